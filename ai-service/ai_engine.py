@@ -1,62 +1,64 @@
-import requests
+import asyncio
 import os
-from datetime import datetime, timedelta
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from analytics import ProductFrame, top_k
+from backend_client import BackendClient
+from forecasting import DemandForecast
+from metrics import stage
+from movers import MoverIndex
+from transaction_store import TransactionStore, days_ago_ms
 
 class AIEngine:
-    def __init__(self, backend_url):
+    def __init__(self, backend_url, client=None):
         self.backend_url = backend_url
+        self.client = client or BackendClient(backend_url)
     
-    def get_headers(self, token):
-        return {"Authorization": f"Bearer {token}"}
-    
-    def fetch_products(self, token):
+    async def fetch_products(self, token):
         """Fetch all products from backend"""
-        try:
-            response = requests.get(
-                f"{self.backend_url}/products",
-                headers=self.get_headers(token)
-            )
-            if response.status_code == 200:
-                return response.json().get('data', [])
-            return []
-        except Exception as e:
-            print(f"Error fetching products: {e}")
-            return []
+        products, _ = await self.client.get_data('products', '/products', token, default=[])
+        return products or []
     
-    def fetch_transactions(self, token, days=30):
+    async def fetch_transactions(self, token, days=30):
         """Fetch recent transactions"""
-        try:
-            start_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
-            response = requests.get(
-                f"{self.backend_url}/transactions?startDate={start_date}",
-                headers=self.get_headers(token)
-            )
-            if response.status_code == 200:
-                return response.json().get('data', [])
-            return []
-        except Exception as e:
-            print(f"Error fetching transactions: {e}")
-            return []
+        start_date = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d')
+        transactions, _ = await self.client.get_data(
+            'transactions', '/transactions', token,
+            params={'startDate': start_date}, default=[]
+        )
+        return transactions or []
     
-    def analyze_query(self, query, token):
+    async def analyze_query(self, query, token):
         """Analyze user query and generate response"""
         query_lower = query.lower()
         
         # Fetch data
-        products = self.fetch_products(token)
-        transactions = self.fetch_transactions(token)
+        products, transactions = await asyncio.gather(
+            self.fetch_products(token),
+            self.fetch_transactions(token)
+        )
+        products = ProductFrame.of(products)
+        transactions = TransactionStore.of(transactions)
         
         # Low stock queries
         if any(word in query_lower for word in ['low stock', 'running out', 'shortage']):
             return self.handle_low_stock(products)
         
+        # Projected stockouts and reorder points
+        if any(word in query_lower for word in ['run out', 'days of cover', 'reorder point', 'at risk']):
+            return self.handle_stockout_risk(products, transactions)
+        
         # Out of stock queries
         if any(word in query_lower for word in ['out of stock', 'no stock']):
             return self.handle_out_of_stock(products)
         
         # Most sold/popular products
         if any(word in query_lower for word in ['most sold', 'popular', 'top selling']):
-            return self.handle_most_sold(transactions)
+            return self.handle_most_sold(products, transactions)
+        
+        # Top products by revenue
+        if any(word in query_lower for word in ['revenue', 'top earning', 'highest earning']):
+            return self.handle_top_revenue(products, transactions)
         
         # Stock value queries
         if any(word in query_lower for word in ['stock value', 'total value', 'inventory value']):
@@ -64,7 +66,7 @@ class AIEngine:
         
         # Category queries
         if 'category' in query_lower or 'categories' in query_lower:
-            return self.handle_category_info(products)
+            return self.handle_category_info(products, transactions)
         
         # Supplier queries
         if 'supplier' in query_lower or 'vendor' in query_lower:
@@ -72,23 +74,46 @@ class AIEngine:
         
         # Fastest moving products
         if any(word in query_lower for word in ['fastest', 'quick', 'moving fast']):
-            return self.handle_fastest_moving(transactions)
+            return self.handle_fastest_moving(products, transactions)
         
         # Default response
         return self.handle_general_stats(products, transactions)
     
+    def handle_intent(self, intent, products, transactions, forecast=None, movers=None):
+        """Answer a classified intent (see router.INTENT_PATTERNS)"""
+        with stage('local'):
+            if intent == 'low_stock':
+                return self.handle_low_stock(products)
+            if intent == 'stockout_risk':
+                return self.handle_stockout_risk(products, transactions, forecast)
+            if intent == 'out_of_stock':
+                return self.handle_out_of_stock(products)
+            if intent == 'most_sold':
+                return self.handle_most_sold(products, transactions, movers)
+            if intent == 'top_revenue':
+                return self.handle_top_revenue(products, transactions, movers)
+            if intent == 'stock_value':
+                return self.handle_stock_value(products)
+            if intent == 'category':
+                return self.handle_category_info(products, transactions, movers)
+            if intent == 'supplier':
+                return self.handle_supplier_info(products, transactions, movers)
+            if intent == 'fastest_moving':
+                return self.handle_fastest_moving(products, transactions, movers)
+            return self.handle_general_stats(products, transactions)
+    
     def handle_low_stock(self, products):
         """Handle low stock queries"""
-        low_stock = [p for p in products if 0 < p['quantity'] <= p['reorderLevel']]
+        frame = ProductFrame.of(products)
+        low_stock = np.flatnonzero(frame.low_stock_mask())
         
-        if not low_stock:
+        if not len(low_stock):
             return {
                 "answer": "Great news! No products are currently at low stock levels. All inventory is well maintained.",
                 "data": []
             }
         
-        low_stock.sort(key=lambda x: x['quantity'])
-        top_5 = low_stock[:5]
+        top_5 = [dict(frame.records[i]) for i in top_k(frame.quantity, 5, low_stock, descending=False)]
         
         answer = f"⚠️ **{len(low_stock)} products** are running low on stock:\n\n"
         for i, product in enumerate(top_5, 1):
@@ -104,43 +129,75 @@ class AIEngine:
     
     def handle_out_of_stock(self, products):
         """Handle out of stock queries"""
-        out_of_stock = [p for p in products if p['quantity'] == 0]
+        frame = ProductFrame.of(products)
+        out_of_stock = np.flatnonzero(frame.out_of_stock_mask())
         
-        if not out_of_stock:
+        if not len(out_of_stock):
             return {
                 "answer": "✅ Excellent! No products are out of stock. Your inventory is fully stocked.",
                 "data": []
             }
         
+        first_5 = [dict(frame.records[i]) for i in out_of_stock[:5]]
+        
         answer = f"❌ **{len(out_of_stock)} products** are currently out of stock:\n\n"
-        for i, product in enumerate(out_of_stock[:5], 1):
+        for i, product in enumerate(first_5, 1):
             answer += f"{i}. **{product['name']}** (SKU: {product['sku']})\n"
             answer += f"   - Supplier: {product['supplier']}\n\n"
         
         answer += "🚨 **Action Required:** Reorder these items immediately!"
         
-        return {"answer": answer, "data": out_of_stock[:5]}
+        return {"answer": answer, "data": first_5}
+    
+    def handle_stockout_risk(self, products, transactions, forecast=None):
+        """Products projected to run out soon, from the demand forecast"""
+        frame = ProductFrame.of(products)
+        forecast = forecast or DemandForecast.of(transactions)
+        projection = forecast.project(frame)
+        at_risk = projection.at_risk()
+        
+        if not len(at_risk):
+            return {
+                "answer": f"✅ No in-stock products are projected to run out in the next {projection.horizon_days} days at current demand.",
+                "data": []
+            }
+        
+        top_5 = [projection.row(i) for i in at_risk[:5]]
+        
+        answer = f"⏳ **{len(at_risk)} products** may run out within {projection.horizon_days} days:\n\n"
+        for i, product in enumerate(top_5, 1):
+            answer += f"{i}. **{product['name']}** (SKU: {product['sku']})\n"
+            answer += f"   - Stock: **{product['quantity']}** | Selling ~{product['daily_demand']:g}/day | "
+            answer += f"Runs out in ~{product['days_of_cover']:g} days ({product['stockout_date']})\n"
+            answer += f"   - Suggested reorder point: {product['reorder_point']}\n\n"
+        
+        if len(at_risk) > 5:
+            answer += f"...and {len(at_risk) - 5} more items.\n\n"
+        
+        answer += f"💡 **Recommendation:** Reorder items at or below their reorder point ({projection.lead_days:g}-day lead time assumed)."
+        
+        return {"answer": answer, "data": top_5}
+    
+    def best_sellers(self, products, transactions, movers, field):
+        """Best-selling product name per category or supplier (empty without sales)"""
+        if movers is None:
+            if transactions is None or not len(transactions):
+                return {}
+            movers = MoverIndex.of(transactions)
+        return {label: top['name'] for label, top in movers.top_by_group(field, frame=products).items()}
     
-    def handle_most_sold(self, transactions):
+    def handle_most_sold(self, products, transactions, movers=None):
         """Handle most sold product queries"""
-        if not transactions:
+        store = TransactionStore.of(transactions)
+        if not len(store):
             return {"answer": "No transaction data available yet.", "data": []}
         
-        # Count OUT transactions per product
-        product_sales = {}
-        for trans in transactions:
-            if trans['type'] == 'OUT' and trans.get('product'):
-                prod_id = trans['product']['_id']
-                prod_name = trans['product']['name']
-                if prod_id not in product_sales:
-                    product_sales[prod_id] = {'name': prod_name, 'quantity': 0}
-                product_sales[prod_id]['quantity'] += trans['quantity']
-        
-        if not product_sales:
-            return {"answer": "No sales recorded yet.", "data": []}
+        # All-time totals are kept by the mover index as transactions arrive
+        movers = movers or MoverIndex.of(store)
+        top_5 = movers.top(5, frame=products)
         
-        sorted_products = sorted(product_sales.values(), key=lambda x: x['quantity'], reverse=True)
-        top_5 = sorted_products[:5]
+        if not top_5:
+            return {"answer": "No sales recorded yet.", "data": []}
         
         answer = f"📈 **Top {len(top_5)} Best-Selling Products:**\n\n"
         for i, product in enumerate(top_5, 1):
@@ -148,89 +205,107 @@ class AIEngine:
         
         return {"answer": answer, "data": top_5}
     
+    def handle_top_revenue(self, products, transactions, movers=None):
+        """Products that brought in the most revenue over the last 30 days"""
+        store = TransactionStore.of(transactions)
+        if not len(store):
+            return {"answer": "No transaction data available yet.", "data": []}
+        
+        movers = movers or MoverIndex.of(store)
+        top_5 = movers.top(5, 30, by='revenue', frame=products)
+        
+        if not top_5:
+            return {"answer": "No sales revenue in the last 30 days.", "data": []}
+        
+        answer = f"💵 **Top {len(top_5)} Products by Revenue (Last 30 Days):**\n\n"
+        for i, product in enumerate(top_5, 1):
+            answer += f"{i}. **{product['name']}** - ₹{product['revenue']:,.2f} from {product['quantity']} units\n"
+        answer += "\n💡 Revenue is estimated at current list prices."
+        
+        return {"answer": answer, "data": top_5}
+    
     def handle_stock_value(self, products):
         """Calculate total stock value"""
-        if not products:
+        frame = ProductFrame.of(products)
+        if not len(frame):
             return {"answer": "No products in inventory.", "data": []}
         
-        total_value = sum(p['price'] * p['quantity'] for p in products)
-        total_items = sum(p['quantity'] for p in products)
+        total_value = float(frame.value.sum())
+        total_items = int(frame.quantity.sum())
         
         answer = f"💰 **Total Inventory Value:** ₹{total_value:,.2f}\n\n"
         answer += f"📦 **Total Items in Stock:** {total_items:,}\n"
-        answer += f"📊 **Total Products:** {len(products)}\n"
-        answer += f"📈 **Average Value per Product:** ₹{total_value/len(products):,.2f}"
+        answer += f"📊 **Total Products:** {len(frame)}\n"
+        answer += f"📈 **Average Value per Product:** ₹{total_value/len(frame):,.2f}"
         
         return {
             "answer": answer,
             "data": {
                 "total_value": total_value,
                 "total_items": total_items,
-                "total_products": len(products)
+                "total_products": len(frame)
             }
         }
     
-    def handle_category_info(self, products):
+    def handle_category_info(self, products, transactions=None, movers=None):
         """Handle category information queries"""
-        categories = {}
-        for product in products:
-            cat = product['category']
-            if cat not in categories:
-                categories[cat] = {'count': 0, 'value': 0}
-            categories[cat]['count'] += 1
-            categories[cat]['value'] += product['price'] * product['quantity']
-        
-        sorted_cats = sorted(categories.items(), key=lambda x: x[1]['count'], reverse=True)
+        frame = ProductFrame.of(products)
+        counts, values = frame.group_totals(frame.category, frame.categories)
+        best = self.best_sellers(frame, transactions, movers, 'category')
+        order = top_k(counts, len(counts))
+        sorted_cats = [
+            (frame.categories[c], {
+                'count': int(counts[c]),
+                'value': float(values[c]),
+                'best_seller': best.get(frame.categories[c]),
+            })
+            for c in order
+        ]
         
         answer = f"📁 **Inventory by Category:**\n\n"
         for cat, data in sorted_cats:
-            answer += f"• **{cat}**: {data['count']} products | Value: ₹{data['value']:,.2f}\n"
+            answer += f"• **{cat}**: {data['count']} products | Value: ₹{data['value']:,.2f}"
+            answer += f" | Best seller: {data['best_seller']}\n" if data['best_seller'] else "\n"
         
         return {"answer": answer, "data": dict(sorted_cats)}
     
-    def handle_supplier_info(self, products, transactions):
+    def handle_supplier_info(self, products, transactions, movers=None):
         """Handle supplier information queries"""
-        suppliers = {}
-        for product in products:
-            sup = product['supplier']
-            if sup not in suppliers:
-                suppliers[sup] = {'products': 0, 'stock_value': 0}
-            suppliers[sup]['products'] += 1
-            suppliers[sup]['stock_value'] += product['price'] * product['quantity']
-        
-        sorted_suppliers = sorted(suppliers.items(), key=lambda x: x[1]['products'], reverse=True)
+        frame = ProductFrame.of(products)
+        counts, values = frame.group_totals(frame.supplier, frame.suppliers)
+        best = self.best_sellers(frame, transactions, movers, 'supplier')
+        order = top_k(counts, len(counts))
+        sorted_suppliers = [
+            (frame.suppliers[s], {
+                'products': int(counts[s]),
+                'stock_value': float(values[s]),
+                'best_seller': best.get(frame.suppliers[s]),
+            })
+            for s in order
+        ]
         
         answer = f"🏢 **Suppliers Overview:**\n\n"
         for i, (supplier, data) in enumerate(sorted_suppliers[:5], 1):
             answer += f"{i}. **{supplier}**\n"
-            answer += f"   - Products: {data['products']} | Value: ₹{data['stock_value']:,.2f}\n\n"
+            answer += f"   - Products: {data['products']} | Value: ₹{data['stock_value']:,.2f}\n"
+            if data['best_seller']:
+                answer += f"   - Best seller: {data['best_seller']}\n"
+            answer += "\n"
         
         return {"answer": answer, "data": dict(sorted_suppliers)}
     
-    def handle_fastest_moving(self, transactions):
+    def handle_fastest_moving(self, products, transactions, movers=None):
         """Identify fastest moving products"""
-        if not transactions:
+        store = TransactionStore.of(transactions)
+        if not len(store):
             return {"answer": "No transaction data available.", "data": []}
         
-        # Recent 7 days OUT transactions
-        recent_date = datetime.now() - timedelta(days=7)
-        product_movement = {}
-        
-        for trans in transactions:
-            if trans['type'] == 'OUT' and trans.get('product'):
-                trans_date = datetime.fromisoformat(trans['transactionDate'].replace('Z', '+00:00'))
-                if trans_date >= recent_date:
-                    prod_id = trans['product']['_id']
-                    prod_name = trans['product']['name']
-                    if prod_id not in product_movement:
-                        product_movement[prod_id] = {'name': prod_name, 'quantity': 0}
-                    product_movement[prod_id]['quantity'] += trans['quantity']
-        
-        if not product_movement:
-            return {"answer": "No recent sales in the last 7 days.", "data": []}
+        # Recent 7 days OUT transactions (sliding window, kept incrementally)
+        movers = movers or MoverIndex.of(store)
+        top_3 = movers.top(3, 7, frame=products)
         
-        sorted_products = sorted(product_movement.values(), key=lambda x: x['quantity'], reverse=True)
-        top_3 = sorted_products[:3]
+        if not top_3:
+            return {"answer": "No recent sales in the last 7 days.", "data": []}
         
         answer = f"🚀 **Fastest Moving Products (Last 7 Days):**\n\n"
         for i, product in enumerate(top_3, 1):
@@ -240,14 +315,14 @@ class AIEngine:
     
     def handle_general_stats(self, products, transactions):
         """Provide general inventory statistics"""
-        total_products = len(products)
-        low_stock = sum(1 for p in products if 0 < p['quantity'] <= p['reorderLevel'])
-        out_of_stock = sum(1 for p in products if p['quantity'] == 0)
-        total_value = sum(p['price'] * p['quantity'] for p in products)
-        
-        recent_trans = len([t for t in transactions if 
-                           datetime.fromisoformat(t['transactionDate'].replace('Z', '+00:00')) >= 
-                           datetime.now() - timedelta(days=7)])
+        frame = ProductFrame.of(products)
+        store = TransactionStore.of(transactions)
+        total_products = len(frame)
+        low_stock = int(frame.low_stock_mask().sum())
+        out_of_stock = int(frame.out_of_stock_mask().sum())
+        total_value = float(frame.value.sum())
+        
+        recent_trans = store.count(days_ago_ms(7))
         
         answer = f"📊 **Inventory Overview:**\n\n"
         answer += f"• **Total Products:** {total_products}\n"
@@ -0,0 +1,127 @@
+import numpy as np
+from datetime import datetime, timezone
+
+
+def parse_epoch_ms(values):
+    """Parse ISO-8601 timestamps into an int64 array of UTC epoch milliseconds.
+
+    Backend dates are UTC with a `Z` suffix, which NumPy parses in one
+    vectorized call; anything else falls back to `datetime.fromisoformat`.
+    Unparseable or missing values become the minimum int64.
+    """
+    missing = np.iinfo(np.int64).min
+    if not values:
+        return np.empty(0, dtype=np.int64)
+    try:
+        stripped = [v[:-1] if v.endswith('Z') else v for v in values]
+        return np.array(stripped, dtype='datetime64[ms]').astype(np.int64)
+    except (TypeError, ValueError, AttributeError):
+        pass
+
+    out = np.empty(len(values), dtype=np.int64)
+    for i, value in enumerate(values):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            out[i] = int(parsed.timestamp() * 1000)
+        except (TypeError, ValueError, AttributeError):
+            out[i] = missing
+    return out
+
+
+def encode(values):
+    """Categorical-encode values in first-appearance order: `(codes, labels)`"""
+    lookup = {}
+    codes = np.fromiter(
+        (lookup.setdefault(v, len(lookup)) for v in values),
+        dtype=np.int32, count=len(values)
+    )
+    return codes, list(lookup)
+
+
+def top_k(values, k, candidates=None, descending=True):
+    """Indices of the `k` best `values`, ties broken by lower index.
+
+    Uses argpartition to find the cut-off so only the candidates at or
+    above it are sorted.
+    """
+    idx = np.arange(len(values)) if candidates is None else candidates
+    if len(idx) == 0:
+        return idx
+    v = values[idx]
+    key = -v if descending else v
+    if len(idx) > k:
+        kth = np.partition(key, k - 1)[k - 1]
+        keep = key <= kth
+        idx, key = idx[keep], key[keep]
+    order = np.lexsort((idx, key))
+    return idx[order[:k]]
+
+
+class ProductFrame:
+    """Columnar view of a product list.
+
+    Numeric fields are NumPy arrays and category / supplier are integer
+    codes, so handler queries become vectorized masks and `bincount`
+    reductions. `records` keeps the source dicts for response payloads.
+    """
+
+    COLUMNS = ('quantity', 'price', 'reorder_level', 'category', 'supplier', 'value')
+
+    def __init__(self, products):
+        self.records = list(products)
+        n = len(self.records)
+        self.quantity = np.fromiter((p.get('quantity', 0) or 0 for p in self.records), dtype=np.int64, count=n)
+        self.price = np.fromiter((p.get('price', 0) or 0 for p in self.records), dtype=np.float64, count=n)
+        self.reorder_level = np.fromiter((p.get('reorderLevel', 0) or 0 for p in self.records), dtype=np.int64, count=n)
+        self.category, self.categories = encode([p.get('category', 'Other') for p in self.records])
+        self.supplier, self.suppliers = encode([p.get('supplier') for p in self.records])
+        self.value = self.price * self.quantity
+        self.ids = None
+
+    @classmethod
+    def of(cls, products):
+        return products if isinstance(products, cls) else cls(products)
+
+    @classmethod
+    def from_columns(cls, records, categories, suppliers, ids=None, **columns):
+        """Frame over existing `COLUMNS` arrays (e.g. views of a shared snapshot), without copying"""
+        frame = cls.__new__(cls)
+        frame.records = records
+        frame.categories = categories
+        frame.suppliers = suppliers
+        frame.ids = ids
+        for name in cls.COLUMNS:
+            setattr(frame, name, columns[name])
+        return frame
+
+    @classmethod
+    def attach(cls, replica):
+        """Frame for the replica's current version, rebuilt once per version"""
+        cached = replica.derived.get('product_frame')
+        if cached is None or cached[0] != replica.version:
+            cached = (replica.version, cls(replica.snapshot_data()['products']))
+            replica.derived['product_frame'] = cached
+        return cached[1]
+
+    def __len__(self):
+        return len(self.records)
+
+    def product_ids(self):
+        """Product `_id` of each row"""
+        if self.ids is None:
+            self.ids = [p.get('_id') for p in self.records]
+        return self.ids
+
+    def low_stock_mask(self):
+        return (self.quantity > 0) & (self.quantity <= self.reorder_level)
+
+    def out_of_stock_mask(self):
+        return self.quantity == 0
+
+    def group_totals(self, codes, labels):
+        """Per-group `(counts, values)` arrays aligned with `labels`"""
+        counts = np.bincount(codes, minlength=len(labels))
+        values = np.bincount(codes, weights=self.value, minlength=len(labels))
+        return counts, values
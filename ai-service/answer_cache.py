@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+
+
+# Phrasings folded onto one canonical form before keying. Applied in
+# order, longest phrases first, after case and punctuation are folded.
+SYNONYMS = [
+    (r"\bwhat's\b|\bwhats\b", 'what is'),
+    (r'\b(?:top|best)[ -]?sell(?:ing|ers?)\b|\bmost sold\b|\bmost popular\b', 'best selling'),
+    (r'\b(?:total|inventory|stock) (?:value|worth)\b|\bvaluation\b', 'stock value'),
+    (r'\blow on stock\b|\brunning low\b|\brunning out\b', 'low stock'),
+    (r'\bsold out\b|\bno stock\b', 'out of stock'),
+    (r'\bvendors?\b', 'suppliers'),
+    (r'\bsupplier\b', 'suppliers'),
+    (r'\bcategory\b', 'categories'),
+    (r'\bitems\b|\bproduct\b', 'products'),
+    (r'\bplease\b|\bkindly\b|\bcan you\b|\bcould you\b|\bshow me\b|\btell me\b', ' '),
+]
+SYNONYM_PATTERNS = [(re.compile(pattern), replacement) for pattern, replacement in SYNONYMS]
+PUNCTUATION_RE = re.compile(r"[^\w\s']+")
+
+
+def normalize_question(text):
+    """Fold case, punctuation, whitespace and common synonyms"""
+    text = PUNCTUATION_RE.sub(' ', text.lower())
+    for pattern, replacement in SYNONYM_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return ' '.join(text.split())
+
+
+class AnswerCache:
+    """Bounded LRU/TTL cache of answers keyed by question and snapshot version.
+
+    Keys combine the tenant, the normalized question, a digest of the last
+    few history messages and the inventory snapshot version, so any data
+    change makes older answers unreachable; they are also purged as soon as
+    a newer version is seen for the tenant. Entries past their TTL but
+    within the stale window are still served while one background task
+    recomputes them (stale-while-revalidate).
+    """
+
+    def __init__(self, max_entries=None, ttl=None, stale_ttl=None, history_turns=None):
+        self.max_entries = max_entries or int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+        self.ttl = ttl if ttl is not None else float(os.getenv("ANSWER_CACHE_TTL", 300))
+        self.stale_ttl = stale_ttl if stale_ttl is not None else float(os.getenv("ANSWER_CACHE_STALE", 60))
+        self.history_turns = history_turns if history_turns is not None else int(os.getenv("ANSWER_CACHE_HISTORY", 2))
+        self.entries = OrderedDict()
+        self.latest_versions = {}
+        self.refreshing = {}
+        self.counters = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def key(self, tenant, message, conversation_history, version):
+        """Cache key, or None when the snapshot version is unknown"""
+        if version is None:
+            return None
+        tail = (conversation_history or [])[-self.history_turns:] if self.history_turns else []
+        digest = hashlib.sha1('\x1e'.join(
+            f"{m.get('role')}\x1f{normalize_question(m.get('content', ''))}" for m in tail
+        ).encode()).hexdigest()
+        return (tenant, version, normalize_question(message), digest)
+
+    def _purge_older(self, tenant, version):
+        latest = self.latest_versions.get(tenant)
+        if latest is not None and latest >= version:
+            return
+        self.latest_versions[tenant] = version
+        if latest is None:
+            return
+        stale = [k for k in self.entries if k[0] == tenant and k[1] < version]
+        for k in stale:
+            del self.entries[k]
+        self.counters['invalidations'] += len(stale)
+
+    def get(self, key):
+        """Return `(result, fresh)`; `result` is None on a miss"""
+        if key is None:
+            return None, False
+        self._purge_older(key[0], key[1])
+        entry = self.entries.get(key)
+        if entry is None:
+            self.counters['misses'] += 1
+            return None, False
+        result, stored_at = entry
+        age = time.monotonic() - stored_at
+        if age >= self.ttl + self.stale_ttl:
+            del self.entries[key]
+            self.counters['misses'] += 1
+            return None, False
+        self.entries.move_to_end(key)
+        if age >= self.ttl:
+            self.counters['stale_hits'] += 1
+            return result, False
+        self.counters['hits'] += 1
+        return result, True
+
+    def put(self, key, result):
+        if key is None:
+            return
+        self._purge_older(key[0], key[1])
+        if key[1] < self.latest_versions.get(key[0], key[1]):
+            return
+        self.entries[key] = (result, time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def revalidate(self, key, compute):
+        """Recompute a stale entry in the background, at most once at a time"""
+        if key is None or key in self.refreshing:
+            return
+
+        async def refresh():
+            try:
+                result = await compute()
+                if result.get('model') != 'fallback':
+                    self.put(key, result)
+            except Exception as e:
+                print(f"Error revalidating cached answer: {e}")
+            finally:
+                self.refreshing.pop(key, None)
+
+        self.refreshing[key] = asyncio.create_task(refresh())
+
+    def invalidate(self, tenant=None):
+        """Drop cached answers for one tenant, or all of them"""
+        keys = [k for k in self.entries if tenant is None or k[0] == tenant]
+        for k in keys:
+            del self.entries[k]
+        self.counters['invalidations'] += len(keys)
+        return len(keys)
+
+    def stats(self):
+        lookups = self.counters['hits'] + self.counters['stale_hits'] + self.counters['misses']
+        return {
+            **self.counters,
+            'hit_ratio': round((self.counters['hits'] + self.counters['stale_hits']) / lookups, 4) if lookups else 0.0,
+            'entries': len(self.entries),
+            'ttl': self.ttl,
+            'stale_ttl': self.stale_ttl,
+        }
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import os
+import httpx
+from metrics import payload_bytes, stage
+from records import DEFAULT_DECODERS, decode_records
+
+
+# Per-endpoint timeouts (seconds). The dashboard is a cheap aggregate, so it
+# gets a tighter budget than the full collections.
+DEFAULT_TIMEOUTS = {
+    'products': float(os.getenv("BACKEND_TIMEOUT_PRODUCTS", 10)),
+    'dashboard': float(os.getenv("BACKEND_TIMEOUT_DASHBOARD", 5)),
+    'transactions': float(os.getenv("BACKEND_TIMEOUT_TRANSACTIONS", 10)),
+}
+
+# Statuses meaning the backend rejected the token (expired, invalid or the
+# user deactivated), as opposed to the backend being unavailable
+AUTH_REJECTED = (401, 403)
+
+
+def is_transient(status):
+    """True for failures worth serving stale data through: network errors
+    and timeouts (no status) or backend 5xx"""
+    return status is None or status >= 500
+
+
+class BackendClient:
+    """Async client for the Node backend with a shared keep-alive connection pool"""
+
+    def __init__(self, backend_url, timeouts=None, max_connections=None, decoders=None):
+        self.backend_url = backend_url.rstrip('/')
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        # Endpoints whose `data` arrays are stream-decoded into compact records
+        self.decoders = DEFAULT_DECODERS if decoders is None else decoders
+        self.max_connections = max_connections or int(os.getenv("BACKEND_MAX_CONNECTIONS", 20))
+        self._client = None
+
+    @property
+    def client(self):
+        # Created lazily so the pool is bound to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.backend_url,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        return self._client
+
+    def get_headers(self, token):
+        return {"Authorization": f"Bearer {token}"}
+
+    async def get(self, name, path, token, params=None, headers=None):
+        """GET a backend path, returning the raw response (raises on network errors)"""
+        return await self.client.get(
+            path,
+            params=params,
+            headers={**self.get_headers(token), **(headers or {})},
+            timeout=self.timeouts.get(name, 10)
+        )
+
+    def stream(self, name, path, token, params=None, headers=None):
+        """Open a streamed GET of a backend path (use with `async with`)"""
+        return self.client.stream(
+            'GET', path,
+            params=params,
+            headers={**self.get_headers(token), **(headers or {})},
+            timeout=self.timeouts.get(name, 10)
+        )
+
+    async def read_data(self, name, response, default=None):
+        """Unwrap the `data` field of a streamed response. Returns `(data, size)`.
+
+        Endpoints with a decoder are decoded element by element into
+        compact records as the body arrives; others are parsed whole.
+        """
+        decode = self.decoders.get(name)
+        if decode is not None:
+            data, size = await decode_records(response.aiter_bytes(), decode, default)
+        else:
+            body = await response.aread()
+            data, size = json.loads(body).get('data', default), len(body)
+        payload_bytes.observe(size, name)
+        return data, size
+
+    async def get_data(self, name, path, token, params=None, default=None):
+        """GET a backend path and unwrap its `data` field.
+
+        Returns `(data, error)`; on any failure `data` is `default` and `error`
+        describes what went wrong, so callers can degrade per endpoint.
+        """
+        try:
+            with stage(f'backend_{name}'):
+                async with self.stream(name, path, token, params=params) as response:
+                    if response.status_code == 200:
+                        data, _ = await self.read_data(name, response, default)
+                        return data, None
+                    return default, f"HTTP {response.status_code}"
+        except Exception as e:
+            print(f"Error fetching {name}: {e}")
+            return default, str(e) or type(e).__name__
+
+    async def fetch_many(self, token, endpoints):
+        """Fetch several endpoints concurrently.
+
+        `endpoints` maps a name to `(path, params, default)`. Returns
+        `(results, errors)` keyed by name; one failing endpoint does not
+        affect the others.
+        """
+        names = list(endpoints)
+        outcomes = await asyncio.gather(*[
+            self.get_data(name, path, token, params=params, default=default)
+            for name, (path, params, default) in endpoints.items()
+        ])
+
+        results, errors = {}, {}
+        for name, (data, error) in zip(names, outcomes):
+            results[name] = data
+            if error:
+                errors[name] = error
+        return results, errors
+
+    async def get_conditional(self, name, path, token, params=None, validators=None, default=None):
+        """GET a backend path, revalidating against previously seen validators.
+
+        Sends If-None-Match / If-Modified-Since when `validators` carries an
+        ETag / Last-Modified. Returns a dict with `status` ('ok',
+        'not_modified' or 'error'), `data`, fresh `validators`, `size` in
+        bytes, `error` and the HTTP `status_code` (None on network errors).
+        """
+        headers = {}
+        status_code = None
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        try:
+            with stage(f'backend_{name}'):
+                async with self.stream(name, path, token, params=params, headers=headers) as response:
+                    status_code = response.status_code
+                    if status_code == 304:
+                        return {
+                            'status': 'not_modified', 'data': None, 'validators': validators,
+                            'size': 0, 'error': None, 'status_code': status_code
+                        }
+                    if status_code == 200:
+                        data, size = await self.read_data(name, response, default)
+                        return {
+                            'status': 'ok',
+                            'data': data,
+                            'validators': {
+                                'etag': response.headers.get('etag'),
+                                'last_modified': response.headers.get('last-modified')
+                            },
+                            'size': size,
+                            'error': None,
+                            'status_code': status_code
+                        }
+                    error = f"HTTP {status_code}"
+        except Exception as e:
+            print(f"Error fetching {name}: {e}")
+            error = str(e) or type(e).__name__
+        return {
+            'status': 'error', 'data': default, 'validators': None,
+            'size': 0, 'error': error, 'status_code': status_code
+        }
+
+    async def revalidate_many(self, token, endpoints, validators=None):
+        """Conditionally fetch several endpoints concurrently.
+
+        `endpoints` is shaped as for `fetch_many`; `validators` maps a name
+        to the validators from its previous response. Returns a dict of
+        `get_conditional` results keyed by name.
+        """
+        validators = validators or {}
+        names = list(endpoints)
+        outcomes = await asyncio.gather(*[
+            self.get_conditional(
+                name, path, token, params=params,
+                validators=validators.get(name), default=default
+            )
+            for name, (path, params, default) in endpoints.items()
+        ])
+        return dict(zip(names, outcomes))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1 @@
+"""Reproducible benchmarks for the AI service (see benchmarks/run.py)"""
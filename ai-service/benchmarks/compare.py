@@ -0,0 +1,51 @@
+"""Compare two benchmark result files: `python -m benchmarks.compare BASE.json NEW.json`"""
+import json
+import sys
+
+
+# Metrics where a lower value is better; rps is reported the other way round
+LOAD_METRICS = ('p50', 'p95', 'p99', 'mean')
+
+
+STARTUP_METRICS = ('import_main', 'first_health', 'first_ready')
+
+
+def rows(base, new):
+    if 'startup' in base and 'startup' in new:
+        for metric in STARTUP_METRICS:
+            yield 'startup', metric, base['startup'][metric]['median_ms'], new['startup'][metric]['median_ms']
+    for size, entry in new['sizes'].items():
+        before = base['sizes'].get(size)
+        if before is None:
+            continue
+        for name, timing in entry.get('micro', {}).items():
+            if name in before.get('micro', {}):
+                yield size, name, before['micro'][name]['median_ms'], timing['median_ms']
+        if 'load' in entry and 'load' in before:
+            for metric in LOAD_METRICS:
+                old, value = before['load']['latency_ms'].get(metric), entry['load']['latency_ms'].get(metric)
+                if old is not None and value is not None:
+                    yield size, f'/chat {metric}', old, value
+            yield size, '/chat rps', before['load']['rps'], entry['load']['rps']
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print(__doc__)
+        return 2
+    with open(argv[0]) as f:
+        base = json.load(f)
+    with open(argv[1]) as f:
+        new = json.load(f)
+
+    print(f"base {base['meta'].get('commit')} -> new {new['meta'].get('commit')}")
+    print(f"{'size':>8}  {'benchmark':<45} {'base':>12} {'new':>12} {'change':>8}")
+    for size, name, old, value in rows(base, new):
+        change = f"{(value - old) / old * 100:+.1f}%" if old else 'n/a'
+        print(f"{size:>8}  {name:<45} {old:>12.4f} {value:>12.4f} {change:>8}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
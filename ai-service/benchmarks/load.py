@@ -0,0 +1,118 @@
+"""End-to-end load test of POST /chat.
+
+By default the service runs in-process (ASGI) against the stub backend
+and the stub model, so results depend only on this code and the machine.
+With `url`, requests go over HTTP to a separately started service.
+"""
+import asyncio
+import random
+import statistics
+import time
+import httpx
+import numpy as np
+
+
+LOCAL_QUESTIONS = [
+    'show low stock items',
+    'what is out of stock',
+    'total stock value',
+    'list categories',
+    'top selling products',
+    'show suppliers',
+    'fastest moving items',
+]
+
+
+def questions(dataset, count, local_share, seed=0):
+    """Mix of locally answered questions and unique model-bound ones"""
+    rng = random.Random(seed)
+    names = dataset.product_names(count, seed) or ['stock']
+    return [
+        rng.choice(LOCAL_QUESTIONS) if rng.random() < local_share
+        else f"Why is {names[i]} selling slowly compared with last month? ({i})"
+        for i in range(count)
+    ]
+
+
+def parse_server_timing(header):
+    stages = {}
+    for entry in (header or '').split(','):
+        name, _, duration = entry.strip().partition(';dur=')
+        if name and duration:
+            stages[name] = float(duration)
+    return stages
+
+
+def percentiles(latencies):
+    values = np.asarray(latencies) * 1000
+    if not len(values):
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'p50': round(float(p50), 3),
+        'p95': round(float(p95), 3),
+        'p99': round(float(p99), 3),
+        'mean': round(float(values.mean()), 3),
+        'max': round(float(values.max()), 3),
+    }
+
+
+async def run_load(client, dataset, requests=200, concurrency=16, local_share=0.5, token='bench', warmup=5):
+    """Send `requests` chats from `concurrency` closed-loop clients"""
+    pending = iter(questions(dataset, requests, local_share))
+    latencies, stages = [], {}
+    statuses, routes = {}, {}
+
+    for question in questions(dataset, warmup, local_share, seed=1):
+        await client.post('/chat', json={'message': question, 'token': token})
+
+    async def worker():
+        for question in pending:
+            started = time.perf_counter()
+            try:
+                response = await client.post('/chat', json={'message': question, 'token': token})
+                status = response.status_code
+            except httpx.HTTPError as e:
+                response, status = None, type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+            if response is None or status != 200:
+                continue
+            route = response.json().get('route') or 'unknown'
+            routes[route] = routes.get(route, 0) + 1
+            for name, ms in parse_server_timing(response.headers.get('server-timing')).items():
+                stages.setdefault(name, []).append(ms)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'local_share': local_share,
+        'errors': sum(n for status, n in statuses.items() if status != 200),
+        'status': {str(status): n for status, n in statuses.items()},
+        'routes': routes,
+        'seconds': round(elapsed, 3),
+        'rps': round(requests / elapsed, 2) if elapsed else None,
+        'latency_ms': percentiles(latencies),
+        'stages_ms': {name: round(statistics.fmean(values), 3) for name, values in sorted(stages.items())},
+    }
+
+
+def service_client(url=None, timeout=120):
+    """HTTP client for the service under test: the in-process app unless `url` is given"""
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=timeout)
+    import main
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url='http://ai-service', timeout=timeout)
+
+
+def use_stub_backend(stub):
+    """Point the in-process service's backend client at `stub` with a clean snapshot cache"""
+    import main
+    main.snapshot_cache.invalidate(None, drop=True)
+    main.backend_client._client = httpx.AsyncClient(
+        base_url=main.BACKEND_URL, transport=httpx.ASGITransport(app=stub)
+    )
@@ -0,0 +1,98 @@
+"""Micro-benchmarks of the per-request hot spots on one synthetic snapshot"""
+import inspect
+import statistics
+import timeit
+import httpx
+from ai_engine import AIEngine
+from analytics import ProductFrame
+from backend_client import BackendClient
+from forecasting import DemandForecast
+from gemini_engine import GeminiAIEngine
+from llm_providers import StubProvider
+from movers import MoverIndex
+from snapshot_cache import SnapshotCache
+from transaction_store import TransactionStore
+from benchmarks.stub_backend import StubBackend
+
+
+BACKEND_URL = 'http://stub-backend/api'
+TOKEN = 'bench'
+
+
+def measure(func, repeat=5, min_time=0.2):
+    """Per-call timings of `func()` in milliseconds over `repeat` timed runs"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    runs = [seconds / number * 1000 for seconds in timer.repeat(repeat=repeat, number=number)]
+    return {
+        'min_ms': round(min(runs), 6),
+        'median_ms': round(statistics.median(runs), 6),
+        'mean_ms': round(statistics.fmean(runs), 6),
+        'calls': number * repeat,
+    }
+
+
+def stub_client(dataset):
+    """Backend client wired in-process to a stub backend serving `dataset`"""
+    client = BackendClient(BACKEND_URL)
+    client._client = httpx.AsyncClient(base_url=BACKEND_URL, transport=httpx.ASGITransport(app=StubBackend(dataset)))
+    return client
+
+
+async def load_snapshot(dataset):
+    """Seed a snapshot through the real fetch/decode path. Returns `(engine, local, data)`."""
+    client = stub_client(dataset)
+    engine = GeminiAIEngine(BACKEND_URL, client=client, provider=StubProvider(), snapshots=SnapshotCache(client))
+    data = await engine.fetch_inventory_data(TOKEN)
+    await client.aclose()
+    return engine, AIEngine(BACKEND_URL, client=client), data
+
+
+def handlers(local):
+    """Every `AIEngine.handle_*` answer handler with its parameter names"""
+    return {
+        name: list(inspect.signature(method).parameters)
+        for name, method in inspect.getmembers(local, inspect.ismethod)
+        if name.startswith('handle_') and name != 'handle_intent'
+    }
+
+
+async def run_micro(dataset, repeat=5, min_time=0.2):
+    engine, local, data = await load_snapshot(dataset)
+    query = f"Why is {dataset.product_names(1)[0] if dataset.products else 'stock'} selling slowly?"
+    # Without the replica's incremental builder the context is rendered from scratch
+    cold = {'products': list(data['products']), 'transactions': list(data['transactions'])}
+
+    cases = {
+        'format_inventory_context/incremental': lambda: engine.format_inventory_context(data),
+        'format_inventory_context/incremental_query': lambda: engine.format_inventory_context(data, query=query),
+        'format_inventory_context/cold_query': lambda: engine.format_inventory_context(cold, query=query),
+    }
+
+    lines = data['transactions'][:1000]
+    if lines:
+        cases['format_transaction_line'] = lambda: [engine.format_transaction_line(t) for t in lines]
+
+    arguments = {
+        'products': ProductFrame.attach(data['replica']),
+        'transactions': TransactionStore.attach(data['replica']),
+        'forecast': DemandForecast.attach(data['replica']),
+        'movers': MoverIndex.attach(data['replica']),
+    }
+    # Folding the whole history into a fresh forecast, as on first use of a snapshot
+    cases['DemandForecast/full_history'] = lambda: DemandForecast(arguments['transactions']).project(arguments['products'])
+    cases['MoverIndex/full_history'] = lambda: MoverIndex(arguments['transactions']).update(arguments['products'])
+    for name, params in sorted(handlers(local).items()):
+        args = [arguments[param] for param in params]
+        cases[f'AIEngine.{name}'] = lambda method=getattr(local, name), args=args: method(*args)
+
+    results = {}
+    for name, func in cases.items():
+        results[name] = measure(func, repeat, min_time)
+        if name == 'format_transaction_line':
+            # Reported per line
+            for key in ('min_ms', 'median_ms', 'mean_ms'):
+                results[name][key] = round(results[name][key] / len(lines), 6)
+            results[name]['calls'] *= len(lines)
+    return results
@@ -0,0 +1,146 @@
+"""Run the benchmark suite and save the results as JSON.
+
+    cd ai-service
+    python -m benchmarks.run --sizes 1000,10000,100000
+    python -m benchmarks.run --suite load --requests 500 --concurrency 32
+    python -m benchmarks.run --suite startup
+    python -m benchmarks.compare benchmarks/results/A.json benchmarks/results/B.json
+
+Each size is a synthetic inventory of that many products (and as many
+transactions unless `--transactions-ratio` says otherwise). The service
+runs in-process against a stub backend and the stub model, whose latency
+is set with `--llm-first-token` / `--llm-token-delay`. The startup suite
+times fresh service processes to their first /health and /ready answers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(__file__)
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the AI service on synthetic inventories')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='comma-separated product counts (up to 1000000)')
+    parser.add_argument('--transactions-ratio', type=float, default=1.0, help='transactions per product')
+    parser.add_argument('--suite', choices=('all', 'micro', 'load', 'startup'), default='all')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per micro-benchmark')
+    parser.add_argument('--requests', type=int, default=200, help='chat requests per load test')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients in the load test')
+    parser.add_argument('--local-share', type=float, default=0.5, help='share of locally answered questions')
+    parser.add_argument('--llm-first-token', type=float, default=0.2, help='stub model seconds to first token')
+    parser.add_argument('--llm-token-delay', type=float, default=0.01, help='stub model seconds per further token')
+    parser.add_argument('--backend-latency', type=float, default=0.0, help='stub backend seconds per response')
+    parser.add_argument('--startup-runs', type=int, default=5, help='service processes started by the startup suite')
+    parser.add_argument('--url', default=None, help='load-test a running service instead of the in-process app')
+    parser.add_argument('--output', default=None, help='results file (default: results/<time>-<commit>.json)')
+    return parser.parse_args(argv)
+
+
+def configure(args):
+    """Service settings for an in-process run; must precede importing `main`"""
+    os.environ['LLM_PROVIDER'] = 'stub'
+    os.environ['STUB_FIRST_TOKEN_DELAY'] = str(args.llm_first_token)
+    os.environ['STUB_TOKEN_DELAY'] = str(args.llm_token_delay)
+    # Keep the largest snapshots cached for the whole run
+    os.environ.setdefault('SNAPSHOT_MAX_BYTES', str(16 * 1024 ** 3))
+    os.environ.setdefault('SNAPSHOT_TTL', '3600')
+
+
+async def run(args):
+    from benchmarks.load import run_load, service_client, use_stub_backend
+    from benchmarks.micro import run_micro
+    from benchmarks.stub_backend import StubBackend
+    from benchmarks.synthetic import Dataset
+
+    results = {}
+    if args.suite == 'startup':
+        return results
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        started = time.perf_counter()
+        dataset = Dataset(size, int(size * args.transactions_ratio), seed=args.seed)
+        entry = {'dataset': dataset.describe(), 'generate_s': round(time.perf_counter() - started, 3)}
+        print(f"[{size}] generated {entry['dataset']} in {entry['generate_s']}s", file=sys.stderr)
+
+        if args.suite in ('all', 'micro'):
+            entry['micro'] = await run_micro(dataset, repeat=args.repeat)
+            for name, timing in entry['micro'].items():
+                print(f"[{size}] {name}: {timing['median_ms']:.4f} ms", file=sys.stderr)
+
+        if args.suite in ('all', 'load'):
+            if not args.url:
+                use_stub_backend(StubBackend(dataset, args.backend_latency))
+            async with service_client(args.url) as client:
+                entry['load'] = await run_load(
+                    client, dataset, requests=args.requests, concurrency=args.concurrency,
+                    local_share=args.local_share, token=f'bench-{size}'
+                )
+            load = entry['load']
+            print(
+                f"[{size}] /chat: {load['rps']} rps, p50 {load['latency_ms'].get('p50')} ms, "
+                f"p95 {load['latency_ms'].get('p95')} ms, p99 {load['latency_ms'].get('p99')} ms, "
+                f"errors {load['errors']}",
+                file=sys.stderr
+            )
+        results[str(size)] = entry
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    startup = None
+    if args.suite in ('all', 'startup'):
+        # Before configure(), which points this process's environment at the stub model
+        from benchmarks.startup import run_startup
+        startup = run_startup(args.startup_runs)
+        print(
+            f"startup: import {startup['import_main']['median_ms']} ms, "
+            f"/health {startup['first_health']['median_ms']} ms, /ready {startup['first_ready']['median_ms']} ms",
+            file=sys.stderr
+        )
+    if not args.url:
+        configure(args)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'sizes': asyncio.run(run(args)),
+    }
+    if startup is not None:
+        results['startup'] = startup
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{results['meta']['commit'] or 'unknown'}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
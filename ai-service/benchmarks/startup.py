@@ -0,0 +1,102 @@
+"""Cold start: time from launching the service process to its first responses.
+
+    python -m benchmarks.startup --runs 5
+
+Each run starts `uvicorn main:app` in a fresh process and polls /health
+(liveness, first response) and /ready (model client loaded) until they
+answer 200. The stub model is used unless `--provider gemini` is given;
+Gemini's client needs only an API key to load, not a network call.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import httpx
+
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(client, path, started, timeout):
+    """Seconds from `started` until GET `path` answers 200"""
+    while time.perf_counter() - started < timeout:
+        try:
+            if client.get(path).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(f"{path} not ready after {timeout}s")
+
+
+def measure_import(env):
+    """Seconds to import `main` in a fresh interpreter"""
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    result = subprocess.run(
+        [sys.executable, '-c', code], cwd=SERVICE_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure_start(env, timeout=60):
+    """Seconds from spawning the server to the first /health and /ready 200s"""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(base_url=f'http://127.0.0.1:{port}', timeout=5) as client:
+            health = wait_for(client, '/health', started, timeout)
+            ready = wait_for(client, '/ready', started, timeout)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return health, ready
+
+
+def run_startup(runs=5, provider='stub'):
+    env = {**os.environ, 'LLM_PROVIDER': provider, 'AI_WORKERS': '1'}
+    env.setdefault('GEMINI_API_KEY', 'benchmark')
+    env.pop('WARMUP_TOKEN', None)
+    imports, health, ready = [], [], []
+    for _ in range(runs):
+        imports.append(measure_import(env))
+        first, warm = measure_start(env)
+        health.append(first)
+        ready.append(warm)
+
+    def summary(values):
+        ms = [v * 1000 for v in values]
+        return {'median_ms': round(statistics.median(ms), 3), 'min_ms': round(min(ms), 3), 'max_ms': round(max(ms), 3)}
+
+    return {
+        'runs': runs,
+        'provider': provider,
+        'import_main': summary(imports),
+        'first_health': summary(health),
+        'first_ready': summary(ready),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure AI service cold start')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--provider', choices=('stub', 'gemini'), default='stub')
+    args = parser.parse_args(argv)
+    print(json.dumps(run_startup(args.runs, args.provider), indent=2))
+
+
+if __name__ == '__main__':
+    main()
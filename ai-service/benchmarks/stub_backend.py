@@ -0,0 +1,98 @@
+"""Stand-in for the Node backend's read endpoints, serving a synthetic dataset.
+
+Serves `/api/products` (with `updatedSince`), `/api/dashboard` (with ETag
+revalidation) and `/api/transactions` (with `startDate`) in the backend's
+`{success, count, data}` envelope. Full responses are encoded once, so the
+stub costs next to nothing compared with the service being measured.
+
+Run standalone to benchmark a separately started ai-service:
+
+    python -m benchmarks.stub_backend --size 10000 --port 5055
+    NODE_BACKEND_URL=http://localhost:5055/api LLM_PROVIDER=stub python main.py
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+from urllib.parse import parse_qs
+
+
+def envelope(data):
+    body = {'success': True, 'data': data}
+    if isinstance(data, list):
+        body['count'] = len(data)
+    return json.dumps(body, separators=(',', ':')).encode()
+
+
+class StubBackend:
+    """ASGI app serving `dataset`; `latency` seconds are added to every response"""
+
+    def __init__(self, dataset, latency=0.0):
+        self.dataset = dataset
+        self.latency = latency
+        self.bodies = {
+            'products': envelope(dataset.products),
+            'dashboard': envelope(dataset.dashboard),
+            'transactions': envelope(dataset.transactions),
+        }
+        self.dashboard_etag = '"%s"' % hashlib.sha1(self.bodies['dashboard']).hexdigest()
+        self.requests = {'products': 0, 'dashboard': 0, 'transactions': 0, 'not_modified': 0}
+
+    def respond(self, name, query, headers):
+        if name == 'products' and 'updatedSince' in query:
+            since = query['updatedSince'][0]
+            changed = [p for p in self.dataset.products if p['updatedAt'] >= since]
+            changed.sort(key=lambda p: p['updatedAt'])
+            return 200, envelope(changed), []
+        if name == 'transactions' and 'startDate' in query:
+            start = query['startDate'][0]
+            return 200, envelope([t for t in self.dataset.transactions if t['transactionDate'] >= start]), []
+        if name == 'dashboard':
+            if headers.get(b'if-none-match', b'').decode() == self.dashboard_etag:
+                self.requests['not_modified'] += 1
+                return 304, b'', [(b'etag', self.dashboard_etag.encode())]
+            return 200, self.bodies[name], [(b'etag', self.dashboard_etag.encode())]
+        return 200, self.bodies[name], []
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        name = scope['path'].rstrip('/').rsplit('/', 1)[-1]
+        if name not in self.bodies:
+            status, body, extra = 404, b'{"success":false,"message":"Not found"}', []
+        else:
+            self.requests[name] += 1
+            status, body, extra = self.respond(
+                name, parse_qs(scope.get('query_string', b'').decode()), dict(scope.get('headers', []))
+            )
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()), *extra],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+def main():
+    from benchmarks.synthetic import Dataset
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=10000, help='number of products')
+    parser.add_argument('--transactions', type=int, default=None, help='number of transactions (default: size)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    dataset = Dataset(args.size, args.transactions, seed=args.seed)
+    print(f"Generated {dataset.describe()} in {time.perf_counter() - started:.1f}s")
+    uvicorn.run(StubBackend(dataset, args.latency), host='127.0.0.1', port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import random
+from datetime import datetime, timezone
+from transaction_store import DAY_MS
+
+
+CATEGORIES = [
+    'Electronics', 'Groceries', 'Beverages', 'Stationery', 'Hardware', 'Clothing',
+    'Pharmacy', 'Toys', 'Furniture', 'Cleaning', 'Cosmetics', 'Automotive',
+]
+SUPPLIERS = [f'Supplier {name}' for name in (
+    'Alpha', 'Bravo', 'Cobalt', 'Delta', 'Everest', 'Falcon', 'Granite', 'Harbor',
+    'Indigo', 'Juniper', 'Keystone', 'Lotus', 'Meridian', 'Nimbus', 'Orion', 'Pioneer',
+)]
+ADJECTIVES = ['Classic', 'Premium', 'Compact', 'Organic', 'Heavy Duty', 'Wireless', 'Mini', 'Deluxe', 'Eco', 'Pro']
+NOUNS = ['Widget', 'Charger', 'Notebook', 'Bottle', 'Drill', 'Shirt', 'Lamp', 'Cable', 'Soap', 'Chair', 'Tea', 'Filter']
+USERS = [
+    {'_id': '64b000000000000000000001', 'name': 'Bench Admin', 'email': 'admin@bench.local'},
+    {'_id': '64b000000000000000000002', 'name': 'Bench Clerk', 'email': 'clerk@bench.local'},
+]
+
+
+def object_id(rng):
+    return '%024x' % rng.getrandbits(96)
+
+
+def iso(ms):
+    """Epoch milliseconds as the backend's JSON date (`2024-01-31T12:00:00.000Z`)"""
+    dt = datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f'{dt.microsecond // 1000:03d}Z'
+
+
+def stock_status(quantity, reorder_level):
+    if quantity == 0:
+        return 'out_of_stock'
+    if quantity <= reorder_level:
+        return 'low_stock'
+    return 'in_stock'
+
+
+def generate_products(count, rng, now_ms, days):
+    """Active products as GET /api/products returns them (createdBy populated)"""
+    products = []
+    for i in range(count):
+        product_id = object_id(rng)
+        reorder_level = rng.choice((5, 10, 20, 50))
+        roll = rng.random()
+        if roll < 0.05:
+            quantity = 0
+        elif roll < 0.20:
+            quantity = rng.randint(1, reorder_level)
+        else:
+            quantity = rng.randint(reorder_level + 1, reorder_level * 40)
+        created = now_ms - rng.randrange(days * DAY_MS)
+        updated = created + rng.randrange(now_ms - created + 1)
+        products.append({
+            '_id': product_id,
+            'productId': f'PRD{i:07d}',
+            'name': f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}',
+            'sku': f'SKU-{i:07d}',
+            'category': rng.choice(CATEGORIES),
+            'price': round(rng.uniform(0.5, 500), 2),
+            'quantity': quantity,
+            'supplier': rng.choice(SUPPLIERS),
+            'reorderLevel': reorder_level,
+            'expiryDate': iso(now_ms + rng.randrange(365) * DAY_MS) if rng.random() < 0.2 else None,
+            'description': '',
+            'isActive': True,
+            'createdBy': USERS[0],
+            'createdAt': iso(created),
+            'updatedAt': iso(updated),
+            '__v': 0,
+            'stockStatus': stock_status(quantity, reorder_level),
+            'id': product_id,
+        })
+    # The backend lists newest first
+    products.sort(key=lambda p: p['createdAt'], reverse=True)
+    return products
+
+
+def generate_transactions(count, products, rng, now_ms, days):
+    """Transactions as GET /api/transactions returns them, newest first.
+
+    Sales are skewed towards a minority of products, so top-K and
+    fast-mover questions have a realistic head and long tail.
+    """
+    transactions = []
+    n = len(products)
+    for _ in range(count if n else 0):
+        product = products[int(n * rng.random() ** 3)]
+        performer = rng.choice(USERS)
+        date = iso(now_ms - rng.randrange(days * DAY_MS))
+        transactions.append({
+            '_id': object_id(rng),
+            'product': {
+                '_id': product['_id'],
+                'name': product['name'],
+                'sku': product['sku'],
+                'category': product['category'],
+            },
+            'type': 'OUT' if rng.random() < 0.65 else 'IN',
+            'quantity': rng.randint(1, 50),
+            'notes': '',
+            'performedBy': performer,
+            'transactionDate': date,
+            'createdAt': date,
+            'updatedAt': date,
+            '__v': 0,
+        })
+    transactions.sort(key=lambda t: t['transactionDate'], reverse=True)
+    return transactions
+
+
+def dashboard(products, transactions, now_ms):
+    """GET /api/dashboard for the dataset, computed like dashboardController"""
+    low_stock = [p for p in products if p['quantity'] <= p['reorderLevel']]
+    today = iso(now_ms - now_ms % DAY_MS)
+    today_transactions = [t for t in transactions if t['transactionDate'] >= today]
+    return {
+        'totalProducts': len(products),
+        'totalStockValue': round(sum(p['price'] * p['quantity'] for p in products), 2),
+        'lowStockCount': len(low_stock),
+        'outOfStockCount': sum(1 for p in products if p['quantity'] == 0),
+        'todayStockIn': sum(t['quantity'] for t in today_transactions if t['type'] == 'IN'),
+        'todayStockOut': sum(t['quantity'] for t in today_transactions if t['type'] == 'OUT'),
+        'lowStockItems': low_stock[:5],
+        'recentTransactions': [
+            {
+                **t,
+                'product': {k: t['product'][k] for k in ('_id', 'name', 'sku')},
+                'performedBy': {k: t['performedBy'][k] for k in ('_id', 'name')},
+            }
+            for t in transactions[:10]
+        ],
+    }
+
+
+class Dataset:
+    """A reproducible synthetic inventory: `size` products and, by default,
+    as many transactions spread over the last `days` days"""
+
+    def __init__(self, size, transactions=None, days=90, seed=42, now_ms=None):
+        rng = random.Random(seed)
+        self.size = size
+        self.seed = seed
+        # Dates are relative to now so rolling windows always hold data
+        self.now_ms = now_ms or int(datetime.now(timezone.utc).timestamp() * 1000)
+        self.products = generate_products(size, rng, self.now_ms, days)
+        self.transactions = generate_transactions(
+            size if transactions is None else transactions, self.products, rng, self.now_ms, days
+        )
+        self.dashboard = dashboard(self.products, self.transactions, self.now_ms)
+
+    def describe(self):
+        return {
+            'products': len(self.products),
+            'transactions': len(self.transactions),
+            'seed': self.seed,
+        }
+
+    def product_names(self, count, seed=0):
+        rng = random.Random(seed)
+        return [rng.choice(self.products)['name'] for _ in range(count)] if self.products else []
@@ -0,0 +1,389 @@
+import bisect
+import heapq
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from retrieval import ProductIndex
+from tokens import estimate_tokens, take_within_budget
+
+
+def stock_status(p):
+    if p.get('quantity', 0) == 0:
+        return 'OUT OF STOCK'
+    if p.get('quantity', 0) <= p.get('reorderLevel', 0):
+        return 'LOW STOCK'
+    return 'IN STOCK'
+
+
+def format_product_line(p):
+    """Format a single product entry"""
+    return (
+        f"- {p.get('name')} (SKU: {p.get('sku')})\n"
+        f"  Category: {p.get('category')}, Price: ₹{p.get('price', 0):,.2f}, "
+        f"Current Stock: {p.get('quantity')}, Reorder Level: {p.get('reorderLevel')}, "
+        f"Status: {stock_status(p)}"
+    )
+
+
+def format_transaction_line(t, product_name=None):
+    """Format a single transaction line; `product_name` overrides the name
+    populated into the transaction"""
+    try:
+        trans_date = datetime.fromisoformat(t.get('transactionDate', '').replace('Z', '+00:00'))
+        date_str = trans_date.strftime('%Y-%m-%d %H:%M')
+    except:
+        date_str = 'Unknown date'
+
+    if product_name is None:
+        product_name = (t.get('product') or {}).get('name', 'Unknown')
+    performed_by = (t.get('performedBy') or {}).get('name', 'Unknown')
+    trans_type = t.get('type', 'Unknown')
+    quantity = t.get('quantity', 0)
+    notes = t.get('notes', '')
+
+    line = f"- {date_str}: {trans_type} {quantity} units of {product_name} by {performed_by}"
+    if notes:
+        line += f" (Notes: {notes})"
+
+    return line
+
+
+class ContextBuilder:
+    """Incrementally maintained renderer for the inventory context block.
+
+    Rendered lines are cached per record (keyed by `_id` plus `updatedAt`)
+    and the summary aggregates are adjusted record by record, so applying a
+    delta costs the number of changed records. The alert lists are kept in
+    backend order like the product listing. Product sections are cached
+    until a product changes; a new transaction only drops the assembled
+    contexts, which are cached per query. Transaction lines name the
+    product as the product records currently do, so a rename re-renders
+    that product's transactions.
+    """
+
+    RECENT_TRANSACTIONS = 100
+    RENDER_CACHE_SIZE = 32
+    # Listings get 90% of the budget; the rest covers the summary and instructions
+    PRODUCT_SHARE = 0.45
+
+    def __init__(self, products=(), transactions=(), product_lines=None, transaction_lines=None):
+        # Lines rendered before (e.g. stored with a snapshot) are kept while the record's `updatedAt` matches
+        self.products = {}
+        self.product_lines = dict(product_lines or {})
+        self.product_tokens = sum(tokens for _, _, tokens in self.product_lines.values())
+        self.product_order = []
+        self.transactions = {}
+        self.transaction_lines = dict(transaction_lines or {})
+        self.transaction_order = []
+        self.transactions_by_product = defaultdict(list)
+
+        # Running aggregates; the alert lists hold order keys, sorted like `product_order`
+        self.total_stock_value = 0
+        self.low_stock = []
+        self.out_of_stock = []
+        self.categories = {}
+        self.contributions = {}
+
+        self.product_revision = 0
+        self.transaction_revision = 0
+        # Bumped when lines of transactions already rendered change (renames, edited transactions)
+        self.rewrites = 0
+        self.sections = {}
+        self.rendered = OrderedDict()
+
+        # The initial records are appended and sorted once rather than inserted in order
+        self.loading = True
+        for product in products:
+            self.upsert_product(product)
+        for transaction in transactions:
+            self.add_transaction(transaction)
+        self.loading = False
+        for keys in (self.product_order, self.transaction_order, self.low_stock, self.out_of_stock):
+            keys.sort()
+
+    @classmethod
+    def attach(cls, replica):
+        """Return the builder kept in step with `replica`, building it once"""
+        builder = replica.derived.get('context_builder')
+        if builder is None:
+            builder = cls(replica.products.values(), replica.transactions.values())
+            replica.derived['context_builder'] = builder
+            replica.subscribe(builder.apply)
+        return builder
+
+    def apply(self, changes):
+        """Replica listener: apply one delta"""
+        for product_id in changes.get('removed', []):
+            self.remove_product(product_id)
+        for product in changes.get('products', []):
+            self.upsert_product(product)
+        for transaction in changes.get('transactions', []):
+            self.add_transaction(transaction)
+
+    def _products_changed(self):
+        self.product_revision += 1
+        self.sections = {}
+        self.rendered.clear()
+
+    def _transactions_changed(self):
+        # No cached section depends on transactions, only the assembled contexts
+        self.transaction_revision += 1
+        self.rendered.clear()
+
+    def _insert(self, keys, key):
+        if self.loading:
+            keys.append(key)
+        else:
+            bisect.insort(keys, key)
+
+    def _discard(self, keys, key):
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
+
+    # -- products ---------------------------------------------------------
+
+    def _order_key(self, product):
+        return (product.get('createdAt') or '', product.get('_id'))
+
+    def _retract(self, product_id):
+        old = self.products.get(product_id)
+        if old is None:
+            return
+        value, category = self.contributions.pop(product_id)
+        self.total_stock_value -= value
+        self.categories[category] -= 1
+        if not self.categories[category]:
+            del self.categories[category]
+        key = self._order_key(old)
+        self._discard(self.low_stock, key)
+        self._discard(self.out_of_stock, key)
+
+    def upsert_product(self, product):
+        product_id = product.get('_id')
+        old = self.products.get(product_id)
+        self._retract(product_id)
+        key = self._order_key(product)
+        if old is None:
+            self._insert(self.product_order, key)
+
+        self.products[product_id] = product
+        value = product.get('price', 0) * product.get('quantity', 0)
+        category = product.get('category', 'Other')
+        self.contributions[product_id] = (value, category)
+        self.total_stock_value += value
+        self.categories[category] = self.categories.get(category, 0) + 1
+        quantity = product.get('quantity', 0)
+        if quantity == 0:
+            self._insert(self.out_of_stock, key)
+        elif quantity <= product.get('reorderLevel', 0):
+            self._insert(self.low_stock, key)
+
+        if old is not None and old.get('name') != product.get('name'):
+            self._rename(product_id)
+
+        cached = self.product_lines.get(product_id)
+        if cached is None or cached[0] is None or cached[0] != product.get('updatedAt'):
+            if cached is not None:
+                self.product_tokens -= cached[2]
+            line = format_product_line(product)
+            tokens = estimate_tokens(line) + 1
+            self.product_lines[product_id] = (product.get('updatedAt'), line, tokens)
+            self.product_tokens += tokens
+        self._products_changed()
+
+    def remove_product(self, product_id):
+        product = self.products.get(product_id)
+        if product is None:
+            return
+        self._retract(product_id)
+        del self.products[product_id]
+        self._discard(self.product_order, self._order_key(product))
+        _, _, tokens = self.product_lines.pop(product_id)
+        self.product_tokens -= tokens
+        self._products_changed()
+
+    def product_line(self, product_id):
+        return self.product_lines[product_id][1]
+
+    # -- transactions -----------------------------------------------------
+
+    def _format_transaction(self, transaction):
+        product = self.products.get((transaction.get('product') or {}).get('_id'))
+        return format_transaction_line(transaction, product.get('name') if product is not None else None)
+
+    def _rename(self, product_id):
+        for transaction_id in self.transactions_by_product.get(product_id, ()):
+            transaction = self.transactions[transaction_id]
+            self.transaction_lines[transaction_id] = (transaction.get('updatedAt'), self._format_transaction(transaction))
+        self.rewrites += 1
+        self._transactions_changed()
+
+    def add_transaction(self, transaction):
+        transaction_id = transaction.get('_id')
+        cached = self.transaction_lines.get(transaction_id)
+        if transaction_id not in self.transactions:
+            self._insert(self.transaction_order, (transaction.get('transactionDate') or '', transaction_id))
+            product_id = (transaction.get('product') or {}).get('_id')
+            if product_id is not None:
+                self.transactions_by_product[product_id].append(transaction_id)
+        self.transactions[transaction_id] = transaction
+        if cached is None or cached[0] is None or cached[0] != transaction.get('updatedAt'):
+            self.transaction_lines[transaction_id] = (transaction.get('updatedAt'), self._format_transaction(transaction))
+            if cached is not None:
+                self.rewrites += 1
+        self._transactions_changed()
+
+    def transaction_line(self, transaction_id):
+        return self.transaction_lines[transaction_id][1]
+
+    def recent_transaction_ids(self, limit):
+        return [tid for _, tid in reversed(self.transaction_order[-limit:])]
+
+    # -- sections ---------------------------------------------------------
+
+    def _section(self, name, build):
+        if name not in self.sections:
+            self.sections[name] = build()
+        return self.sections[name]
+
+    def ordered(self, keys):
+        """Product ids of sorted order keys in backend order (newest created first)"""
+        return [pid for _, pid in reversed(keys)]
+
+    def summary(self):
+        return self._section('summary', lambda: f"""SUMMARY STATISTICS:
+- Total Products: {len(self.products)}
+- Total Stock Value: ₹{self.total_stock_value:,.2f}
+- Low Stock Items: {len(self.low_stock)}
+- Out of Stock Items: {len(self.out_of_stock)}
+- Categories: {', '.join([f"{k} ({v})" for k, v in self.categories.items()])}""")
+
+    def alert_lines(self, name):
+        """`(count, lines)` of the 'low_stock' or 'out_of_stock' alert list;
+        lines are formatted lazily as they are taken"""
+        if name == 'low_stock':
+            ids = self.ordered(self.low_stock)
+            fmt = lambda p: f"- {p.get('name')}: Current {p.get('quantity')} units (Reorder at: {p.get('reorderLevel')})"
+        else:
+            ids = self.ordered(self.out_of_stock)
+            fmt = lambda p: f"- {p.get('name')} (SKU: {p.get('sku')})"
+        return len(ids), (fmt(self.products[pid]) for pid in ids)
+
+    def alert_section(self, name, budget):
+        def build():
+            count, alerts = self.alert_lines(name)
+            if not count:
+                return 'None'
+            lines = take_within_budget(alerts, budget)
+            if len(lines) < count:
+                lines.append(f"...and {count - len(lines)} more")
+            return "\n".join(lines)
+        return self._section((name, budget), build)
+
+    def alert_ids(self):
+        """Out-of-stock and low-stock product ids in backend order"""
+        return self._section('alert_ids', lambda: [
+            pid for _, pid in heapq.merge(reversed(self.out_of_stock), reversed(self.low_stock), reverse=True)
+        ])
+
+    def all_products_section(self):
+        return self._section('all_products', lambda: "\n".join(
+            self.product_line(pid) for pid in self.ordered(self.product_order)
+        ))
+
+    def lists_all_products(self, budget):
+        """Whether a context rendered with `budget` lists every product"""
+        return self.product_tokens <= int(budget * self.PRODUCT_SHARE)
+
+    def select_products(self, query, budget, index=None):
+        """Product ids to list: all of them if they fit the budget, otherwise
+        the best retrieval matches topped up with out-of-stock and low-stock
+        items. Returns `(ids, lines, complete)`."""
+        if self.product_tokens <= budget:
+            return None, None, True
+
+        if index is None:
+            index = ProductIndex(self.products.values())
+        ranked = [pid for pid, _ in index.search(query or '', limit=200) if pid in self.products]
+        seen = set(ranked)
+        ranked += [pid for pid in self.alert_ids() if pid not in seen]
+        lines = take_within_budget((self.product_line(pid) for pid in ranked), budget)
+        return ranked[:len(lines)], lines, False
+
+    def select_transactions(self, product_ids, budget):
+        if product_ids is None:
+            candidates = self.recent_transaction_ids(self.RECENT_TRANSACTIONS)
+        else:
+            relevant = [tid for pid in product_ids for tid in self.transactions_by_product.get(pid, ())]
+            relevant.sort(key=lambda tid: self.transactions[tid].get('transactionDate') or '', reverse=True)
+            relevant = relevant[:self.RECENT_TRANSACTIONS]
+            seen = set(relevant)
+            candidates = relevant + [
+                tid for tid in self.recent_transaction_ids(self.RECENT_TRANSACTIONS)
+                if tid not in seen
+            ][:self.RECENT_TRANSACTIONS - len(relevant)]
+        return take_within_budget((self.transaction_line(tid) for tid in candidates), budget)
+
+    # -- assembly ---------------------------------------------------------
+
+    def render(self, query, budget, index=None, forecast=None):
+        """Assemble the context block, reusing the product sections while no
+        product changed. `forecast` is a `forecasting.Projection` for this catalogue."""
+        product_budget = int(budget * self.PRODUCT_SHARE)
+        complete = self.lists_all_products(budget)
+        forecast_section = forecast.section(int(budget * 0.05)) if forecast is not None else None
+        cache_key = (budget, None if complete else ' '.join((query or '').lower().split()), forecast_section)
+        if cache_key in self.rendered:
+            self.rendered.move_to_end(cache_key)
+            return self.rendered[cache_key]
+
+        selected, product_lines, complete = self.select_products(query, product_budget, index)
+        if complete:
+            products_header = "=== ALL PRODUCTS (Complete List) ==="
+            all_products_list = self.all_products_section()
+        else:
+            products_header = f"=== RELEVANT PRODUCTS ({len(selected)} of {len(self.products)}, selected for this question) ==="
+            all_products_list = "\n".join(product_lines)
+
+        transaction_lines = self.select_transactions(selected, int(budget * 0.2))
+        transactions_list = "\n".join(transaction_lines)
+
+        search_note = (
+            "- When user asks about a product, search through ALL products listed above"
+            if complete else
+            "- Only products relevant to this question are listed; the summary statistics cover the full catalogue"
+        )
+
+        context = f"""
+=== COMPLETE INVENTORY DATABASE ===
+
+{self.summary()}
+
+{products_header}
+{all_products_list}
+
+=== LOW STOCK ALERTS ===
+{self.alert_section('low_stock', int(budget * 0.1))}
+
+=== OUT OF STOCK ITEMS ===
+{self.alert_section('out_of_stock', int(budget * 0.1))}
+
+=== DEMAND FORECAST ===
+{forecast_section or 'Not enough sales history yet'}
+
+=== RECENT TRANSACTIONS (Last {len(transaction_lines)}) ===
+{transactions_list if self.transactions else 'No transactions recorded yet'}
+
+IMPORTANT INSTRUCTIONS:
+{search_note}
+- Product names are case-insensitive (e.g., "iphone 15 pro" matches "iPhone 15 Pro")
+- When user asks for recent transactions, count from the transaction list above
+- For stockout, demand or reorder questions, use the demand forecast above rather than estimating from transactions
+- You can perform calculations and analysis on any product or transaction data
+- Always provide specific numbers and product names from the data above
+- If user asks to add stock or perform transactions, politely explain they should use the "Perform Transaction" button in the product details page
+"""
+        self.rendered[cache_key] = context
+        while len(self.rendered) > self.RENDER_CACHE_SIZE:
+            self.rendered.popitem(last=False)
+        return context
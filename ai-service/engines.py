@@ -0,0 +1,107 @@
+import asyncio
+import os
+import time
+from ai_engine import AIEngine
+from gemini_engine import GeminiAIEngine
+from llm_providers import create_provider
+from router import HybridEngine, IntentRouter
+
+
+# Engine name -> factory(backend_url, client, snapshots) returning a HybridEngine
+ENGINES = {}
+
+
+def register_engine(name):
+    """Register an engine factory under `name` for `create_engine` / AI_ENGINE"""
+    def decorator(factory):
+        ENGINES[name] = factory
+        return factory
+    return decorator
+
+
+@register_engine('hybrid')
+def hybrid_engine(backend_url, client, snapshots):
+    """Structured questions answered locally, everything else by the LLM_PROVIDER model"""
+    llm = GeminiAIEngine(backend_url, client=client, snapshots=snapshots)
+    return HybridEngine(AIEngine(backend_url, client=client), llm)
+
+
+@register_engine('gemini')
+def gemini_only_engine(backend_url, client, snapshots):
+    """Every question goes to the model, as before local routing existed"""
+    llm = GeminiAIEngine(backend_url, client=client, snapshots=snapshots)
+    return HybridEngine(AIEngine(backend_url, client=client), llm, router=IntentRouter(threshold=float('inf')))
+
+
+@register_engine('stub')
+def stub_engine(backend_url, client, snapshots):
+    """Hybrid routing with the local stub model; no Gemini SDK or API key needed"""
+    llm = GeminiAIEngine(backend_url, client=client, snapshots=snapshots, provider=create_provider('stub'))
+    return HybridEngine(AIEngine(backend_url, client=client), llm)
+
+
+def create_engine(backend_url, client, snapshots, name=None):
+    """Build the engine selected by AI_ENGINE (hybrid | gemini | stub)"""
+    name = (name or os.getenv("AI_ENGINE", "hybrid")).lower()
+    if name not in ENGINES:
+        raise ValueError(f"Unknown AI engine: {name}")
+    return ENGINES[name](backend_url, client, snapshots)
+
+
+class WarmUp:
+    """Start-up work run in the background once the server is accepting requests.
+
+    Loads the model client and, when WARMUP_TOKEN is set, that tenant's
+    snapshot with its rendered inventory context, so the first real
+    request does not pay for either. Failures (e.g. the backend is not
+    up yet) are retried every `retry_delay` seconds. `checks()` reports
+    what is ready.
+    """
+
+    def __init__(self, engine, token=None, retry_delay=None):
+        self.engine = engine
+        self.token = token if token is not None else os.getenv("WARMUP_TOKEN")
+        self.retry_delay = retry_delay if retry_delay is not None else float(os.getenv("WARMUP_RETRY_DELAY", 5))
+        self.snapshot_loaded = False
+        self.seconds = None
+        self.error = None
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def warm(self):
+        await self.engine.provider.warm()
+        if self.token:
+            data = await self.engine.llm.fetch_inventory_data(self.token)
+            if data.get('version') is None:
+                raise RuntimeError(f"snapshot unavailable: {data.get('errors')}")
+            self.engine.llm.format_inventory_context(data)
+            self.snapshot_loaded = True
+
+    async def run(self):
+        started = time.perf_counter()
+        while True:
+            try:
+                await self.warm()
+                break
+            except Exception as e:
+                self.error = str(e)
+                print(f"Warm-up failed, retrying in {self.retry_delay}s: {e}")
+            await asyncio.sleep(self.retry_delay)
+        self.error = None
+        self.seconds = round(time.perf_counter() - started, 3)
+
+    def checks(self):
+        checks = {'model': self.engine.provider.ready}
+        if self.token:
+            checks['snapshot'] = self.snapshot_loaded
+        return checks
@@ -0,0 +1,261 @@
+import math
+import os
+import numpy as np
+from datetime import datetime, timezone
+from analytics import ProductFrame
+from tokens import take_within_budget
+from transaction_store import DAY_MS, TransactionStore, now_ms
+
+
+# Average days between demands above which a product's demand is treated as intermittent
+INTERMITTENT_ADI = 1.32
+# Daily demand standard deviation per unit of mean absolute error
+MAD_TO_SIGMA = 1.25
+
+
+class DemandForecast:
+    """Per-product daily demand forecast from the OUT transaction history.
+
+    Daily OUT units per product are folded in one day at a time, with every
+    product updated at once as NumPy vectors, so a pass over a year of
+    history costs 365 vector steps over the catalogue whatever its size.
+    Each product keeps simple exponential smoothing state (level and mean
+    absolute error) and Croston state (demand size and interval).
+    Products that sell on most days are forecast by SES. The rest are
+    intermittent and use Croston's method with the Syntetos-Boylan
+    correction; a gap longer than the usual interval lowers their rate.
+
+    Only completed days are folded in, so state advances incrementally as
+    days close; later calls only fold in the days since. If transactions
+    arrive for days already folded in, the forecast starts over.
+    """
+
+    def __init__(self, store, alpha=None, history_days=None, lead_days=None, service_z=None, horizon_days=None):
+        self.store = store
+        self.alpha = alpha or float(os.getenv("FORECAST_ALPHA", 0.1))
+        self.history_days = history_days or int(os.getenv("FORECAST_HISTORY_DAYS", 365))
+        # Supplier lead time and service level (z-score) for the reorder point
+        self.lead_days = lead_days or float(os.getenv("FORECAST_LEAD_DAYS", 7))
+        self.service_z = service_z if service_z is not None else float(os.getenv("FORECAST_SERVICE_Z", 1.65))
+        # Products projected to run out within this many days are listed as at risk
+        self.horizon_days = horizon_days or int(os.getenv("FORECAST_HORIZON_DAYS", 30))
+        self.reset()
+
+    @classmethod
+    def of(cls, store):
+        return store if isinstance(store, cls) else cls(TransactionStore.of(store))
+
+    @classmethod
+    def attach(cls, replica):
+        """Return the forecast over the replica's transaction store, building it once"""
+        forecast = replica.derived.get('demand_forecast')
+        if forecast is None:
+            forecast = cls(TransactionStore.attach(replica))
+            replica.derived['demand_forecast'] = forecast
+        return forecast
+
+    def follow(self, store):
+        """Continue from a newer copy of the same history (e.g. the next
+        published snapshot) instead of starting over"""
+        self.store = store
+        self.projection = None
+        return self
+
+    def reset(self):
+        self.start_day = None
+        # First day not folded in yet, and the store rows before it
+        self.day = None
+        self.consumed = 0
+        self.version = 0
+        self.projection = None
+        size = 0
+        self.started = np.zeros(size, dtype=bool)
+        self.level = np.zeros(size)
+        self.error = np.zeros(size)
+        self.size = np.zeros(size)
+        self.interval = np.zeros(size)
+        self.since = np.zeros(size)
+        self.demand_days = np.zeros(size)
+        self.active_days = np.zeros(size)
+
+    def _pad(self, size):
+        # New products may have appeared since the last update
+        grow = size - len(self.level)
+        if grow <= 0:
+            return
+        for name in ('started', 'level', 'error', 'size', 'interval', 'since', 'demand_days', 'active_days'):
+            column = getattr(self, name)
+            setattr(self, name, np.concatenate([column, np.zeros(grow, dtype=column.dtype)]))
+        if self.day is not None:
+            # Days since the history began, as for products seen from the start
+            self.since[-grow:] = self.day - self.start_day
+
+    def _step(self, demand):
+        """Fold one day's per-product OUT units into the smoothing state"""
+        a = self.alpha
+        sold = demand > 0
+        seen = self.started
+        first = sold & ~seen
+        update = sold & seen
+
+        self.error[seen] = a * np.abs(demand[seen] - self.level[seen]) + (1 - a) * self.error[seen]
+        self.level[seen] = a * demand[seen] + (1 - a) * self.level[seen]
+        self.since += 1
+        self.size[update] = a * demand[update] + (1 - a) * self.size[update]
+        # The first sale seeds the interval with the days observed before it;
+        # the first actual gap, at the second sale, replaces that guess
+        self.interval[update] = np.where(
+            self.demand_days[update] > 1,
+            a * self.since[update] + (1 - a) * self.interval[update],
+            self.since[update]
+        )
+
+        self.level[first] = self.size[first] = demand[first]
+        self.error[first] = demand[first] / 2
+        self.interval[first] = self.since[first]
+        self.since[sold] = 0
+        self.started |= sold
+        self.demand_days += sold
+        self.active_days += self.started
+
+    def update(self, now=None):
+        """Fold in every day completed before `now` (epoch ms, default: the current time)"""
+        store = self.store
+        ts = store.timestamp[:store.n]
+        today = (now if now is not None else now_ms()) // DAY_MS
+        if self.day is not None and int(np.searchsorted(ts, self.day * DAY_MS)) != self.consumed:
+            # Transactions arrived for days already folded in
+            self.reset()
+        if self.day is None:
+            if not len(ts):
+                return False
+            self.start_day = self.day = max(int(ts[0]) // DAY_MS, today - self.history_days)
+            self.consumed = int(np.searchsorted(ts, self.day * DAY_MS))
+        if today <= self.day:
+            return False
+
+        size = len(store.product_ids)
+        self._pad(size)
+        bounds = np.searchsorted(ts, np.arange(self.day + 1, today + 1, dtype=np.int64) * DAY_MS)
+        lo = self.consumed
+        for hi in bounds:
+            rows = slice(lo, int(hi))
+            out = store.is_out[rows] & (store.product[rows] >= 0)
+            self._step(np.bincount(
+                store.product[rows][out], weights=store.quantity[rows][out], minlength=size
+            ))
+            lo = int(hi)
+        self.day = today
+        self.consumed = lo
+        self.version += 1
+        self.projection = None
+        return True
+
+    def daily_rate(self):
+        """Forecast OUT units per day per product code"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # A single sale says nothing about the rate yet: treat it as intermittent
+            adi = np.where(self.demand_days > 1, self.active_days / self.demand_days, np.inf)
+            croston = (1 - self.alpha / 2) * self.size / np.maximum(np.maximum(self.interval, self.since), 1)
+        rate = np.where(adi > INTERMITTENT_ADI, croston, self.level)
+        return np.where(self.started, np.nan_to_num(rate), 0.0)
+
+    def project(self, frame, now=None):
+        """Stock projection for each row of `frame` (see `Projection`), kept
+        for the latest frame until the next day is folded in"""
+        self.update(now)
+        frame = ProductFrame.of(frame)
+        if self.projection is None or self.projection.frame is not frame:
+            self.projection = Projection(self, frame)
+        return self.projection
+
+
+class Projection:
+    """Per-product demand rate, days of cover, stockout date and reorder
+    point, aligned with the rows of a `ProductFrame`"""
+
+    def __init__(self, forecast, frame):
+        self.forecast = forecast
+        self.frame = frame
+        self.day = forecast.day
+        self.history_days = 0 if forecast.day is None else forecast.day - forecast.start_day
+        self.horizon_days = forecast.horizon_days
+        self.lead_days = forecast.lead_days
+        self.sections = {}
+
+        n = len(frame)
+        self.rate = np.zeros(n)
+        sigma = np.zeros(n)
+        codes = self._rows(forecast.store.product_ids, frame.product_ids())
+        if len(forecast.level):
+            codes = codes[:len(forecast.level)]
+            known = np.flatnonzero(codes >= 0)
+            self.rate[codes[known]] = forecast.daily_rate()[known]
+            sigma[codes[known]] = MAD_TO_SIGMA * forecast.error[known]
+
+        quantity = frame.quantity.astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.cover_days = np.where(self.rate > 0, quantity / self.rate, np.inf)
+        now = (self.day if self.day is not None else now_ms() // DAY_MS) * DAY_MS
+        self.stockout_ms = np.where(
+            np.isfinite(self.cover_days), now + np.nan_to_num(self.cover_days, posinf=0) * DAY_MS, np.nan
+        )
+        self.reorder_point = np.ceil(
+            self.rate * self.lead_days + forecast.service_z * sigma * math.sqrt(self.lead_days)
+        ).astype(np.int64)
+
+    @staticmethod
+    def _rows(product_ids, frame_ids):
+        """Frame row per product code (-1 for products no longer listed)"""
+        rows = {pid: row for row, pid in enumerate(frame_ids)}
+        return np.fromiter((rows.get(pid, -1) for pid in product_ids), dtype=np.int64, count=len(product_ids))
+
+    def at_risk(self, horizon_days=None):
+        """Rows in stock but projected to run out within the horizon, soonest first"""
+        horizon = self.horizon_days if horizon_days is None else horizon_days
+        rows = np.flatnonzero((self.frame.quantity > 0) & (self.cover_days <= horizon))
+        return rows[np.lexsort((rows, self.cover_days[rows]))]
+
+    def below_reorder_point(self):
+        """Rows whose stock is at or below the forecast reorder point"""
+        return np.flatnonzero((self.rate > 0) & (self.frame.quantity <= self.reorder_point))
+
+    def stockout_date(self, row):
+        if not np.isfinite(self.stockout_ms[row]):
+            return None
+        return datetime.fromtimestamp(self.stockout_ms[row] / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+
+    def row(self, row):
+        """Forecast fields of one product, for response payloads"""
+        record = self.frame.records[row]
+        return {
+            'name': record.get('name'),
+            'sku': record.get('sku'),
+            'quantity': int(self.frame.quantity[row]),
+            'daily_demand': round(float(self.rate[row]), 2),
+            'days_of_cover': round(float(self.cover_days[row]), 1) if np.isfinite(self.cover_days[row]) else None,
+            'stockout_date': self.stockout_date(row),
+            'reorder_point': int(self.reorder_point[row]),
+        }
+
+    def line(self, row):
+        entry = self.row(row)
+        return (
+            f"- {entry['name']}: ~{entry['daily_demand']:g}/day, stock {entry['quantity']}, "
+            f"{entry['days_of_cover']:g} days of cover (out ~{entry['stockout_date']}), "
+            f"reorder point {entry['reorder_point']}"
+        )
+
+    def section(self, budget):
+        """Context block of at-risk products within `budget` tokens"""
+        if budget not in self.sections:
+            rows = self.at_risk()
+            header = (
+                f"Forecast from {self.history_days} days of sales; {len(rows)} in-stock products projected "
+                f"to run out within {self.horizon_days} days (reorder points assume {self.lead_days:g} days lead time)"
+            )
+            lines = take_within_budget((self.line(row) for row in rows), budget)
+            if len(lines) < len(rows):
+                lines.append(f"...and {len(rows) - len(lines)} more")
+            self.sections[budget] = "\n".join([header, *lines])
+        return self.sections[budget]
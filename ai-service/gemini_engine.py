@@ -1,17 +1,34 @@
-import os
-import requests
-import google.generativeai as genai
-from datetime import datetime, timedelta
+from backend_client import BackendClient
+from llm_providers import create_provider
+from snapshot_cache import SnapshotCache
+from retrieval import ProductIndex
+from forecasting import DemandForecast
+from analytics import ProductFrame
+from context_builder import ContextBuilder, format_product_line, format_transaction_line
+from prompt_assembler import PromptAssembler
+from sessions import PrefixCache
+from llm_scheduler import INTERACTIVE, LLMScheduler, Overloaded
+from metrics import prompt_tokens as prompt_tokens_histogram, stage
 
 
 class GeminiAIEngine:
-    def __init__(self, backend_url):
+    def __init__(self, backend_url, client=None, provider=None, snapshots=None, assembler=None, prefixes=None,
+                 scheduler=None):
         self.backend_url = backend_url
-        self.api_key = os.getenv("GEMINI_API_KEY")
+        self.client = client or BackendClient(backend_url)
+        self.snapshots = snapshots or SnapshotCache(self.client)
         
-        # Configure Gemini
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        # Per-section token budgets for the prompt
+        self.assembler = assembler or PromptAssembler()
+        # Token budget for the inventory context block
+        self.context_token_budget = self.assembler.budgets['inventory']
+        
+        # Model provider (Gemini by default, stub for local testing)
+        self.provider = provider or create_provider()
+        # Static prompt prefixes registered with the provider, shared by sessions
+        self.prefixes = prefixes or PrefixCache(self.provider)
+        # Concurrency cap, priority queue and rate limiting for model calls
+        self.scheduler = scheduler or LLMScheduler()
         
         # System prompt for inventory context
         self.system_prompt = """You are an intelligent inventory management assistant. 
@@ -32,184 +49,135 @@ When answering:
 Your tone should be professional yet friendly, like a helpful colleague."""
 
 
-    def get_headers(self, token):
-        return {"Authorization": f"Bearer {token}"}
-    
-    def fetch_inventory_data(self, token):
-        """Fetch all relevant inventory data"""
-        try:
-            products_response = requests.get(
-                f"{self.backend_url}/products",
-                headers=self.get_headers(token),
-                timeout=10
-            )
-            
-            dashboard_response = requests.get(
-                f"{self.backend_url}/dashboard",
-                headers=self.get_headers(token),
-                timeout=10
-            )
-            
-            transactions_response = requests.get(
-                f"{self.backend_url}/transactions",
-                headers=self.get_headers(token),
-                timeout=10
-            )
-            
-            return {
-                'products': products_response.json().get('data', []) if products_response.status_code == 200 else [],
-                'dashboard': dashboard_response.json().get('data', {}) if dashboard_response.status_code == 200 else {},
-                'transactions': transactions_response.json().get('data', []) if transactions_response.status_code == 200 else []
-            }
-        except Exception as e:
-            print(f"Error fetching inventory data: {e}")
-            return {'products': [], 'dashboard': {}, 'transactions': []}
+    async def fetch_inventory_data(self, token):
+        """Fetch all relevant inventory data from the tenant's delta-synced replica"""
+        with stage('snapshot'):
+            snapshot, errors = await self.snapshots.get_snapshot(token)
+        if errors:
+            print(f"Error fetching inventory data: {errors}")
+        if snapshot is None:
+            return {'products': [], 'dashboard': {}, 'transactions': [], 'version': None, 'errors': errors}
+        return {
+            'products': snapshot.data['products'] or [],
+            'dashboard': snapshot.data['dashboard'] or {},
+            'transactions': snapshot.data['transactions'] or [],
+            'index': ProductIndex.attach(snapshot.replica),
+            'builder': ContextBuilder.attach(snapshot.replica),
+            'replica': snapshot.replica,
+            'version': snapshot.version,
+            'errors': errors
+        }
     
     def format_transaction_line(self, t):
         """Format a single transaction line"""
-        try:
-            trans_date = datetime.fromisoformat(t.get('transactionDate', '').replace('Z', '+00:00'))
-            date_str = trans_date.strftime('%Y-%m-%d %H:%M')
-        except:
-            date_str = 'Unknown date'
-        
-        product_name = t.get('product', {}).get('name', 'Unknown')
-        performed_by = t.get('performedBy', {}).get('name', 'Unknown')
-        trans_type = t.get('type', 'Unknown')
-        quantity = t.get('quantity', 0)
-        notes = t.get('notes', '')
-        
-        line = f"- {date_str}: {trans_type} {quantity} units of {product_name} by {performed_by}"
-        if notes:
-            line += f" (Notes: {notes})"
-        
-        return line
+        return format_transaction_line(t)
     
-    def format_inventory_context(self, data):
-        """Format COMPLETE inventory data for AI context"""
-        products = data.get('products', [])
-        dashboard = data.get('dashboard', {})
-        transactions = data.get('transactions', [])
-        
-        # Product summary
-        total_products = len(products)
-        low_stock = [p for p in products if 0 < p.get('quantity', 0) <= p.get('reorderLevel', 0)]
-        out_of_stock = [p for p in products if p.get('quantity', 0) == 0]
-        
-        # Calculate total stock value
-        total_stock_value = sum(p.get('price', 0) * p.get('quantity', 0) for p in products)
+    def format_product_line(self, p):
+        """Format a single product entry"""
+        return format_product_line(p)
+    
+    def format_inventory_context(self, data, query=None):
+        """Format inventory data for AI context within the token budget.
         
-        # Category breakdown
-        categories = {}
-        for p in products:
-            cat = p.get('category', 'Other')
-            if cat not in categories:
-                categories[cat] = 0
-            categories[cat] += 1
+        Summary statistics always cover the whole catalogue. Product and
+        transaction listings are complete when they fit; otherwise only the
+        entries relevant to `query` are included. Rendering is incremental
+        when `data` carries the replica's context builder.
+        """
+        builder = data.get('builder')
+        if builder is None:
+            builder = ContextBuilder(data.get('products', []), data.get('transactions', []))
+        return builder.render(query, self.context_token_budget, index=data.get('index'), forecast=self.forecast(data))
+    
+    def forecast(self, data):
+        """Demand projection for the snapshot's products, kept incrementally with the replica"""
+        replica = data.get('replica')
+        if replica is None:
+            return DemandForecast.of(data.get('transactions', [])).project(data.get('products', []))
+        return DemandForecast.attach(replica).project(ProductFrame.attach(replica))
+    
+    def relevant_products(self, data, query):
+        """Product lines relevant to `query` when the static context cannot list them all"""
+        builder = data.get('builder')
+        if builder is None or builder.lists_all_products(self.context_token_budget):
+            return None
+        _, lines, _ = builder.select_products(query, int(self.context_token_budget * 0.2), index=data.get('index'))
+        if not lines:
+            return None
+        return "Products relevant to this question:\n" + "\n".join(lines)
+    
+    def build_conversation(self, user_message, inventory_context, conversation_history=None, supplement=None):
+        """Build the Gemini conversation for a user message.
         
-        # Build COMPLETE product list for AI
-        all_products_list = "\n".join([
-            f"- {p.get('name')} (SKU: {p.get('sku')})\n"
-            f"  Category: {p.get('category')}, Price: ₹{p.get('price', 0):,.2f}, "
-            f"Current Stock: {p.get('quantity')}, Reorder Level: {p.get('reorderLevel')}, "
-            f"Status: {'OUT OF STOCK' if p.get('quantity', 0) == 0 else 'LOW STOCK' if p.get('quantity', 0) <= p.get('reorderLevel', 0) else 'IN STOCK'}"
-            for p in products
-        ])
+        Returns `(prefix, delta, prompt_tokens)` with the estimated token
+        count of each prompt section; older history turns are compacted
+        to fit the history budget.
+        """
+        with stage('prompt'):
+            prefix, delta, prompt_tokens = self.assembler.assemble(
+                self.system_prompt, inventory_context, user_message, conversation_history, supplement
+            )
+        for section in ('system', 'inventory', 'history', 'user', 'sent'):
+            prompt_tokens_histogram.observe(prompt_tokens[section], section)
+        return prefix, delta, prompt_tokens
+    
+    async def prepare_conversation(self, user_message, token, conversation_history=None, session=None, data=None):
+        """Fetch real-time inventory data and build the conversation.
         
-        # Build COMPLETE transaction list (last 100)
-        recent_transactions = transactions[:100]
-        transactions_list = "\n".join([
-            self.format_transaction_line(t) for t in recent_transactions
-        ])
+        Returns `(conversation, prefix, prompt_tokens)`. Without a session
+        the whole conversation is sent and `prefix` is None. In a session
+        the inventory context is query-independent, so the static prefix
+        is registered once per snapshot version and only the delta (history
+        and question, plus relevant products for large catalogues) is sent.
+        `data` reuses inventory data the caller already fetched.
+        """
+        inventory_data = data if data is not None else await self.fetch_inventory_data(token)
+        if session is None:
+            with stage('context'):
+                inventory_context = self.format_inventory_context(inventory_data, query=user_message)
+            prefix, delta, prompt_tokens = self.build_conversation(user_message, inventory_context, conversation_history)
+            return prefix + delta, None, prompt_tokens
         
-        context = f"""
-=== COMPLETE INVENTORY DATABASE ===
-
-SUMMARY STATISTICS:
-- Total Products: {total_products}
-- Total Stock Value: ₹{total_stock_value:,.2f}
-- Low Stock Items: {len(low_stock)}
-- Out of Stock Items: {len(out_of_stock)}
-- Categories: {', '.join([f"{k} ({v})" for k, v in categories.items()])}
-
-=== ALL PRODUCTS (Complete List) ===
-{all_products_list}
-
-=== LOW STOCK ALERTS ===
-{chr(10).join([f"- {p.get('name')}: Current {p.get('quantity')} units (Reorder at: {p.get('reorderLevel')})" for p in low_stock]) if low_stock else 'None'}
-
-=== OUT OF STOCK ITEMS ===
-{chr(10).join([f"- {p.get('name')} (SKU: {p.get('sku')})" for p in out_of_stock]) if out_of_stock else 'None'}
-
-=== RECENT TRANSACTIONS (Last {len(recent_transactions)}) ===
-{transactions_list if transactions else 'No transactions recorded yet'}
-
-IMPORTANT INSTRUCTIONS:
-- When user asks about a product, search through ALL products listed above
-- Product names are case-insensitive (e.g., "iphone 15 pro" matches "iPhone 15 Pro")
-- When user asks for recent transactions, count from the transaction list above
-- You can perform calculations and analysis on any product or transaction data
-- Always provide specific numbers and product names from the data above
-- If user asks to add stock or perform transactions, politely explain they should use the "Perform Transaction" button in the product details page
-"""
-        return context
+        with stage('context'):
+            inventory_context = self.format_inventory_context(inventory_data)
+            supplement = self.relevant_products(inventory_data, user_message)
+        prefix, delta, prompt_tokens = self.build_conversation(
+            user_message, inventory_context, conversation_history, supplement
+        )
+        with stage('prefix'):
+            handle = await self.prefixes.get(prefix)
+        session.prefix_key = handle.key
+        if handle.remote is not None:
+            prompt_tokens['sent'] -= prompt_tokens['prefix']
+        return delta, handle, prompt_tokens
     
-    async def chat(self, user_message, token, conversation_history=None):
+    async def chat(self, user_message, token, conversation_history=None, session=None, data=None,
+                   priority=INTERACTIVE):
         """
-        Process user message with Gemini AI
+        Process user message with Gemini AI. Raises `Overloaded` when the
+        model call is shed or rate limited beyond its retries.
         """
         try:
-            # Fetch real-time inventory data
-            inventory_data = self.fetch_inventory_data(token)
-            inventory_context = self.format_inventory_context(inventory_data)
-            
-            # Build conversation with context
-            conversation = []
-            
-            # Add system prompt
-            conversation.append({
-                "role": "user",
-                "parts": [self.system_prompt]
-            })
-            conversation.append({
-                "role": "model",
-                "parts": ["I understand. I'm your inventory management assistant with access to COMPLETE real-time data. How can I help you today?"]
-            })
-            
-            # Add COMPLETE inventory context
-            conversation.append({
-                "role": "user",
-                "parts": [f"Here's the COMPLETE inventory database:\n{inventory_context}"]
-            })
-            conversation.append({
-                "role": "model",
-                "parts": ["I've received the complete inventory data including all products and transactions. I can now answer any question about your inventory. What would you like to know?"]
-            })
-            
-            # Add conversation history if exists
-            if conversation_history and len(conversation_history) > 0:
-                for msg in conversation_history[-6:]:
-                    if msg.get('role') in ['user', 'assistant']:
-                        conversation.append({
-                            "role": "user" if msg['role'] == 'user' else "model",
-                            "parts": [msg.get('content', '')]
-                        })
-            
-            # Add current user message
-            conversation.append({
-                "role": "user",
-                "parts": [user_message]
-            })
+            conversation, prefix, prompt_tokens = await self.prepare_conversation(
+                user_message, token, conversation_history, session, data
+            )
             
-            # Generate response
-            response = self.model.generate_content(conversation)
+            # Generate response off the event loop, through the scheduler
+            with stage('generate'):
+                answer = await self.scheduler.run(
+                    lambda: self.provider.generate(conversation, prefix=prefix),
+                    priority=priority, tokens=prompt_tokens['sent']
+                )
             
             return {
-                "answer": response.text,
+                "answer": answer,
                 "context_used": True,
-                "model": "gemini-2.0-flash-exp"
+                "model": self.provider.model_name,
+                "prompt_tokens": prompt_tokens
             }
             
+        except Overloaded:
+            raise
         except Exception as e:
             print(f"Gemini API Error: {str(e)}")
             return {
@@ -217,3 +185,22 @@ IMPORTANT INSTRUCTIONS:
                 "context_used": False,
                 "model": "fallback"
             }
+    
+    async def chat_stream(self, user_message, token, conversation_history=None, meta=None, session=None, data=None,
+                          admitted=False):
+        """
+        Process user message with Gemini AI, yielding answer chunks as they arrive.
+        Prompt token counts are stored in `meta['prompt_tokens']` when given;
+        `admitted` is passed on to the scheduler.
+        """
+        conversation, prefix, prompt_tokens = await self.prepare_conversation(
+            user_message, token, conversation_history, session, data
+        )
+        if meta is not None:
+            meta['prompt_tokens'] = prompt_tokens
+        with stage('generate'):
+            async for chunk in self.scheduler.stream(
+                lambda: self.provider.stream(conversation, prefix=prefix),
+                tokens=prompt_tokens['sent'], admitted=admitted
+            ):
+                yield chunk
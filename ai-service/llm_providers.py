@@ -0,0 +1,257 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+
+def conversation_bytes(conversation):
+    """UTF-8 size of the text parts of a conversation"""
+    return sum(len(str(part).encode()) for message in conversation for part in message['parts'])
+
+
+class RateLimited(Exception):
+    """The provider rejected a call for quota reasons (HTTP 429)"""
+
+    def __init__(self, message='Rate limited by the model provider', retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+RETRY_HINT_RE = re.compile(r'retry in ([\d.]+)\s*s|retry_delay\s*\{\s*seconds:\s*(\d+)', re.IGNORECASE)
+
+
+def as_rate_limited(error):
+    """Map a Gemini SDK quota error to `RateLimited` (None for other errors)"""
+    if getattr(error, 'code', None) != 429 and type(error).__name__ not in ('ResourceExhausted', 'TooManyRequests'):
+        return None
+    match = RETRY_HINT_RE.search(str(error))
+    retry_after = float(match.group(1) or match.group(2)) if match else None
+    return RateLimited(str(error), retry_after)
+
+
+class PrefixHandle:
+    """A conversation prefix registered with a provider.
+
+    `remote` is the provider-side cached content when the provider holds
+    the prefix itself; otherwise the prefix is prepended on every call.
+    """
+
+    def __init__(self, key, contents, remote=None):
+        self.key = key
+        self.contents = contents
+        self.remote = remote
+        self.size = conversation_bytes(contents)
+        self.created_at = time.monotonic()
+
+
+class GeminiProvider:
+    """Gemini model client that never blocks the event loop.
+
+    The SDK's `generate_content` is synchronous, so calls run on a bounded
+    thread pool; the pool size caps concurrent model calls per process.
+    The SDK (and its gRPC / protobuf stack) is imported and the client
+    configured on first use or by `warm()`, not at construction, so the
+    service starts answering before the model client is loaded.
+    """
+
+    def __init__(self, api_key=None, model_name='gemini-2.0-flash-exp', max_workers=None, context_cache=None):
+        self.api_key = api_key or os.getenv("GEMINI_API_KEY")
+        self.genai = None
+        self.model_name = model_name
+        self.model = None
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv("LLM_MAX_WORKERS", 8)),
+            thread_name_prefix="gemini"
+        )
+        # Gemini context caching only applies to models that support it and
+        # to prefixes above its minimum size, so it is opt-in
+        self.context_cache = (
+            context_cache if context_cache is not None
+            else os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true"
+        )
+        self.prefix_ttl = int(os.getenv("PREFIX_CACHE_TTL", 600))
+
+    @property
+    def ready(self):
+        return self.model is not None
+
+    def _load(self):
+        with self.lock:
+            if self.model is not None:
+                return
+            import google.generativeai as genai
+
+            genai.configure(api_key=self.api_key)
+            self.genai = genai
+            self.model = genai.GenerativeModel(self.model_name)
+
+    async def warm(self):
+        """Import the SDK and build the client off the event loop (once)"""
+        if self.model is None:
+            await self._run(self._load)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def cache_prefix(self, key, prefix):
+        """Register a conversation prefix, uploading it once as Gemini cached
+        content when context caching is enabled and available"""
+        if not self.context_cache:
+            return PrefixHandle(key, prefix)
+        await self.warm()
+        from google.generativeai import caching
+        try:
+            remote = await self._run(lambda: caching.CachedContent.create(
+                model=self.model_name,
+                contents=prefix,
+                ttl=timedelta(seconds=self.prefix_ttl)
+            ))
+        except Exception as e:
+            print(f"Gemini context cache unavailable: {e}")
+            return PrefixHandle(key, prefix)
+        return PrefixHandle(key, prefix, remote=remote)
+
+    async def release_prefix(self, handle):
+        if handle.remote is None:
+            return
+        try:
+            await self._run(handle.remote.delete)
+        except Exception as e:
+            print(f"Error releasing Gemini cached content: {e}")
+
+    def _prepare(self, conversation, prefix):
+        if prefix is None:
+            return self.model, conversation
+        if prefix.remote is not None:
+            return self.genai.GenerativeModel.from_cached_content(cached_content=prefix.remote), conversation
+        return self.model, prefix.contents + conversation
+
+    async def generate(self, conversation, prefix=None):
+        """Return the full response text. `conversation` follows `prefix` if given."""
+        await self.warm()
+        model, conversation = self._prepare(conversation, prefix)
+        try:
+            response = await self._run(model.generate_content, conversation)
+        except Exception as e:
+            raise as_rate_limited(e) or e
+        return response.text
+
+    async def stream(self, conversation, prefix=None):
+        """Yield response text chunks as the model produces them"""
+        await self.warm()
+        model, conversation = self._prepare(conversation, prefix)
+        try:
+            response = await self._run(
+                lambda: model.generate_content(conversation, stream=True)
+            )
+            chunks = iter(response)
+            done = object()
+            while True:
+                chunk = await self._run(next, chunks, done)
+                if chunk is done:
+                    break
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            raise as_rate_limited(e) or e
+
+
+class StubProvider:
+    """Local stand-in model that emits canned tokens with a configurable delay.
+
+    Used for load and time-to-first-byte testing without calling Gemini.
+    Behaves like a provider with context caching: registered prefixes are
+    counted as uploaded once, and calls count only the bytes they send.
+    With a `quota_rpm`, calls beyond that many per minute fail with
+    `RateLimited` carrying a retry hint, like a provider's 429.
+    """
+
+    def __init__(self, reply=None, token_delay=None, first_token_delay=None, quota_rpm=None):
+        self.model_name = 'stub'
+        self.reply = reply or os.getenv(
+            "STUB_REPLY",
+            "This is a stub response from the local test model. Inventory data was received."
+        )
+        self.token_delay = token_delay if token_delay is not None else float(os.getenv("STUB_TOKEN_DELAY", 0.02))
+        self.first_token_delay = (
+            first_token_delay if first_token_delay is not None
+            else float(os.getenv("STUB_FIRST_TOKEN_DELAY", self.token_delay))
+        )
+        self.quota_rpm = quota_rpm if quota_rpm is not None else int(os.getenv("STUB_QUOTA_RPM", 0))
+        self.recent_calls = deque()
+        self.calls = 0
+        self.rate_limited = 0
+        self.prefix_uploads = 0
+        self.prefix_bytes = 0
+        self.sent_bytes = 0
+
+    @property
+    def ready(self):
+        return True
+
+    async def warm(self):
+        pass
+
+    def tokens(self):
+        words = self.reply.split(' ')
+        return [w if i == len(words) - 1 else w + ' ' for i, w in enumerate(words)]
+
+    async def cache_prefix(self, key, prefix):
+        handle = PrefixHandle(key, prefix, remote=key)
+        self.prefix_uploads += 1
+        self.prefix_bytes += handle.size
+        return handle
+
+    async def release_prefix(self, handle):
+        pass
+
+    def usage(self):
+        return {
+            'calls': self.calls,
+            'rate_limited': self.rate_limited,
+            'prefix_uploads': self.prefix_uploads,
+            'prefix_bytes': self.prefix_bytes,
+            'sent_bytes': self.sent_bytes,
+        }
+
+    async def generate(self, conversation, prefix=None):
+        return ''.join([chunk async for chunk in self.stream(conversation, prefix)])
+
+    def _check_quota(self):
+        if not self.quota_rpm:
+            return
+        now = time.monotonic()
+        while self.recent_calls and now - self.recent_calls[0] >= 60:
+            self.recent_calls.popleft()
+        if len(self.recent_calls) >= self.quota_rpm:
+            self.rate_limited += 1
+            raise RateLimited(retry_after=60 - (now - self.recent_calls[0]))
+        self.recent_calls.append(now)
+
+    async def stream(self, conversation, prefix=None):
+        self._check_quota()
+        self.calls += 1
+        self.sent_bytes += conversation_bytes(conversation)
+        for i, token in enumerate(self.tokens()):
+            await asyncio.sleep(self.first_token_delay if i == 0 else self.token_delay)
+            yield token
+
+
+PROVIDERS = {
+    'gemini': GeminiProvider,
+    'stub': StubProvider,
+}
+
+
+def create_provider(name=None):
+    """Build the model provider selected by LLM_PROVIDER (gemini | stub)"""
+    name = (name or os.getenv("LLM_PROVIDER", "gemini")).lower()
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider: {name}")
+    return PROVIDERS[name]()
@@ -0,0 +1,260 @@
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import random
+import time
+from llm_providers import RateLimited
+from metrics import stage
+
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+
+class Overloaded(Exception):
+    """A model call was refused or gave up; maps to HTTP 429 / 503 with Retry-After"""
+
+    def __init__(self, message, status_code=503, retry_after=1.0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after or 1))
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to `capacity`"""
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount):
+        """Seconds until `amount` units are available"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class LLMScheduler:
+    """Admission control and pacing in front of the model provider.
+
+    At most `max_concurrency` calls run at once; others wait in a bounded
+    priority queue (interactive chat ahead of background recomputation).
+    Calls are paced by request- and token-per-minute buckets. A provider
+    429 pauses every call for its retry hint and the call is retried with
+    jittered exponential backoff. Requests that would wait longer than
+    `max_wait` are shed up front with `Overloaded` instead of queueing.
+    """
+
+    def __init__(self, max_concurrency=None, max_queue=None, rpm=None, tpm=None, max_wait=None,
+                 max_retries=None, backoff_base=None, backoff_max=None):
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", os.getenv("LLM_MAX_WORKERS", 8)))
+        self.max_queue = max_queue or int(os.getenv("LLM_MAX_QUEUE", 64))
+        rpm = rpm if rpm is not None else int(os.getenv("LLM_RPM", 0))
+        tpm = tpm if tpm is not None else int(os.getenv("LLM_TPM", 0))
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("LLM_MAX_WAIT", 20))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", 3))
+        self.backoff_base = backoff_base if backoff_base is not None else float(os.getenv("LLM_BACKOFF_BASE", 0.5))
+        self.backoff_max = backoff_max if backoff_max is not None else float(os.getenv("LLM_BACKOFF_MAX", 8))
+        self.output_tokens = int(os.getenv("LLM_OUTPUT_TOKENS", 500))
+
+        self.active = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.cooldown_until = 0.0
+        # Running estimate of how long one call holds a slot
+        self.service_time = 2.0
+        self.counters = {
+            'admitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'shed_429': 0,
+            'shed_503': 0,
+            'retries': 0,
+            'rate_limited': 0,
+        }
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # -- admission --------------------------------------------------------
+
+    def queued(self, priority=None):
+        return sum(
+            1 for p, _, future in self.waiting
+            if not future.done() and (priority is None or p <= priority)
+        )
+
+    def pacing_delay(self, tokens=0):
+        """Seconds until rate limits and provider cooldown allow a call"""
+        delays = [self.cooldown_until - time.monotonic()]
+        if self.requests:
+            delays.append(self.requests.delay(1))
+        if self.tokens:
+            delays.append(self.tokens.delay(tokens))
+        return max(0.0, *delays)
+
+    def estimated_wait(self, priority=INTERACTIVE):
+        ahead = self.queued(priority) + max(0, self.active - self.max_concurrency + 1)
+        return (ahead / self.max_concurrency) * self.service_time
+
+    def admit(self, priority=INTERACTIVE, tokens=0):
+        """Raise `Overloaded` if a call would be shed; otherwise return"""
+        if self.queued() >= self.max_queue:
+            self.counters['shed_503'] += 1
+            raise Overloaded("AI service is busy, please retry shortly", 503, self.estimated_wait(priority))
+        pacing = self.pacing_delay(tokens)
+        if pacing > self.max_wait:
+            self.counters['shed_429'] += 1
+            raise Overloaded("Model rate limit reached, please retry later", 429, pacing)
+        wait = self.estimated_wait(priority) + pacing
+        if wait > self.max_wait:
+            self.counters['shed_503'] += 1
+            raise Overloaded("AI service is busy, please retry shortly", 503, wait)
+
+    # -- slots ------------------------------------------------------------
+
+    async def _acquire(self, priority):
+        if self.active < self.max_concurrency and not self.queued():
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before cancellation
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        while self.waiting:
+            _, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                future.set_result(None)  # hand the slot over
+                return
+        self.active -= 1
+
+    async def _pace(self, tokens):
+        while True:
+            delay = self.pacing_delay(tokens)
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+
+    def _backoff(self, attempt, error):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.5)
+        if error.retry_after:
+            # Every call pauses until the provider's hint has passed
+            delay = max(delay, error.retry_after)
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + error.retry_after)
+        return delay
+
+    # -- calls ------------------------------------------------------------
+
+    async def _enter(self, priority, tokens, admitted=False):
+        if not admitted:
+            self.admit(priority, tokens)
+        self.counters['admitted'] += 1
+        queued_at = time.monotonic()
+        await self._acquire(priority)
+        try:
+            await self._pace(tokens + self.output_tokens)
+        except BaseException:
+            self._release()
+            raise
+        waited = time.monotonic() - queued_at
+        self.waits += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        return time.monotonic()
+
+    def _exit(self, started, ok):
+        self.service_time = 0.8 * self.service_time + 0.2 * (time.monotonic() - started)
+        self.counters['completed' if ok else 'failed'] += 1
+        self._release()
+
+    async def _retry_wait(self, attempt, error, started):
+        self.counters['rate_limited'] += 1
+        delay = self._backoff(attempt, error)
+        if attempt >= self.max_retries or time.monotonic() - started + delay > self.max_wait:
+            raise Overloaded("Model rate limit reached, please retry later", 429, delay) from error
+        self.counters['retries'] += 1
+        await asyncio.sleep(delay)
+
+    async def run(self, call, priority=INTERACTIVE, tokens=0):
+        """Run `await call()` under admission control, retrying on RateLimited"""
+        with stage('llm_queue'):
+            started = await self._enter(priority, tokens)
+        ok = False
+        try:
+            attempt = 0
+            while True:
+                try:
+                    result = await call()
+                    ok = True
+                    return result
+                except RateLimited as e:
+                    await self._retry_wait(attempt, e, started)
+                    attempt += 1
+        finally:
+            self._exit(started, ok)
+
+    async def stream(self, open_stream, priority=INTERACTIVE, tokens=0, admitted=False):
+        """Yield from `open_stream()` under admission control. RateLimited is
+        retried only before the first chunk; the slot is held until the end.
+        `admitted` means the caller already passed `admit()` for this call,
+        so it is not checked (or counted) twice."""
+        with stage('llm_queue'):
+            started = await self._enter(priority, tokens, admitted)
+        ok = False
+        try:
+            attempt = 0
+            while True:
+                emitted = False
+                try:
+                    async for chunk in open_stream():
+                        emitted = True
+                        yield chunk
+                    ok = True
+                    return
+                except RateLimited as e:
+                    if emitted:
+                        raise Overloaded("Model rate limit reached, please retry later", 429, e.retry_after) from e
+                    await self._retry_wait(attempt, e, started)
+                    attempt += 1
+        finally:
+            self._exit(started, ok)
+
+    def stats(self):
+        return {
+            **self.counters,
+            'in_flight': self.active,
+            'max_concurrency': self.max_concurrency,
+            'queue_depth': {name: self.queued(p) - (self.queued(p - 1) if p else 0) for p, name in PRIORITY_NAMES.items()},
+            'max_queue': self.max_queue,
+            'avg_wait_ms': round(self.wait_total / self.waits * 1000, 3) if self.waits else 0.0,
+            'max_wait_ms': round(self.wait_max * 1000, 3),
+            'service_time_ms': round(self.service_time * 1000, 3),
+            'cooldown_s': round(max(0.0, self.cooldown_until - time.monotonic()), 3),
+        }
@@ -1,14 +1,64 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+import asyncio
+import json
 import os
-from gemini_engine import GeminiAIEngine
-from typing import List, Optional
+import time
+from backend_client import BackendClient
+from engines import WarmUp, create_engine
+from llm_scheduler import Overloaded
+from metrics import MetricsMiddleware, mark_handled, registry
+from snapshot_cache import SnapshotCache
+from snapshot_store import SnapshotStore
+from shared_snapshot import SharedSnapshotCache
+from replica import SyncScheduler
+from workers import Supervisor, shared_directory
+from typing import Any, Dict, List, Optional
 
 load_dotenv()
 
-app = FastAPI(title="Inventory AI Assistant - Gemini Powered")
+STARTED_AT = time.monotonic()
+BACKEND_URL = os.getenv("NODE_BACKEND_URL", "http://localhost:5000/api")
+AI_SERVICE_SECRET = os.getenv("AI_SERVICE_SECRET")
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", 100))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 16))
+# With several workers, one owner process syncs snapshots and the workers share them
+AI_WORKERS = int(os.getenv("AI_WORKERS", 1))
+backend_client = BackendClient(BACKEND_URL)
+if AI_WORKERS > 1:
+    snapshot_cache = SharedSnapshotCache(shared_directory())
+    sync_scheduler = None
+    snapshot_store = None
+else:
+    # With SNAPSHOT_STORE_DIR set, snapshots are kept on disk across restarts
+    snapshot_store = SnapshotStore.from_env()
+    snapshot_cache = SnapshotCache(backend_client, store=snapshot_store)
+    sync_scheduler = SyncScheduler(snapshot_cache, interval=float(os.getenv("SYNC_INTERVAL", 15)))
+# Structured questions are answered locally, everything else by the model (AI_ENGINE selects the mix)
+ai_engine = create_engine(BACKEND_URL, backend_client, snapshot_cache)
+gemini_engine = ai_engine.llm
+# The model client is loaded in the background after start-up, not at import
+warm_up = WarmUp(ai_engine)
+
+@asynccontextmanager
+async def lifespan(app):
+    if sync_scheduler is not None:
+        sync_scheduler.start()
+    restore = asyncio.create_task(snapshot_store.restore(snapshot_cache)) if snapshot_store is not None else None
+    warm_up.start()
+    yield
+    await warm_up.stop()
+    if restore is not None and not restore.done():
+        restore.cancel()
+    if sync_scheduler is not None:
+        await sync_scheduler.stop()
+    await backend_client.aclose()
+
+app = FastAPI(title="Inventory AI Assistant - Gemini Powered", lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -17,11 +67,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
-# Initialize Gemini AI Engine
-BACKEND_URL = os.getenv("NODE_BACKEND_URL", "http://localhost:5000/api")
-ai_engine = GeminiAIEngine(BACKEND_URL)
+# Request latency, Server-Timing header and sampled profiling of slow requests
+app.add_middleware(MetricsMiddleware)
 
 class Message(BaseModel):
     role: str
@@ -31,11 +81,49 @@ class ChatRequest(BaseModel):
     message: str
     token: str
     conversation_history: Optional[List[Message]] = []
+    # Server-side sessions are opt-in: resume `session_id`, or start one with `session`
+    session_id: Optional[str] = None
+    session: bool = False
+
+class BatchRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_QUESTIONS)
+    token: str
+    max_concurrency: Optional[int] = Field(None, ge=1, le=BATCH_MAX_CONCURRENCY)
+
+class InvalidateRequest(BaseModel):
+    user_id: Optional[str] = None
+    drop: bool = False
 
 class ChatResponse(BaseModel):
     answer: str
     model: str
     timestamp: str
+    route: Optional[str] = None
+    intent: Optional[str] = None
+    data: Optional[Any] = None
+    cached: bool = False
+    prompt_tokens: Optional[Dict[str, int]] = None
+    session_id: Optional[str] = None
+
+class BatchItem(BaseModel):
+    index: int
+    question: str
+    status: str
+    answer: Optional[str] = None
+    model: Optional[str] = None
+    route: Optional[str] = None
+    intent: Optional[str] = None
+    data: Optional[Any] = None
+    cached: bool = False
+    error: Optional[str] = None
+    retry_after: Optional[int] = None
+    duration_ms: float
+
+class BatchResponse(BaseModel):
+    results: List[BatchItem]
+    total_ms: float
+    snapshot_version: Optional[int] = None
+    timestamp: str
 
 @app.get("/")
 def root():
@@ -58,35 +146,229 @@ async def chat(request: ChatRequest):
         if not request.token:
             raise HTTPException(status_code=401, detail="Authentication token required")
         
-        # Process with Gemini AI
+        # Route to the local handlers or Gemini AI
         result = await ai_engine.chat(
             request.message, 
             request.token,
-            conversation_history=[msg.dict() for msg in request.conversation_history]
+            conversation_history=[msg.dict() for msg in request.conversation_history],
+            session_id=request.session_id,
+            start_session=request.session
         )
         
         from datetime import datetime
+        mark_handled()
         return ChatResponse(
             answer=result['answer'],
-            model=result.get('model', 'gemini-2.0-flash'),
-            timestamp=datetime.now().isoformat()
+            model=result.get('model', ai_engine.provider.model_name),
+            timestamp=datetime.now().isoformat(),
+            route=result.get('route'),
+            intent=result.get('intent'),
+            data=result.get('data'),
+            cached=result.get('cached', False),
+            prompt_tokens=result.get('prompt_tokens'),
+            session_id=result.get('session_id')
         )
     
     except HTTPException:
         raise
+    except Overloaded as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         print(f"Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"AI processing error: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming AI Chat endpoint (Server-Sent Events)
+
+    Emits `data: {"delta": ...}` events as tokens arrive, then a final
+    `event: done` carrying the model name, timestamp, route, session id
+    and prompt token counts.
+    """
+    if not request.message.strip():
+        raise HTTPException(status_code=400, detail="Message cannot be empty")
+    
+    if not request.token:
+        raise HTTPException(status_code=401, detail="Authentication token required")
+    
+    # Shed model-bound requests before the stream starts, while a status code can still be sent;
+    # the scheduler then takes this as the request's admission instead of checking again
+    admitted = not ai_engine.router.is_local(ai_engine.router.classify(request.message))
+    if admitted:
+        try:
+            gemini_engine.scheduler.admit()
+        except Overloaded as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    
+    async def events():
+        from datetime import datetime
+        meta = {}
+        try:
+            async for chunk in ai_engine.chat_stream(
+                request.message,
+                request.token,
+                conversation_history=[msg.dict() for msg in request.conversation_history],
+                meta=meta,
+                session_id=request.session_id,
+                admitted=admitted,
+                start_session=request.session
+            ):
+                yield f"data: {json.dumps({'delta': chunk})}\n\n"
+            done = {
+                'model': ai_engine.provider.model_name,
+                'timestamp': datetime.now().isoformat(),
+                'route': meta.get('route'),
+                'session_id': meta.get('session_id'),
+                'prompt_tokens': meta.get('prompt_tokens')
+            }
+            yield f"event: done\ndata: {json.dumps(done)}\n\n"
+        except Overloaded as e:
+            error = {'detail': str(e), 'status': e.status_code, 'retry_after': e.retry_after}
+            yield f"event: error\ndata: {json.dumps(error)}\n\n"
+        except Exception as e:
+            print(f"Error: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'detail': f'AI processing error: {str(e)}'})}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/chat/batch", response_model=BatchResponse)
+async def chat_batch(request: BatchRequest):
+    """
+    Answer a list of independent questions (e.g. nightly reports) against
+    one inventory snapshot. Local questions are answered directly and the
+    rest run against the model in parallel; results keep the input order.
+    """
+    if not request.token:
+        raise HTTPException(status_code=401, detail="Authentication token required")
+    
+    questions = request.questions
+    if any(not q.strip() for q in questions):
+        raise HTTPException(status_code=400, detail="Questions cannot be empty")
+    
+    from datetime import datetime
+    started = time.perf_counter()
+    results, version = await ai_engine.batch(questions, request.token, request.max_concurrency)
+    mark_handled()
+    return BatchResponse(
+        results=results,
+        total_ms=round((time.perf_counter() - started) * 1000, 3),
+        snapshot_version=version,
+        timestamp=datetime.now().isoformat()
+    )
+
+@app.post("/cache/invalidate")
+def invalidate_cache(request: InvalidateRequest, x_ai_service_secret: Optional[str] = Header(None)):
+    """
+    Mark cached inventory snapshots stale after a backend write, so the
+    next request delta-syncs them (`drop` forces a full reseed).
+    Invalidates every tenant unless `user_id` is given.
+    """
+    if AI_SERVICE_SECRET and x_ai_service_secret != AI_SERVICE_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid service secret")
+    
+    key = f"user:{request.user_id}" if request.user_id else None
+    return {"invalidated": snapshot_cache.invalidate(key, drop=request.drop)}
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "snapshots": snapshot_cache.stats(),
+        "answers": ai_engine.answers.stats(),
+        "sessions": ai_engine.sessions.stats(),
+        "prefixes": gemini_engine.prefixes.stats()
+    }
+
+@app.get("/router/stats")
+def router_stats():
+    return {"routes": ai_engine.router.route_stats(), "flights": ai_engine.flights.stats()}
+
+@app.get("/llm/stats")
+def llm_stats():
+    """Model call scheduler: queue depth, wait times, shedding and retries"""
+    return gemini_engine.scheduler.stats()
+
+@registry.collector
+def service_gauges():
+    snapshots = snapshot_cache.stats()
+    answers = ai_engine.answers.stats()
+    prefixes = gemini_engine.prefixes.stats()
+    prefix_lookups = prefixes['hits'] + prefixes['registrations']
+    scheduler = gemini_engine.scheduler.stats()
+    return [
+        ("ai_cache_hit_ratio", "Hit ratio per cache", ("cache",), {
+            ("snapshots",): snapshots['hit_ratio'],
+            ("answers",): answers['hit_ratio'],
+            ("prefixes",): round(prefixes['hits'] / prefix_lookups, 4) if prefix_lookups else 0.0,
+        }),
+        ("ai_cache_entries", "Entries per cache", ("cache",), {
+            ("snapshots",): snapshots['entries'],
+            ("answers",): answers['entries'],
+            ("prefixes",): prefixes['entries'],
+            ("sessions",): ai_engine.sessions.stats()['sessions'],
+        }),
+        ("ai_snapshot_bytes", "Backend payload bytes held by cached snapshots", (), {(): snapshots['bytes']}),
+        ("ai_coalesced_requests", "Requests that joined an in-flight call", ("kind",), {
+            ("snapshot",): snapshots['coalesced'],
+            ("answer",): ai_engine.flights.stats()['coalesced'],
+        }),
+        ("ai_llm_in_flight", "Model calls holding a slot", (), {(): scheduler['in_flight']}),
+        ("ai_llm_queue_depth", "Model calls waiting for a slot", ("priority",), {
+            (name,): depth for name, depth in scheduler['queue_depth'].items()
+        }),
+        ("ai_llm_shed", "Model calls refused by admission control", ("status",), {
+            ("429",): scheduler['shed_429'],
+            ("503",): scheduler['shed_503'],
+        }),
+    ]
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition: stage latencies, payload and prompt sizes, cache ratios"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 def health_check():
+    """Liveness: the process is up and serving; says nothing about the model or data"""
     return {
         "status": "healthy",
-        "model": "gemini-2.0-flash-exp",
-        "backend_url": BACKEND_URL
+        "model": ai_engine.provider.model_name,
+        "backend_url": BACKEND_URL,
+        "uptime_s": round(time.monotonic() - STARTED_AT, 3)
     }
 
+@app.get("/ready")
+def readiness_check():
+    """
+    Readiness: the model client is loaded, snapshots kept on disk are
+    restored and, with WARMUP_TOKEN, that tenant's snapshot is cached.
+    With several workers the snapshot owner must be serving too. 503
+    until then.
+    """
+    checks = warm_up.checks()
+    if snapshot_store is not None:
+        checks['restored'] = snapshot_store.restored
+    if AI_WORKERS > 1:
+        checks['snapshot_owner'] = os.path.exists(snapshot_cache.socket_path)
+    ready = all(checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "starting",
+            "checks": checks,
+            "warm_up_s": warm_up.seconds,
+            "error": warm_up.error
+        }
+    )
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8001))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    if AI_WORKERS > 1:
+        Supervisor(app, AI_WORKERS, snapshot_cache.directory, backend_client, port=port).run()
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
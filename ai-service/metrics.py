@@ -0,0 +1,237 @@
+import bisect
+import contextvars
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(9))  # 1 KiB .. 64 MiB
+TOKENS_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, values)) + '}'
+
+
+class Histogram:
+    """Prometheus-style histogram with fixed buckets, one series per label set"""
+
+    def __init__(self, name, help_text, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, n in zip((*self.buckets, '+Inf'), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels((*self.label_names, 'le'), (*labels, bound))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.series = {}
+
+    def inc(self, *labels, amount=1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self.series.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Registry:
+    """Metrics plus gauge collectors evaluated at scrape time"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """Register `func()` returning gauges as `[(name, help, label_names, {labels: value})]`"""
+        self.collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collect in self.collectors:
+            try:
+                gauges = collect()
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, help_text, label_names, series in gauges:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in series.items():
+                    lines.append(f"{name}{_labels(label_names, labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+stage_seconds = registry.histogram('ai_stage_seconds', 'Time spent per request stage', labels=('stage',))
+request_seconds = registry.histogram('ai_request_seconds', 'End-to-end request latency', labels=('path', 'status'))
+prompt_tokens = registry.histogram(
+    'ai_prompt_tokens', 'Estimated prompt tokens per section', labels=('section',), buckets=TOKENS_BUCKETS
+)
+payload_bytes = registry.histogram(
+    'ai_backend_payload_bytes', 'Backend response body size', labels=('endpoint',), buckets=BYTES_BUCKETS
+)
+
+# Stage timings of the current request, for the Server-Timing header
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as request stage `name`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, name)
+        timings = request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def server_timing(timings):
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+class SlowRequestProfiler:
+    """Sampled cProfile of requests; dumps the profile of slow ones.
+
+    A fraction `sample_rate` of requests is profiled (one at a time, as
+    cProfile is process-wide) and the stats are written to `directory`
+    when the request took longer than `threshold_ms`. Disabled when the
+    threshold is 0.
+    """
+
+    def __init__(self, threshold_ms=None, sample_rate=None, directory=None):
+        self.threshold_ms = threshold_ms if threshold_ms is not None else float(os.getenv("PROFILE_SLOW_MS", 0))
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("PROFILE_SAMPLE_RATE", 0.01))
+        self.directory = directory or os.getenv("PROFILE_DIR", "profiles")
+        self.lock = threading.Lock()
+        self.active = False
+        self.dumps = 0
+
+    def start(self):
+        """Return a running profiler for this request, or None"""
+        if not self.threshold_ms or random.random() >= self.sample_rate:
+            return None
+        with self.lock:
+            if self.active:
+                return None
+            self.active = True
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this process
+            self.active = False
+            return None
+        return profiler
+
+    def finish(self, profiler, path, seconds):
+        profiler.disable()
+        self.active = False
+        if seconds * 1000 < self.threshold_ms:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"{int(time.time() * 1000)}{path.replace('/', '_')}.prof"
+            profiler.dump_stats(os.path.join(self.directory, name))
+            self.dumps += 1
+        except OSError as e:
+            print(f"Error writing profile: {e}")
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request latency histogram, Server-Timing header and
+    the sampled slow-request profiler"""
+
+    def __init__(self, app, profiler=None):
+        self.app = app
+        self.profiler = profiler or SlowRequestProfiler()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        timings = {}
+        token = request_timings.set(timings)
+        started = time.perf_counter()
+        profiler = self.profiler.start()
+        status = [500]
+
+        async def send_with_timing(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                now = time.perf_counter()
+                handled = timings.pop('_handled', None)
+                if handled is not None:
+                    timings['serialize'] = now - handled
+                timings['total'] = now - started
+                message['headers'] = [
+                    *message.get('headers', []),
+                    (b'server-timing', server_timing(timings).encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - started
+            # Label by path only for routed requests, so unknown URLs cannot grow the series
+            path = scope['path'] if 'endpoint' in scope else 'other'
+            request_seconds.observe(elapsed, path, status[0])
+            if profiler is not None:
+                self.profiler.finish(profiler, path, elapsed)
+            request_timings.reset(token)
+
+
+def mark_handled():
+    """Mark the end of endpoint work; the rest until the response starts is serialization"""
+    timings = request_timings.get()
+    if timings is not None:
+        timings['_handled'] = time.perf_counter()
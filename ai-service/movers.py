@@ -0,0 +1,376 @@
+import os
+import numpy as np
+from analytics import ProductFrame, top_k
+from transaction_store import DAY_MS, TransactionStore, days_ago_ms, now_ms, to_epoch_ms
+
+
+HOUR_MS = 60 * 60 * 1000
+METRICS = ('units', 'revenue')
+
+
+def _aggregate(codes, units, revenue):
+    """Sum `units` and `revenue` per distinct code; returns sparse `(codes, units, revenue)`"""
+    codes, inverse = np.unique(codes, return_inverse=True)
+    return (
+        codes,
+        np.bincount(inverse, weights=units, minlength=len(codes)).astype(np.int64),
+        np.bincount(inverse, weights=revenue, minlength=len(codes)),
+    )
+
+
+class Bucket:
+    """Per-product units and revenue sold in one hour, as sparse arrays.
+
+    `error_units` / `error_revenue` bound what was dropped when the bucket
+    was pruned to a sketch capacity (0 while exact).
+    """
+
+    __slots__ = ('codes', 'units', 'revenue', 'error_units', 'error_revenue')
+
+    def __init__(self, codes, units, revenue):
+        self.codes, self.units, self.revenue = codes, units, revenue
+        self.error_units = 0
+        self.error_revenue = 0.0
+
+    def merge(self, codes, units, revenue):
+        self.codes, self.units, self.revenue = _aggregate(
+            np.concatenate([self.codes, codes]),
+            np.concatenate([self.units, units]),
+            np.concatenate([self.revenue, revenue]),
+        )
+
+    def prune(self, capacity):
+        """Keep the `capacity` biggest products by units and by revenue (a
+        mergeable Misra-Gries / Space-Saving summary); the largest dropped
+        count becomes the error bound"""
+        if not capacity or len(self.codes) <= capacity:
+            return
+        keep = np.zeros(len(self.codes), dtype=bool)
+        keep[top_k(self.units, capacity)] = True
+        keep[top_k(self.revenue, capacity)] = True
+        self.error_units += int(self.units[~keep].max(initial=0))
+        self.error_revenue += float(self.revenue[~keep].max(initial=0))
+        self.codes, self.units, self.revenue = self.codes[keep], self.units[keep], self.revenue[keep]
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.units.nbytes + self.revenue.nbytes
+
+
+class Window:
+    """Running per-product totals over the buckets from `lo` onwards"""
+
+    def __init__(self, days, lo, size):
+        self.days = days
+        self.lo = lo
+        self.units = np.zeros(size, dtype=np.int64)
+        self.revenue = np.zeros(size)
+        self.error_units = 0
+        self.error_revenue = 0.0
+
+    def add(self, bucket, sign=1):
+        self.units[bucket.codes] += sign * bucket.units
+        self.revenue[bucket.codes] += sign * bucket.revenue
+        self.error_units += sign * bucket.error_units
+        self.error_revenue += sign * bucket.error_revenue
+
+    def extend(self, buckets):
+        """Add several new buckets at once"""
+        if not buckets:
+            return
+        codes = np.concatenate([bucket.codes for bucket in buckets])
+        self.units += np.bincount(
+            codes, weights=np.concatenate([bucket.units for bucket in buckets]), minlength=len(self.units)
+        ).astype(np.int64)
+        self.revenue += np.bincount(
+            codes, weights=np.concatenate([bucket.revenue for bucket in buckets]), minlength=len(self.units)
+        )
+        self.error_units += sum(bucket.error_units for bucket in buckets)
+        self.error_revenue += sum(bucket.error_revenue for bucket in buckets)
+
+    def pad(self, size):
+        grow = size - len(self.units)
+        if grow > 0:
+            self.units = np.concatenate([self.units, np.zeros(grow, dtype=np.int64)])
+            self.revenue = np.concatenate([self.revenue, np.zeros(grow)])
+
+
+class MoverIndex:
+    """Streaming top-K products by units sold or revenue.
+
+    OUT transactions are folded in from a `TransactionStore` as they
+    arrive, never rescanned. Each product keeps all-time totals, and the
+    most recent `max(WINDOW_DAYS)` days are kept as a ring of hourly
+    buckets holding only the products sold in that hour. Every window in
+    `WINDOW_DAYS` has running per-product totals: folded-in buckets are
+    added and buckets that slide out are subtracted, so windows are exact
+    to the hour. A top-K query only selects from those totals (argpartition
+    over the candidates plus a sort of K) and is cached until the next
+    change. Queries can be restricted to one category or supplier.
+
+    Revenue is units times the product's list price when the sale is
+    folded in (0 while the product is not in the frame given).
+
+    Memory does not grow with the number of transactions: the totals are
+    one entry per product and old buckets are dropped. For very large
+    catalogues `capacity` (MOVERS_SKETCH_CAPACITY) caps each bucket to its
+    biggest products, so the ring holds at most hours x capacity entries;
+    window totals may then undercount by up to `error(days)`.
+    """
+
+    WINDOW_DAYS = (1, 7, 30, 90)
+    BUCKET_MS = HOUR_MS
+
+    def __init__(self, store, capacity=None, window_days=None):
+        self.store = store
+        self.capacity = capacity if capacity is not None else int(os.getenv("MOVERS_SKETCH_CAPACITY", 0))
+        self.window_days = tuple(sorted(window_days or self.WINDOW_DAYS))
+        self.reset()
+
+    @classmethod
+    def of(cls, store):
+        return store if isinstance(store, cls) else cls(TransactionStore.of(store))
+
+    @classmethod
+    def attach(cls, replica):
+        """Return the index over the replica's transaction store, building it once"""
+        index = replica.derived.get('mover_index')
+        if index is None:
+            index = cls(TransactionStore.attach(replica))
+            replica.derived['mover_index'] = index
+        return index
+
+    def follow(self, store):
+        """Continue from a newer copy of the same history (e.g. the next
+        published snapshot) instead of starting over"""
+        self.store = store
+        self.results_version = None
+        return self
+
+    def reset(self):
+        # Rows folded in, the last timestamp folded and the rows before it
+        self.consumed = 0
+        self.last_ts = None
+        self.before_last = 0
+        self.now = self.now_bucket = None
+        self.version = 0
+        self.units = np.zeros(0, dtype=np.int64)
+        self.revenue = np.zeros(0)
+        self.prices = np.zeros(0)
+        self.ring = {}
+        self.windows = {}
+        self.frame = None
+        self.rows = None
+        self.groups = {}
+        self.results = {}
+        self.results_version = None
+
+    def _pad(self, size):
+        # New products may have appeared since the last update
+        grow = size - len(self.units)
+        if grow > 0:
+            self.units = np.concatenate([self.units, np.zeros(grow, dtype=np.int64)])
+            self.revenue = np.concatenate([self.revenue, np.zeros(grow)])
+            self.prices = np.concatenate([self.prices, np.zeros(grow)])
+        for window in self.windows.values():
+            window.pad(size)
+
+    def _use_frame(self, frame):
+        """Map product codes to `frame` rows and take list prices from it"""
+        product_ids = self.store.product_ids
+        if frame is None or (frame is self.frame and len(self.rows) == len(product_ids)):
+            return
+        frame = ProductFrame.of(frame)
+        ids = frame.product_ids()
+        rows = {pid: row for row, pid in enumerate(ids)}
+        self.rows = np.fromiter((rows.get(pid, -1) for pid in product_ids), dtype=np.int64, count=len(product_ids))
+        known = self.rows >= 0
+        self.prices[:len(known)][known] = frame.price[self.rows[known]]
+        self.frame = frame
+        self.groups = {}
+        self.results_version = None
+
+    # -- folding ----------------------------------------------------------
+
+    def _lo(self, days, now_bucket):
+        """First bucket of a `days` window ending with `now_bucket`"""
+        return now_bucket - days * DAY_MS // self.BUCKET_MS + 1
+
+    def _advance(self, now_bucket):
+        """Slide every window to end at `now_bucket` and drop expired buckets"""
+        if now_bucket == self.now_bucket:
+            return
+        if self.now_bucket is None:
+            for days in self.window_days:
+                self.windows[days] = Window(days, self._lo(days, now_bucket), len(self.units))
+        else:
+            for window in self.windows.values():
+                lo = self._lo(window.days, now_bucket)
+                if lo - window.lo < len(self.ring):
+                    expired = (self.ring.get(key) for key in range(window.lo, lo))
+                else:
+                    expired = (bucket for key, bucket in self.ring.items() if window.lo <= key < lo)
+                for bucket in expired:
+                    if bucket is not None:
+                        window.add(bucket, -1)
+                window.lo = lo
+        self.now_bucket = now_bucket
+        horizon = self.windows[self.window_days[-1]].lo
+        for key in [key for key in self.ring if key < horizon]:
+            del self.ring[key]
+        self.version += 1
+
+    def _fold(self, lo, hi):
+        store = self.store
+        codes = store.product[lo:hi]
+        out = store.is_out[lo:hi] & (codes >= 0)
+        codes = codes[out].astype(np.int64)
+        units = store.quantity[lo:hi][out]
+        revenue = units * self.prices[codes]
+        self.units += np.bincount(codes, weights=units, minlength=len(self.units)).astype(np.int64)
+        self.revenue += np.bincount(codes, weights=revenue, minlength=len(self.units))
+
+        # Sales within the ring, summed per (hour, product) in one pass
+        size = max(len(self.units), 1)
+        buckets = store.timestamp[lo:hi][out] // self.BUCKET_MS
+        recent = buckets >= self.windows[self.window_days[-1]].lo
+        keys, units, revenue = _aggregate(buckets[recent] * size + codes[recent], units[recent], revenue[recent])
+        hours, codes = keys // size, keys % size
+        added = []
+        starts = np.flatnonzero(np.diff(hours, prepend=-1))
+        for start, end in zip(starts, [*starts[1:], len(hours)]):
+            key = int(hours[start])
+            delta = (codes[start:end], units[start:end], revenue[start:end])
+            bucket = self.ring.get(key)
+            if bucket is None:
+                bucket = self.ring[key] = Bucket(*delta)
+                bucket.prune(self.capacity)
+                added.append((key, bucket))
+                continue
+            # More sales in an hour already folded in (e.g. the current one)
+            windows = [window for window in self.windows.values() if key >= window.lo]
+            for window in windows:
+                window.add(bucket, -1)
+            bucket.merge(*delta)
+            bucket.prune(self.capacity)
+            for window in windows:
+                window.add(bucket)
+        for window in self.windows.values():
+            window.extend([bucket for key, bucket in added if key >= window.lo])
+
+    def update(self, frame=None, now=None):
+        """Fold in transactions added to the store since the last call and
+        slide the windows to `now` (epoch ms, default: the current time).
+        `frame` supplies list prices and categories / suppliers."""
+        store = self.store
+        ts = store.timestamp[:store.n]
+        frame = frame if frame is not None else self.frame
+        now = to_epoch_ms(now if now is not None else now_ms())
+        now_bucket = now // self.BUCKET_MS
+        if self.last_ts is not None and (
+            store.n < self.consumed or int(np.searchsorted(ts, self.last_ts)) != self.before_last
+        ) or self.now_bucket is not None and now_bucket < self.now_bucket:
+            # Transactions arrived before ones already folded in, or the
+            # clock went back past buckets already dropped: start over
+            self.reset()
+        self._pad(len(store.product_ids))
+        self._use_frame(frame)
+        self._advance(now_bucket)
+        self.now = now
+        if store.n > self.consumed:
+            self._fold(self.consumed, store.n)
+            self.consumed = store.n
+            self.last_ts = int(ts[-1])
+            self.before_last = int(np.searchsorted(ts, self.last_ts))
+            self.version += 1
+        if self.version != self.results_version:
+            self.results = {}
+            self.results_version = self.version
+        return self
+
+    # -- queries ----------------------------------------------------------
+
+    def totals(self, days=None):
+        """Per-product-code `(units, revenue)` sold over the last `days` days
+        (all time when None). Windows outside `WINDOW_DAYS` are a one-off
+        range query on the store."""
+        if days is None:
+            return self.units, self.revenue
+        window = self.windows.get(days)
+        if window is not None:
+            return window.units, window.revenue
+        _, units = self.store.movement(days_ago_ms(days, self.now))
+        return units, units * self.prices[:len(units)]
+
+    def error(self, days=None):
+        """Upper bound of the units and revenue a window may undercount by
+        (0 unless buckets are capped)"""
+        window = self.windows.get(days)
+        return (window.error_units, window.error_revenue) if window is not None else (0, 0.0)
+
+    def _group(self, field, label):
+        """Product codes of one category or supplier of the current frame"""
+        if self.frame is None:
+            raise ValueError(f"grouping by {field} needs the product frame")
+        if field not in self.groups:
+            labels = self.frame.categories if field == 'category' else self.frame.suppliers
+            column = getattr(self.frame, field)
+            known = np.flatnonzero(self.rows >= 0)
+            groups = column[self.rows[known]]
+            order = np.argsort(groups, kind='stable')
+            bounds = np.searchsorted(groups[order], np.arange(len(labels) + 1))
+            self.groups[field] = {
+                labels[g]: known[order[bounds[g]:bounds[g + 1]]] for g in range(len(labels))
+            }
+        return self.groups[field].get(label, np.empty(0, dtype=np.int64))
+
+    def top(self, k, days=None, by='units', category=None, supplier=None, frame=None, now=None):
+        """The `k` products that sold the most `by` units or revenue over the
+        last `days` days (all time when None), optionally within one
+        category or supplier, as `{'name', 'quantity', 'revenue'}` dicts"""
+        if by not in METRICS:
+            raise ValueError(f"unknown metric: {by}")
+        self.update(frame, now)
+        key = (k, days, by, category, supplier)
+        if key not in self.results:
+            units, revenue = self.totals(days)
+            values = units if by == 'units' else revenue
+            if category is not None:
+                candidates = self._group('category', category)
+            elif supplier is not None:
+                candidates = self._group('supplier', supplier)
+            else:
+                candidates = np.arange(len(values))
+            candidates = candidates[values[candidates] > 0]
+            names = self.store.product_names
+            self.results[key] = [
+                {'name': names[code], 'quantity': int(units[code]), 'revenue': round(float(revenue[code]), 2)}
+                for code in top_k(values, k, candidates)
+            ]
+        return self.results[key]
+
+    def top_by_group(self, field, days=None, by='units', frame=None, now=None):
+        """Best seller of every category or supplier: label -> dict as in `top`"""
+        self.update(frame, now)
+        key = ('groups', field, days, by)
+        if key not in self.results:
+            self._group(field, None)
+            best = {}
+            for label in self.groups[field]:
+                top = self.top(1, days, by, **{field: label})
+                if top:
+                    best[label] = top[0]
+            self.results[key] = best
+        return self.results[key]
+
+    def stats(self):
+        return {
+            'buckets': len(self.ring),
+            'bucket_entries': sum(len(bucket.codes) for bucket in self.ring.values()),
+            'bytes': (
+                sum(bucket.nbytes for bucket in self.ring.values())
+                + self.units.nbytes + self.revenue.nbytes + self.prices.nbytes
+                + sum(w.units.nbytes + w.revenue.nbytes for w in self.windows.values())
+            ),
+            'capacity': self.capacity,
+        }
@@ -0,0 +1,150 @@
+import os
+import re
+from tokens import estimate_tokens, take_within_budget
+
+
+SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+|\n+')
+
+
+def truncate_to_tokens(text, budget, keep_tail=False):
+    """Cut `text` to roughly `budget` tokens at a word boundary.
+
+    With `keep_tail`, the start and the end are kept around an omission
+    marker (long pasted messages usually end with the actual question).
+    """
+    if estimate_tokens(text) <= budget:
+        return text
+    chars = max(0, budget * 4)
+    if keep_tail:
+        marker = f"\n[... {len(text) - chars} characters omitted ...]\n"
+        room = max(0, chars - len(marker))
+        head, tail = text[:room // 2], text[len(text) - room // 2:] if room // 2 else ''
+        return head.rsplit(' ', 1)[0] + marker + tail.split(' ', 1)[-1]
+    return text[:max(0, chars - 1)].rsplit(' ', 1)[0] + '…'
+
+
+def compact_turn(text, budget):
+    """Extractive summary of one turn: its leading sentences within `budget`"""
+    sentences = [s.strip() for s in SENTENCE_END_RE.split(text) if s.strip()]
+    kept = take_within_budget(sentences, budget)
+    if not kept:
+        return truncate_to_tokens(text, budget)
+    summary = ' '.join(kept)
+    return summary if len(kept) == len(sentences) else summary + ' …'
+
+
+class PromptAssembler:
+    """Assemble the Gemini conversation within per-section token budgets.
+
+    Sections are the system prompt (with the two acknowledgement turns),
+    the inventory context, the conversation history and the user message.
+    History is filled newest first: turns are kept verbatim while they
+    fit, then older turns are compacted to their leading sentences, and
+    whatever still does not fit is dropped. Compaction is deterministic
+    and never calls a model. `assemble` reports per-section token counts.
+    """
+
+    SYSTEM_ACK = "I understand. I'm your inventory management assistant with access to COMPLETE real-time data. How can I help you today?"
+    CONTEXT_ACK = "I've received the complete inventory data including all products and transactions. I can now answer any question about your inventory. What would you like to know?"
+
+    # Below this many tokens left, older turns are dropped instead of compacted
+    MIN_COMPACT_TOKENS = 8
+
+    def __init__(self, system_budget=None, inventory_budget=None, history_budget=None,
+                 user_budget=None, history_turns=None, compact_turn_tokens=None):
+        self.budgets = {
+            'system': system_budget or int(os.getenv("PROMPT_SYSTEM_TOKENS", 1000)),
+            'inventory': inventory_budget or int(os.getenv("CONTEXT_TOKEN_BUDGET", 8000)),
+            'history': history_budget or int(os.getenv("PROMPT_HISTORY_TOKENS", 1500)),
+            'user': user_budget or int(os.getenv("PROMPT_USER_TOKENS", 1000)),
+        }
+        self.history_turns = history_turns or int(os.getenv("PROMPT_HISTORY_TURNS", 10))
+        self.compact_turn_tokens = compact_turn_tokens or int(os.getenv("PROMPT_COMPACT_TURN_TOKENS", 60))
+
+    def compact_history(self, conversation_history):
+        """Fit the history into its budget. Returns `(turns, compacted)`
+        with `turns` as `(role, text)` pairs, oldest first."""
+        messages = [
+            m for m in (conversation_history or [])
+            if m.get('role') in ('user', 'assistant')
+        ][-self.history_turns:]
+
+        remaining = self.budgets['history']
+        turns, compacted, compacting = [], 0, False
+        for message in reversed(messages):
+            text = message.get('content', '') or ''
+            cost = estimate_tokens(text) + 1
+            if not compacting and cost <= remaining:
+                turns.append((message['role'], text))
+                remaining -= cost
+                continue
+            # Once one turn is compacted, everything older is too
+            compacting = True
+            if remaining <= self.MIN_COMPACT_TOKENS:
+                break
+            summary = compact_turn(text, min(self.compact_turn_tokens, remaining - 1))
+            cost = estimate_tokens(summary) + 1
+            if not summary or cost > remaining:
+                break
+            turns.append((message['role'], summary))
+            remaining -= cost
+            compacted += summary != text.strip()
+        turns.reverse()
+        return turns, compacted
+
+    def prefix(self, system_prompt, inventory_context):
+        """The static part of the conversation, identical across the turns
+        of a session while the snapshot is unchanged. Returns `(messages, token_counts)`."""
+        system_prompt = truncate_to_tokens(system_prompt, self.budgets['system'])
+        inventory_context = truncate_to_tokens(inventory_context, self.budgets['inventory'], keep_tail=True)
+        messages = [
+            {"role": "user", "parts": [system_prompt]},
+            {"role": "model", "parts": [self.SYSTEM_ACK]},
+            {"role": "user", "parts": [f"Here's the COMPLETE inventory database:\n{inventory_context}"]},
+            {"role": "model", "parts": [self.CONTEXT_ACK]},
+        ]
+        return messages, {
+            'system': estimate_tokens(system_prompt) + estimate_tokens(self.SYSTEM_ACK) + estimate_tokens(self.CONTEXT_ACK),
+            'inventory': estimate_tokens(messages[2]['parts'][0]),
+        }
+
+    def delta(self, user_message, conversation_history=None, supplement=None):
+        """The per-turn part: compacted history and the user message, with
+        optional extra inventory lines for this question. Returns `(messages, token_counts)`."""
+        user_message = truncate_to_tokens(user_message, self.budgets['user'], keep_tail=True)
+        turns, compacted = self.compact_history(conversation_history)
+        messages = [
+            {"role": "user" if role == 'user' else "model", "parts": [text]}
+            for role, text in turns
+        ]
+        final = f"{supplement}\n\n{user_message}" if supplement else user_message
+        messages.append({"role": "user", "parts": [final]})
+        return messages, {
+            'inventory': estimate_tokens(supplement),
+            'history': sum(estimate_tokens(text) for _, text in turns),
+            'user': estimate_tokens(user_message),
+            'history_turns': len(turns),
+            'compacted_turns': compacted,
+        }
+
+    def assemble(self, system_prompt, inventory_context, user_message, conversation_history=None, supplement=None):
+        """Build the conversation. Returns `(prefix, delta, token_counts)`;
+        the model sees `prefix + delta`. `sent` starts equal to `total`
+        and is reduced by the caller when the provider already holds the prefix."""
+        prefix, prefix_counts = self.prefix(system_prompt, inventory_context)
+        delta, counts = self.delta(user_message, conversation_history, supplement)
+        sections = {
+            'system': prefix_counts['system'],
+            'inventory': prefix_counts['inventory'] + counts['inventory'],
+            'history': counts['history'],
+            'user': counts['user'],
+        }
+        total = sum(sections.values())
+        return prefix, delta, {
+            **sections,
+            'total': total,
+            'prefix': sum(prefix_counts.values()),
+            'sent': total,
+            'history_turns': counts['history_turns'],
+            'compacted_turns': counts['compacted_turns'],
+        }
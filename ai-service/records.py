@@ -0,0 +1,230 @@
+import codecs
+import json
+import re
+import sys
+from collections.abc import Mapping
+
+
+_MISSING = object()
+
+
+class Record(Mapping):
+    """Compact, read-only record projected from a backend document.
+
+    Only the fields named in `__slots__` are kept, so a record costs a few
+    pointers instead of a full dict. Records read like the dicts they were
+    decoded from (`get`, `[]`, `in`, iteration), so the engines need no
+    changes; absent fields behave like missing keys.
+    """
+
+    __slots__ = ()
+    # Fields decoded into a nested record type
+    NESTED = {}
+    # Fields whose string values repeat across records and are interned
+    INTERNED = frozenset()
+    # Whether equal ids share one instance within a decode (populated refs)
+    SHARED = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Per-field (name, slot setter, nested type, interned) decode plan
+        cls._plan = tuple(
+            (field, getattr(cls, field).__set__, cls.NESTED.get(field), field in cls.INTERNED)
+            for field in cls.__slots__
+        )
+
+    @classmethod
+    def decode(cls, doc, pool=None):
+        """Project a decoded JSON object onto this record type"""
+        if not isinstance(doc, dict):
+            return doc
+        if cls.SHARED and pool is not None:
+            key = (cls, doc.get('_id'))
+            record = pool.get(key)
+            if record is not None:
+                return record
+        record = cls.__new__(cls)
+        for field, set_slot, nested, interned in cls._plan:
+            value = doc.get(field, _MISSING)
+            if value is _MISSING:
+                continue
+            if nested is not None:
+                value = nested.decode(value, pool)
+            elif interned and value.__class__ is str:
+                value = sys.intern(value)
+            set_slot(record, value)
+        if cls.SHARED and pool is not None:
+            pool[key] = record
+        return record
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __getitem__(self, key):
+        if key in self.__slots__:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self.__slots__:
+            return getattr(self, key, default)
+        return default
+
+    def __iter__(self):
+        return (field for field in self.__slots__ if hasattr(self, field))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __bool__(self):
+        # `record or {}` is common; stop at the first field present
+        return next(iter(self), _MISSING) is not _MISSING
+
+    def _values(self):
+        return tuple(getattr(self, field, Record) for field in self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is type(self):
+            return self._values() == other._values()
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (self.__class__.decode, (dict(self),))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+class UserRef(Record):
+    """Populated `performedBy` user"""
+
+    __slots__ = ('_id', 'name')
+    INTERNED = frozenset(('_id', 'name'))
+    SHARED = True
+
+
+class ProductRef(Record):
+    """Populated `product` of a transaction"""
+
+    __slots__ = ('_id', 'name', 'sku', 'category')
+    INTERNED = frozenset(('_id', 'name', 'sku', 'category'))
+    SHARED = True
+
+
+class ProductRecord(Record):
+    __slots__ = (
+        '_id', 'name', 'sku', 'category', 'price', 'quantity', 'reorderLevel',
+        'supplier', 'isActive', 'createdAt', 'updatedAt'
+    )
+    INTERNED = frozenset(('category', 'supplier'))
+
+
+class TransactionRecord(Record):
+    __slots__ = (
+        '_id', 'product', 'type', 'quantity', 'transactionDate',
+        'performedBy', 'notes', 'updatedAt'
+    )
+    NESTED = {'product': ProductRef, 'performedBy': UserRef}
+    INTERNED = frozenset(('type',))
+
+
+class ArrayStream:
+    """Incrementally decode the elements of the `key` array in a JSON body.
+
+    Bytes are fed as they arrive; each element is decoded as soon as it is
+    complete and the text before it is dropped, so the raw body and the
+    full document tree are never held at once. Bodies without such an
+    array are buffered and parsed whole on `close()`.
+    """
+
+    WHITESPACE = ' \t\n\r'
+
+    def __init__(self, key='data'):
+        self.start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self.key = key
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.in_array = False
+        self.done = False
+
+    def feed(self, chunk, final=False):
+        """Add bytes, returning the elements completed by them"""
+        self.buffer += self.text.decode(chunk, final)
+        if self.done:
+            return []
+        if not self.in_array:
+            match = self.start.search(self.buffer)
+            if match is None:
+                return []
+            self.in_array = True
+            self.pos = match.end()
+
+        elements = []
+        buffer, pos = self.buffer, self.pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in self.WHITESPACE:
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ',':
+                pos += 1
+                continue
+            if pos >= len(buffer):
+                break
+            if buffer[pos] == ']':
+                self.done = True
+                pos += 1
+                break
+            try:
+                element, end = self.decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                break  # incomplete element, wait for more bytes
+            elements.append(element)
+            pos = end
+
+        self.buffer, self.pos = buffer[pos:], 0
+        return elements
+
+    def close(self, default=None):
+        """Finish the stream. Returns `(elements, value)`: the remaining
+        elements, or when the body had no such array, its `key` value."""
+        elements = self.feed(b'', final=True)
+        if self.in_array:
+            if not self.done:
+                raise json.JSONDecodeError("Unterminated array", self.buffer, self.pos)
+            return elements, None
+        document = json.loads(self.buffer)
+        value = document.get(self.key, default) if isinstance(document, dict) else default
+        return [], value
+
+
+async def decode_records(chunks, decode, default=None):
+    """Stream-decode a `{..., "data": [...]}` body into records.
+
+    `chunks` is an async iterator of bytes and `decode(doc, pool)` projects
+    one element. Returns `(data, size)` with `size` the body length in bytes.
+    """
+    stream = ArrayStream('data')
+    pool = {}
+    records, size = [], 0
+    async for chunk in chunks:
+        size += len(chunk)
+        records.extend(decode(doc, pool) for doc in stream.feed(chunk))
+    elements, value = stream.close(default)
+    if not stream.in_array:
+        return value, size
+    records.extend(decode(doc, pool) for doc in elements)
+    return records, size
+
+
+DEFAULT_DECODERS = {
+    'products': ProductRecord.decode,
+    'transactions': TransactionRecord.decode,
+}
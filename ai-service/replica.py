@@ -0,0 +1,261 @@
+import asyncio
+import itertools
+import os
+from datetime import datetime, timedelta
+
+
+# Replica versions are unique process-wide, so caches keyed on a version
+# can never confuse two tenants or a replica rebuilt after invalidation
+_versions = itertools.count(1)
+
+# Seconds each delta query reaches back behind its cursor
+SYNC_OVERLAP = float(os.getenv("SYNC_OVERLAP", 300))
+
+
+def behind(cursor, seconds):
+    """ISO timestamp `seconds` before `cursor` (unchanged if unparseable)"""
+    try:
+        moment = datetime.fromisoformat(cursor.replace('Z', '+00:00')) - timedelta(seconds=seconds)
+    except (AttributeError, ValueError):
+        return cursor
+    return moment.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+class InventoryReplica:
+    """In-memory replica of one tenant's products and transactions.
+
+    Seeded once with full collections, then refreshed with deltas:
+    products changed since the newest `updatedAt` seen (the backend
+    includes soft-deleted ones so they can be dropped) and transactions
+    dated on or after the newest `transactionDate` seen. Cursors come from
+    server timestamps, never the local clock. Each delta query reaches back
+    `overlap` seconds behind its cursor, so a record committed late with an
+    earlier timestamp (concurrent writers, clock skew between backend
+    instances) is still picked up; records seen again are deduplicated by
+    `_id`. `version` changes only when the replicated data actually changes.
+    """
+
+    def __init__(self):
+        self.products = {}
+        self.transactions = {}
+        self.dashboard = {}
+        self.dashboard_validators = None
+        self.product_cursor = None
+        self.transaction_cursor = None
+        self.version = next(_versions)
+        self.seeded = False
+        self.overlap = SYNC_OVERLAP
+        self.record_bytes = {'products': 0, 'transactions': 0}
+        self.lock = asyncio.Lock()
+        self.listeners = []
+        # Structures derived from the replica (indexes, frames), each kept
+        # current by its own listener
+        self.derived = {}
+        self._lists = None
+
+    @property
+    def size(self):
+        """Approximate payload bytes held by the replica"""
+        return (
+            self.record_bytes['products'] * len(self.products) +
+            self.record_bytes['transactions'] * len(self.transactions)
+        )
+
+    def subscribe(self, listener):
+        """Register `listener(changes)` to be called after each applied delta"""
+        self.listeners.append(listener)
+
+    def apply_products(self, products):
+        """Upsert changed products, dropping soft-deleted ones"""
+        upserted, removed = [], []
+        for product in products:
+            product_id = product.get('_id')
+            if product_id is None:
+                continue
+            updated_at = product.get('updatedAt')
+            if updated_at and (self.product_cursor is None or updated_at > self.product_cursor):
+                self.product_cursor = updated_at
+            if product.get('isActive') is False:
+                if self.products.pop(product_id, None) is not None:
+                    removed.append(product_id)
+            elif self.products.get(product_id) != product:
+                self.products[product_id] = product
+                upserted.append(product)
+        return upserted, removed
+
+    def apply_transactions(self, transactions):
+        """Add transactions not seen before (deltas overlap behind the cursor)"""
+        added = []
+        for transaction in transactions:
+            transaction_id = transaction.get('_id')
+            if transaction_id is None:
+                continue
+            date = transaction.get('transactionDate')
+            if date and (self.transaction_cursor is None or date > self.transaction_cursor):
+                self.transaction_cursor = date
+            if self.transactions.get(transaction_id) != transaction:
+                self.transactions[transaction_id] = transaction
+                added.append(transaction)
+        return added
+
+    def _track_size(self, name, result, records):
+        if result['status'] == 'ok' and records:
+            self.record_bytes[name] = result['size'] // len(records)
+
+    async def sync(self, client, token):
+        """Seed or delta-refresh the replica. Returns `(changes, errors, statuses)`;
+        `statuses` holds the HTTP status of each failed endpoint (None on
+        network errors)."""
+        async with self.lock:
+            endpoints = {
+                'products': (
+                    '/products',
+                    {'updatedSince': behind(self.product_cursor, self.overlap)}
+                    if self.seeded and self.product_cursor else None,
+                    []
+                ),
+                'dashboard': ('/dashboard', None, {}),
+                'transactions': (
+                    '/transactions',
+                    {'startDate': behind(self.transaction_cursor, self.overlap)}
+                    if self.seeded and self.transaction_cursor else None,
+                    []
+                ),
+            }
+            results = await client.revalidate_many(
+                token, endpoints,
+                validators={'dashboard': self.dashboard_validators}
+            )
+            errors = {
+                name: result['error']
+                for name, result in results.items() if result['status'] == 'error'
+            }
+            statuses = {
+                name: result.get('status_code')
+                for name, result in results.items() if result['status'] == 'error'
+            }
+
+            changes = {'products': [], 'removed': [], 'transactions': [], 'dashboard': False}
+
+            products = results['products']
+            if products['status'] == 'ok':
+                records = products['data'] or []
+                if not self.seeded:
+                    self._track_size('products', products, records)
+                changes['products'], changes['removed'] = self.apply_products(records)
+
+            transactions = results['transactions']
+            if transactions['status'] == 'ok':
+                records = transactions['data'] or []
+                if not self.seeded:
+                    self._track_size('transactions', transactions, records)
+                changes['transactions'] = self.apply_transactions(records)
+
+            dashboard = results['dashboard']
+            if dashboard['status'] == 'ok':
+                changes['dashboard'] = dashboard['data'] != self.dashboard
+                self.dashboard = dashboard['data'] or {}
+                self.dashboard_validators = dashboard['validators']
+
+            # Only a complete seed counts; a partial one retries in full
+            if not self.seeded and products['status'] == 'ok' and transactions['status'] == 'ok':
+                self.seeded = True
+
+            if changes['products'] or changes['removed'] or changes['transactions'] or changes['dashboard']:
+                self.version = next(_versions)
+                self._lists = None
+                for listener in self.listeners:
+                    listener(changes)
+
+            return changes, errors, statuses
+
+    def state(self):
+        """Sync state besides the records, for persisting the replica"""
+        return {
+            'product_cursor': self.product_cursor,
+            'transaction_cursor': self.transaction_cursor,
+            'dashboard': self.dashboard,
+            'dashboard_validators': self.dashboard_validators,
+            'record_bytes': self.record_bytes,
+        }
+
+    @classmethod
+    def restore(cls, state, products, transactions):
+        """Seeded replica from persisted `state()` and records; the next
+        sync fetches only what changed after the stored cursors"""
+        replica = cls()
+        replica.products = {p['_id']: p for p in products}
+        replica.transactions = {t['_id']: t for t in transactions}
+        replica.product_cursor = state['product_cursor']
+        replica.transaction_cursor = state['transaction_cursor']
+        replica.dashboard = state['dashboard'] or {}
+        replica.dashboard_validators = state['dashboard_validators']
+        replica.record_bytes = dict(state['record_bytes'])
+        replica.seeded = True
+        return replica
+
+    def snapshot_data(self):
+        """Collections in backend order: products newest-created first,
+        transactions newest first. Rebuilt only when the version changes."""
+        if self._lists is None or self._lists[0] != self.version:
+            products = sorted(self.products.values(), key=lambda p: p.get('createdAt') or '', reverse=True)
+            transactions = sorted(
+                self.transactions.values(),
+                key=lambda t: t.get('transactionDate') or '',
+                reverse=True
+            )
+            self._lists = (self.version, {
+                'products': products,
+                'dashboard': self.dashboard,
+                'transactions': transactions
+            })
+        return self._lists[1]
+
+
+class SyncScheduler:
+    """Background task that keeps recently used replicas refreshed.
+
+    Every `interval` seconds, snapshots used within `idle_timeout` and older
+    than `interval` are delta-synced with the last token seen for them, so
+    chat requests find a fresh snapshot instead of paying for the sync.
+    Changed snapshots are then persisted when the cache has a store.
+    """
+
+    def __init__(self, cache, interval, idle_timeout=600):
+        self.cache = cache
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.task = None
+
+    def start(self):
+        if self.interval > 0 and self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.cache.store is not None:
+            await self.cache.store.persist(self.cache, force=True)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.tick()
+
+    async def tick(self):
+        due = [
+            (key, entry) for key, entry in list(self.cache.entries.items())
+            if entry.last_token and entry.idle() < self.idle_timeout and entry.age() >= self.interval
+        ]
+        for key, entry in due:
+            try:
+                await self.cache.refresh(key, entry, entry.last_token)
+            except Exception as e:
+                print(f"Error syncing replica {key}: {e}")
+        if self.cache.store is not None:
+            await self.cache.store.persist(self.cache)
@@ -0,0 +1,169 @@
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Words that carry no product signal and should never be fuzzily expanded
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'about', 'all', 'any', 'do', 'does', 'for', 'from',
+    'give', 'have', 'how', 'i', 'in', 'is', 'it', 'list', 'many', 'me', 'much',
+    'my', 'of', 'on', 'or', 'our', 'please', 'show', 'tell', 'the', 'there',
+    'this', 'to', 'we', 'what', 'when', 'which', 'who', 'with', 'you',
+}
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ProductIndex:
+    """Inverted index over product name, SKU, category and supplier.
+
+    Ranks with BM25 over field-weighted term frequencies. Query terms that
+    are not in the vocabulary are expanded to similar terms through a
+    character-trigram index, so typos and partial words still match.
+    Products can be added, updated and removed one at a time.
+    """
+
+    FIELD_WEIGHTS = {'name': 3.0, 'sku': 3.0, 'category': 1.5, 'supplier': 1.5}
+
+    def __init__(self, products=(), k1=1.2, b=0.75, fuzzy_threshold=0.45):
+        self.k1 = k1
+        self.b = b
+        self.fuzzy_threshold = fuzzy_threshold
+        self.postings = defaultdict(dict)
+        self.doc_terms = {}
+        self.doc_len = {}
+        self.total_len = 0.0
+        self.gram_index = defaultdict(set)
+        for product in products:
+            self.add(product)
+
+    @classmethod
+    def from_postings(cls, documents, postings, doc_len, total_len, **params):
+        """Index over postings built before (e.g. stored with a snapshot):
+        `documents` lists product ids in the order they were added and
+        `postings` maps each term to `{product_id: tf}` in that order"""
+        index = cls(**params)
+        index.doc_terms = {product_id: Counter() for product_id in documents}
+        for term, posting in postings.items():
+            index.postings[term] = posting
+            for product_id, tf in posting.items():
+                index.doc_terms[product_id][term] = tf
+            for gram in trigrams(term):
+                index.gram_index[gram].add(term)
+        index.doc_len = doc_len
+        index.total_len = total_len
+        return index
+
+    @classmethod
+    def attach(cls, replica):
+        """Return the index kept in step with `replica`, building it once"""
+        index = replica.derived.get('product_index')
+        if index is None:
+            index = cls(replica.products.values())
+            replica.derived['product_index'] = index
+            replica.subscribe(index.apply)
+        return index
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def add(self, product):
+        product_id = product.get('_id')
+        if product_id is None:
+            return
+        if product_id in self.doc_terms:
+            self.remove(product_id)
+
+        terms = Counter()
+        for field, weight in self.FIELD_WEIGHTS.items():
+            for term in tokenize(str(product.get(field) or '')):
+                terms[term] += weight
+
+        self.doc_terms[product_id] = terms
+        length = sum(terms.values())
+        self.doc_len[product_id] = length
+        self.total_len += length
+        for term, tf in terms.items():
+            if term not in self.postings:
+                for gram in trigrams(term):
+                    self.gram_index[gram].add(term)
+            self.postings[term][product_id] = tf
+
+    def remove(self, product_id):
+        terms = self.doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        self.total_len -= self.doc_len.pop(product_id)
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(product_id, None)
+            if not posting:
+                del self.postings[term]
+                for gram in trigrams(term):
+                    self.gram_index[gram].discard(term)
+
+    def apply(self, changes):
+        """Replica listener: apply one delta"""
+        for product_id in changes.get('removed', []):
+            self.remove(product_id)
+        for product in changes.get('products', []):
+            self.add(product)
+
+    def has_term(self, term):
+        return term in self.postings
+
+    def gram_terms(self, gram):
+        """Vocabulary terms containing the character trigram `gram`"""
+        return self.gram_index.get(gram, ())
+
+    def expand(self, term):
+        """Vocabulary terms matching `term`, with a similarity weight each"""
+        if self.has_term(term):
+            return [(term, 1.0)]
+        if term in STOPWORDS or len(term) < 3:
+            return []
+
+        grams = trigrams(term)
+        overlap = Counter()
+        for gram in grams:
+            for candidate in self.gram_terms(gram):
+                overlap[candidate] += 1
+
+        matches = []
+        for candidate, shared in overlap.items():
+            similarity = shared / (len(grams) + len(trigrams(candidate)) - shared)
+            if candidate.startswith(term):
+                similarity = max(similarity, 0.8)
+            if similarity >= self.fuzzy_threshold:
+                matches.append((candidate, similarity))
+        return matches
+
+    def search(self, query, limit=50):
+        """Return up to `limit` `(product_id, score)` pairs, best first"""
+        n = len(self.doc_terms)
+        if not n:
+            return []
+        avg_len = self.total_len / n
+
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            for match, similarity in self.expand(term):
+                posting = self.postings[match]
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for product_id, tf in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_len[product_id] / avg_len)
+                    scores[product_id] += similarity * idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
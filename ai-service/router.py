@@ -0,0 +1,371 @@
+import asyncio
+import os
+import re
+import time
+from analytics import ProductFrame
+from answer_cache import AnswerCache
+from forecasting import DemandForecast
+from sessions import SessionStore
+from single_flight import SingleFlight
+from llm_scheduler import BACKGROUND, INTERACTIVE, Overloaded
+from movers import MoverIndex
+from snapshot_cache import tenant_key
+from transaction_store import TransactionStore
+
+
+# Phrase patterns per intent, with how strongly each one signals it
+INTENT_PATTERNS = {
+    'low_stock': [
+        (r'low (?:on )?stock', 1.0),
+        (r'running (?:low|out)', 1.0),
+        (r'shortages?', 0.9),
+        (r'(?:need|needs|needing) (?:to be )?reorder(?:ed|ing)?', 0.8),
+    ],
+    'stockout_risk': [
+        (r'stock ?out (?:risks?|dates?)', 1.0),
+        (r'(?:will|going to|about to) run out', 1.0),
+        (r'days? of (?:cover|supply|stock left)', 1.0),
+        (r'reorder points?', 1.0),
+        (r'at risk', 0.8),
+    ],
+    'out_of_stock': [
+        (r'out of stock', 1.0),
+        (r'no stock', 1.0),
+        (r'sold out', 0.9),
+        (r'stock ?outs?', 0.8),
+    ],
+    'most_sold': [
+        (r'most sold', 1.0),
+        (r'(?:top|best)[- ]?sell(?:ing|ers?)', 1.0),
+        (r'most popular|popular', 0.8),
+    ],
+    'top_revenue': [
+        (r'(?:top|highest|most|best)[- ](?:revenue|earning|grossing)', 1.0),
+        (r'(?:earn(?:s|ed)?|made|brought in) the most(?: money)?', 0.9),
+        (r'revenue', 0.8),
+    ],
+    'stock_value': [
+        (r'(?:stock|total|inventory) value', 1.0),
+        (r'valuation', 0.8),
+        (r'worth', 0.6),
+    ],
+    'category': [
+        (r'categor(?:y|ies)', 0.8),
+    ],
+    'supplier': [
+        (r'suppliers?|vendors?', 0.8),
+    ],
+    'fastest_moving': [
+        (r'fast[- ]moving|moving fast', 1.0),
+        (r'fastest(?: moving| movers?| selling)', 1.0),
+        (r'fastest', 0.9),
+        (r'quick(?:est|ly)?', 0.5),
+    ],
+}
+
+# Markers of questions the fixed handlers cannot answer well
+COMPLEX_PATTERN = re.compile(
+    r"\b(?:why|how come|compare|compared|versus|vs|should|recommend|suggest|predict|"
+    r"forecast|trend|explain|plan|if|yesterday|today|week|month|year|last \d+|between)\b"
+)
+
+# Words that may surround a routable question without changing its meaning
+FILLER_WORDS = set("""
+a all am an and any are at be by can could current currently do does for from get give have
+how i in inventory is it it's item items level levels list many me much my now of on our
+please product products right see show stock tell the there these this to total us we
+what what's whats which who with you your
+""".split())
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+class RouteDecision:
+    def __init__(self, intent, confidence, scores):
+        self.intent = intent
+        self.confidence = confidence
+        self.scores = scores
+
+    def __repr__(self):
+        return f"RouteDecision({self.intent!r}, {self.confidence:.2f})"
+
+
+class IntentRouter:
+    """Classify a message into one of AIEngine's structured intents.
+
+    All phrase patterns are compiled into a single alternation with one
+    named group per pattern, so a message is scanned once. The best
+    intent's score is reduced for ambiguity (several intents matched),
+    complexity markers ("why", "compare", time ranges) and leftover
+    content words such as product names, which the fixed handlers ignore.
+    """
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold if threshold is not None else float(os.getenv("ROUTER_CONFIDENCE", 0.75))
+        self.groups = {}
+        alternatives = []
+        for intent, patterns in INTENT_PATTERNS.items():
+            for i, (pattern, weight) in enumerate(patterns):
+                name = f"{intent}__{i}"
+                self.groups[name] = (intent, weight)
+                alternatives.append(f"(?P<{name}>\\b(?:{pattern})\\b)")
+        self.matcher = re.compile('|'.join(alternatives))
+        self.stats = {}
+
+    def classify(self, message):
+        text = ' '.join(message.lower().split())
+        scores = {}
+        leftover = text
+        for match in self.matcher.finditer(text):
+            intent, weight = self.groups[match.lastgroup]
+            scores[intent] = max(scores.get(intent, 0.0), weight)
+            leftover = leftover.replace(match.group(0), ' ')
+
+        if not scores:
+            return RouteDecision(None, 0.0, scores)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        intent, confidence = ranked[0]
+        if len(ranked) > 1:
+            confidence -= 0.3 * ranked[1][1]
+        if COMPLEX_PATTERN.search(text):
+            confidence -= 0.4
+        unknown = [w for w in WORD_RE.findall(leftover) if w not in FILLER_WORDS]
+        confidence -= min(0.6, 0.25 * len(unknown))
+
+        return RouteDecision(intent, max(0.0, round(confidence, 3)), scores)
+
+    def is_local(self, decision):
+        return decision.intent is not None and decision.confidence >= self.threshold
+
+    def record(self, route, seconds):
+        """Record the latency of one answered request on `route`"""
+        stats = self.stats.setdefault(route, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        ms = seconds * 1000
+        stats['count'] += 1
+        stats['total_ms'] += ms
+        stats['max_ms'] = max(stats['max_ms'], ms)
+
+    def route_stats(self):
+        return {
+            route: {
+                'count': s['count'],
+                'avg_ms': round(s['total_ms'] / s['count'], 3) if s['count'] else 0.0,
+                'max_ms': round(s['max_ms'], 3),
+            }
+            for route, s in self.stats.items()
+        }
+
+
+class HybridEngine:
+    """Answer structured questions with AIEngine, everything else with the LLM.
+
+    Both paths read the same tenant snapshot; the local path computes from
+    the replica's columnar frames, so a confident match answers in
+    milliseconds without a model call. Answers from either path are kept
+    in the answer cache until the snapshot version changes. Clients that
+    ask for it (a `session_id`, or `start_session`) get a server-side chat
+    session whose id is returned; its history then replaces the
+    client-sent one. Other requests stay stateless.
+    """
+
+    def __init__(self, local_engine, llm_engine, router=None, answers=None, sessions=None):
+        self.local = local_engine
+        self.llm = llm_engine
+        self.router = router or IntentRouter()
+        self.answers = answers or AnswerCache()
+        self.sessions = sessions or SessionStore()
+        # Identical questions in flight (same tenant, snapshot and history) share one answer
+        self.flights = SingleFlight()
+
+    @property
+    def provider(self):
+        return self.llm.provider
+
+    def answer_locally(self, decision, data):
+        if data.get('version') is None:
+            # The snapshot could not be loaded (token rejected or backend
+            # down): answering from the empty lists would be wrong, not just stale
+            return {
+                "answer": "I apologize, but I couldn't load your inventory data right now. Please try again in a moment.",
+                "context_used": False,
+                "model": "fallback",
+            }
+        if data.get('replica') is not None:
+            products = ProductFrame.attach(data['replica'])
+            transactions = TransactionStore.attach(data['replica'])
+            forecast = DemandForecast.attach(data['replica'])
+            movers = MoverIndex.attach(data['replica'])
+        else:
+            products = ProductFrame(data['products'])
+            transactions = TransactionStore(data['transactions'])
+            forecast = movers = None
+        result = self.local.handle_intent(decision.intent, products, transactions, forecast, movers)
+        return {
+            "answer": result['answer'],
+            "data": result.get('data'),
+            "context_used": True,
+            "model": "local",
+        }
+
+    async def answer(self, user_message, token, conversation_history, data, session=None, priority=INTERACTIVE):
+        """Answer without the cache. Returns `(result, route)`."""
+        decision = self.router.classify(user_message)
+        if self.router.is_local(decision):
+            result, route = self.answer_locally(decision, data), 'local'
+        else:
+            result, route = await self.llm.chat(
+                user_message, token, conversation_history, session=session, data=data, priority=priority
+            ), 'llm'
+        return {
+            **result,
+            "route": route,
+            "intent": decision.intent,
+            "confidence": decision.confidence,
+        }, route
+
+    async def cached_answer(self, user_message, token, conversation_history):
+        """Look up the answer cache. Returns `(key, data, cached_result)`."""
+        data = await self.llm.fetch_inventory_data(token)
+        key = self.answers.key(tenant_key(token), user_message, conversation_history, data.get('version'))
+        cached, fresh = self.answers.get(key)
+        if cached is not None and not fresh:
+            async def recompute():
+                latest = await self.llm.fetch_inventory_data(token)
+                result, _ = await self.answer(user_message, token, conversation_history, latest, priority=BACKGROUND)
+                return result
+            self.answers.revalidate(key, recompute)
+        return key, data, cached
+
+    def remember(self, key, result):
+        if result.get('model') != 'fallback':
+            self.answers.put(key, result)
+
+    def open_session(self, session_id, token, conversation_history, start=False):
+        """Resolve the chat session when the client asked for one. Returns
+        `(session, history)`: the session (None when stateless) and a copy
+        of the history to answer with."""
+        if not session_id and not start:
+            return None, list(conversation_history or [])
+        session = self.sessions.resolve(session_id, tenant_key(token), conversation_history)
+        return session, list(session.history)
+
+    def close_turn(self, session, user_message, result):
+        if session is not None and result.get('model') != 'fallback':
+            self.sessions.record(session, user_message, result['answer'])
+
+    async def chat(self, user_message, token, conversation_history=None, session_id=None, start_session=False):
+        started = time.perf_counter()
+        session, history = self.open_session(session_id, token, conversation_history, start_session)
+        session_id = session.session_id if session is not None else None
+        key, data, cached = await self.cached_answer(user_message, token, history)
+        if cached is not None:
+            self.close_turn(session, user_message, cached)
+            self.router.record('cache', time.perf_counter() - started)
+            return {**cached, "cached": True, "session_id": session_id}
+
+        result, route = await self.flights.run(
+            key, lambda: self.answer(user_message, token, history, data, session)
+        )
+        self.remember(key, result)
+        self.close_turn(session, user_message, result)
+        self.router.record(route, time.perf_counter() - started)
+        return {**result, "session_id": session_id}
+
+    async def chat_stream(self, user_message, token, conversation_history=None, meta=None, session_id=None,
+                          admitted=False, start_session=False):
+        """Yield answer chunks; `meta` (if given) receives the route, session id and prompt token counts.
+        `admitted` means the caller already ran the scheduler's `admit()` for this request."""
+        started = time.perf_counter()
+        meta = meta if meta is not None else {}
+        session, history = self.open_session(session_id, token, conversation_history, start_session)
+        meta.update(session_id=session.session_id if session is not None else None)
+        key, data, cached = await self.cached_answer(user_message, token, history)
+        if cached is not None:
+            meta.update(route='cache', prompt_tokens=cached.get('prompt_tokens'))
+            yield cached['answer']
+            self.close_turn(session, user_message, cached)
+            self.router.record('cache', time.perf_counter() - started)
+            return
+
+        decision = self.router.classify(user_message)
+        if self.router.is_local(decision):
+            result = self.answer_locally(decision, data)
+            meta.update(route='local')
+            yield result['answer']
+            self.remember(key, {**result, "route": 'local', "intent": decision.intent, "confidence": decision.confidence})
+            self.close_turn(session, user_message, result)
+            self.router.record('local', time.perf_counter() - started)
+            return
+
+        chunks = []
+        meta.update(route='llm')
+        async for chunk in self.llm.chat_stream(
+            user_message, token, history, meta=meta, session=session, data=data, admitted=admitted
+        ):
+            chunks.append(chunk)
+            yield chunk
+        result = {
+            "answer": ''.join(chunks),
+            "context_used": True,
+            "model": self.provider.model_name,
+            "prompt_tokens": meta.get('prompt_tokens'),
+            "route": 'llm',
+            "intent": decision.intent,
+            "confidence": decision.confidence,
+        }
+        self.remember(key, result)
+        self.close_turn(session, user_message, result)
+        self.router.record('llm', time.perf_counter() - started)
+
+    async def batch(self, questions, token, max_concurrency=None):
+        """Answer independent questions against one inventory snapshot.
+
+        The snapshot is fetched (and its context rendered) once; local and
+        cached answers return immediately and model-bound questions run in
+        parallel, at most `max_concurrency` at a time, as background work
+        for the scheduler. Returns `(results, version)` with one result per
+        question, in order, each carrying a status and its duration.
+        """
+        limit = asyncio.Semaphore(max_concurrency or int(os.getenv("BATCH_CONCURRENCY", 4)))
+        data = await self.llm.fetch_inventory_data(token)
+        tenant = tenant_key(token)
+
+        async def run(index, question):
+            started = time.perf_counter()
+            item = {"index": index, "question": question}
+            try:
+                key = self.answers.key(tenant, question, None, data.get('version'))
+                cached, fresh = self.answers.get(key)
+                if cached is not None:
+                    result, route = {**cached, "cached": True}, 'cache'
+                else:
+                    decision = self.router.classify(question)
+                    if self.router.is_local(decision):
+                        result, route = await self.answer(question, token, None, data)
+                    else:
+                        async with limit:
+                            result, route = await self.flights.run(
+                                key, lambda: self.answer(question, token, None, data, priority=BACKGROUND)
+                            )
+                    self.remember(key, result)
+                self.router.record(route, time.perf_counter() - started)
+                item.update(
+                    status='ok' if result.get('model') != 'fallback' else 'error',
+                    answer=result['answer'],
+                    model=result.get('model'),
+                    route=result.get('route', route),
+                    intent=result.get('intent'),
+                    data=result.get('data'),
+                    cached=result.get('cached', False),
+                )
+            except Overloaded as e:
+                item.update(status='overloaded', error=str(e), retry_after=e.retry_after)
+            except Exception as e:
+                print(f"Error answering batch question {index}: {e}")
+                item.update(status='error', error=str(e))
+            item['duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            return item
+
+        results = await asyncio.gather(*[run(i, q) for i, q in enumerate(questions)])
+        return results, data.get('version')
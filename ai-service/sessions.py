@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+
+class ChatSession:
+    """Server-side state of one chat: its history and the prefix it last used"""
+
+    def __init__(self, session_id, tenant, history=None):
+        self.session_id = session_id
+        self.tenant = tenant
+        self.history = []
+        self.size = 0
+        self.prefix_key = None
+        self.used_at = time.monotonic()
+        for message in history or []:
+            self.append(message.get('role'), message.get('content', ''))
+
+    def append(self, role, content):
+        if role not in ('user', 'assistant'):
+            return
+        self.history.append({'role': role, 'content': content or ''})
+        self.size += len((content or '').encode())
+
+    def record(self, user_message, answer, max_messages):
+        """Add one exchange, keeping the newest `max_messages` messages"""
+        self.append('user', user_message)
+        self.append('assistant', answer)
+        while len(self.history) > max_messages:
+            self.size -= len(self.history.pop(0)['content'].encode())
+
+    def idle(self):
+        return time.monotonic() - self.used_at
+
+
+class SessionStore:
+    """Chat sessions with idle expiry and count / byte caps (LRU eviction).
+
+    A session belongs to the tenant that created it; an id presented by
+    another tenant, or one that expired, starts a new session seeded with
+    the client's history instead.
+    """
+
+    def __init__(self, idle_timeout=None, max_sessions=None, max_bytes=None, max_messages=None):
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(os.getenv("CHAT_SESSION_IDLE", 1800))
+        self.max_sessions = max_sessions or int(os.getenv("CHAT_SESSION_MAX", 1000))
+        self.max_bytes = max_bytes or int(os.getenv("CHAT_SESSION_MAX_BYTES", 32 * 1024 * 1024))
+        self.max_messages = max_messages or int(os.getenv("CHAT_SESSION_MESSAGES", 20))
+        # Least recently used first, so idle sessions are always at the front
+        self.sessions = OrderedDict()
+        self.size = 0
+        self.counters = {'created': 0, 'resumed': 0, 'expired': 0, 'evictions': 0}
+
+    def resolve(self, session_id, tenant, history=None):
+        """Return the tenant's live session `session_id`, or a new one"""
+        session = self.sessions.get(session_id) if session_id else None
+        if session is not None and session.idle() > self.idle_timeout:
+            self._remove(session_id)
+            self.counters['expired'] += 1
+            session = None
+        if session is not None and session.tenant == tenant:
+            session.used_at = time.monotonic()
+            self.sessions.move_to_end(session_id)
+            self.counters['resumed'] += 1
+            return session
+
+        session = ChatSession(secrets.token_urlsafe(16), tenant, (history or [])[-self.max_messages:])
+        self.sessions[session.session_id] = session
+        self.size += session.size
+        self.counters['created'] += 1
+        self._evict()
+        return session
+
+    def record(self, session, user_message, answer):
+        before = session.size
+        session.record(user_message, answer, self.max_messages)
+        if self.sessions.get(session.session_id) is session:
+            self.size += session.size - before
+        self._evict()
+
+    def _remove(self, session_id):
+        self.size -= self.sessions.pop(session_id).size
+
+    def _evict(self):
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if session.idle() > self.idle_timeout:
+                self.counters['expired'] += 1
+            elif len(self.sessions) > self.max_sessions or self.size > self.max_bytes:
+                self.counters['evictions'] += 1
+            else:
+                break
+            self._remove(session_id)
+
+    def stats(self):
+        return {
+            **self.counters,
+            'sessions': len(self.sessions),
+            'bytes': self.size,
+            'idle_timeout': self.idle_timeout,
+        }
+
+
+def prefix_key(prefix):
+    return hashlib.sha256(json.dumps(prefix, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class PrefixCache:
+    """Conversation prefixes registered with the model provider.
+
+    The static prefix (system prompt and inventory context for one
+    snapshot version) is keyed by its content, so it is registered once
+    and shared by every session that sees the same snapshot. Concurrent
+    requests for a new prefix wait on a single registration. Entries are
+    released on LRU eviction or once past their TTL.
+    """
+
+    def __init__(self, provider, max_entries=None, ttl=None):
+        self.provider = provider
+        self.max_entries = max_entries or int(os.getenv("PREFIX_CACHE_SIZE", 32))
+        self.ttl = ttl if ttl is not None else float(os.getenv("PREFIX_CACHE_TTL", 600))
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.counters = {'hits': 0, 'registrations': 0, 'evictions': 0, 'uploaded_bytes': 0}
+
+    async def get(self, prefix):
+        key = prefix_key(prefix)
+        handle = self.entries.get(key)
+        if handle is not None and time.monotonic() - handle.created_at < self.ttl:
+            self.entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return handle
+        if handle is not None:
+            await self._release(self.entries.pop(key))
+
+        if key not in self.pending:
+            self.pending[key] = asyncio.ensure_future(self._register(key, prefix))
+        return await asyncio.shield(self.pending[key])
+
+    async def _register(self, key, prefix):
+        try:
+            handle = await self.provider.cache_prefix(key, prefix)
+            self.entries[key] = handle
+            self.counters['registrations'] += 1
+            self.counters['uploaded_bytes'] += handle.size
+            while len(self.entries) > self.max_entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+                await self._release(evicted)
+            return handle
+        finally:
+            self.pending.pop(key, None)
+
+    async def _release(self, handle):
+        try:
+            await self.provider.release_prefix(handle)
+        except Exception as e:
+            print(f"Error releasing prefix: {e}")
+
+    def stats(self):
+        return {**self.counters, 'entries': len(self.entries), 'ttl': self.ttl}
@@ -0,0 +1,827 @@
+import asyncio
+import hashlib
+import heapq
+import json
+import math
+import os
+import socket
+import time
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping
+from itertools import chain
+import numpy as np
+from analytics import ProductFrame
+from context_builder import ContextBuilder
+from records import ProductRecord, TransactionRecord
+from retrieval import ProductIndex, tokenize, trigrams
+from single_flight import SingleFlight
+from snapshot_cache import Snapshot, tenant_key, token_digest
+from snapshot_format import (
+    ColumnWriter, GrowingFile, IdLookup, RecordColumns, SnapshotFile, id_arrays, string_arrays, write_pointer,
+    write_snapshot,
+)
+from tokens import take_within_budget
+from transaction_store import TransactionStore
+
+
+OWNER_SOCKET = 'owner.sock'
+GENERATION_FILE = 'generation'
+
+
+def write_index(terms, total_len, ids, path, durable=False):
+    """Write `ProductIndex.doc_terms` (`terms`) as a snapshot file of
+    term-major postings over the product rows `ids` (blocking): the
+    vocabulary, each term's slice of the row and term-frequency arrays,
+    each row's document length, the rows in index order, and the trigram
+    index over the vocabulary. Products keep their order within a term, as in the
+    index's own postings."""
+    row_of = {pid: row for row, pid in enumerate(ids)}
+    postings = {}
+    doc_len = np.zeros(len(row_of))
+    for product_id, counts in terms.items():
+        row = row_of[product_id]
+        doc_len[row] = sum(counts.values())
+        for term, tf in counts.items():
+            posting = postings.get(term)
+            if posting is None:
+                postings[term] = posting = ([], [])
+            posting[0].append(row)
+            posting[1].append(tf)
+    vocabulary = list(postings)
+    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum([len(rows) for rows, _ in postings.values()], out=offsets[1:])
+    total = int(offsets[-1])
+    arrays = {
+        # Rows in the order the index added them, which its postings keep
+        'index_documents': np.array([row_of[product_id] for product_id in terms], dtype=np.int32),
+        'index_offsets': offsets,
+        'index_rows': np.fromiter(chain.from_iterable(rows for rows, _ in postings.values()), dtype=np.int32, count=total),
+        'index_tf': np.fromiter(chain.from_iterable(tfs for _, tfs in postings.values()), dtype=np.float64, count=total),
+        'index_doc_len': doc_len,
+    }
+    arrays['index_term_offsets'], arrays['index_term_blob'] = string_arrays(vocabulary)
+    arrays['index_term_keys'], arrays['index_term_rows'] = id_arrays(vocabulary)
+
+    # Character trigram -> numbers of the terms containing it
+    grams = defaultdict(list)
+    for number, term in enumerate(vocabulary):
+        for gram in trigrams(term):
+            grams[gram].append(number)
+    arrays['index_gram_keys'], arrays['index_gram_rows'] = id_arrays(list(grams))
+    arrays['index_gram_offsets'] = np.zeros(len(grams) + 1, dtype=np.int64)
+    np.cumsum([len(numbers) for numbers in grams.values()], out=arrays['index_gram_offsets'][1:])
+    arrays['index_gram_terms'] = np.fromiter(chain.from_iterable(grams.values()), dtype=np.int32)
+    write_snapshot(path, {'documents': len(terms), 'total_len': total_len}, arrays, durable)
+
+
+def write_products(parts, path, tenant, durable=False):
+    """Write the product section of a `SnapshotWriter.capture` (blocking).
+    Returns the product ids by row."""
+    # Backend order, as `InventoryReplica.snapshot_data` lists them
+    products = sorted(parts['products'], key=lambda p: p.get('createdAt') or '', reverse=True)
+    frame = ProductFrame(products)
+    ids = [p.get('_id') or '' for p in products]
+    row_of = {pid: row for row, pid in enumerate(ids)}
+    product_lines = parts['product_lines']
+    records = ColumnWriter(ProductRecord, 'product', products)
+
+    arrays = {f'product_{name}': getattr(frame, name) for name in ProductFrame.COLUMNS}
+    arrays.update(records.encode(products))
+    arrays['product_id_keys'], arrays['product_id_rows'] = id_arrays(ids)
+    arrays['product_id_offsets'], arrays['product_id_blob'] = string_arrays(ids)
+    arrays['product_line_offsets'], arrays['product_line_blob'] = string_arrays(
+        product_lines[p.get('_id')][1] for p in products
+    )
+    # Frame row of each product in the replica's own order
+    arrays['replica_order'] = np.array([row_of[p.get('_id') or ''] for p in parts['products']], dtype=np.int32)
+    arrays['context_order'] = np.array([row_of[pid] for pid in parts['context_order']], dtype=np.int32)
+    arrays['alert_rows'] = np.array([row_of[pid] for pid in parts['alert_ids']], dtype=np.int32)
+    for name, lines in parts['alerts'].items():
+        arrays[f'{name}_offsets'], arrays[f'{name}_blob'] = string_arrays(lines)
+
+    # The transaction store's product codes, which transaction rows refer to
+    product_ids = parts['product_ids']
+    arrays['transaction_product_keys'], arrays['transaction_product_rows'] = id_arrays(product_ids)
+    arrays['transaction_product_offsets'], arrays['transaction_product_blob'] = string_arrays(product_ids)
+    arrays['transaction_name_offsets'], arrays['transaction_name_blob'] = string_arrays(parts['product_names'])
+
+    write_snapshot(path, {
+        'tenant': tenant,
+        'version': parts['version'],
+        'categories': frame.categories,
+        'suppliers': frame.suppliers,
+        'summary': parts['summary'],
+        'product_tokens': parts['product_tokens'],
+        'records': records.meta(),
+        'counts': records.counts(),
+    }, arrays, durable)
+    return ids
+
+
+class SnapshotWriter:
+    """Writes the successive versions of one tenant's replica as snapshot files.
+
+    A version is a product section (records, frame columns, rendered lines,
+    summary and the transaction product codes), written anew when any of
+    those changed; an index section (the retrieval postings), written anew
+    only when product terms or rows changed; and a transaction section
+    (records, store columns and rendered lines) that later versions append
+    to in place. Appended rows lie past what readers of earlier versions map, so
+    each version stays immutable to its readers. The transaction section
+    is written anew only when rows already in it change (late arrivals
+    reorder the store, renames and edited transactions re-render lines) or
+    when it is full. `write` returns the manifest naming a version's files
+    and how many rows of each it spans.
+    """
+
+    def __init__(self, directory, name, durable=False):
+        self.directory = directory
+        self.name = name
+        self.durable = durable
+        # Versions restart with the process; files from before must keep their names
+        self.stamp = f'{time.time_ns():x}'
+        self.lock = asyncio.Lock()
+        # The (store, builder) written from and their marks at that point
+        self.source = None
+        self.product_mark = None
+        self.marks = None
+        self.products = None
+        # The index section and the terms and product rows it was written from
+        self.index = None
+        self.terms = None
+        self.ids = None
+        self.transactions = None
+        self.records = None
+        self.rows = 0
+        self.stale = []
+
+    def capture(self, replica, rewrite=False):
+        """Copy out what changed since the last `write` from `replica`'s
+        current version: the immutable records and lines by reference, the
+        containers and columns later deltas mutate as copies; transactions
+        only from the first row not written yet. Cheap enough for the event
+        loop. `rewrite` captures everything."""
+        store = TransactionStore.attach(replica)
+        builder = ContextBuilder.attach(replica)
+        # Built by the first `write` instead, off the loop (see `adopt`)
+        index = replica.derived.get('product_index')
+        fresh = rewrite or self.source is None or self.source[0] is not store or self.source[1] is not builder
+        names = [name or '' for name in store.product_names]
+        parts = {
+            'version': replica.version,
+            'dashboard': replica.dashboard,
+            'source': (store, builder),
+            'product_mark': (builder.product_revision, names),
+            'marks': (store.reorders, builder.rewrites),
+        }
+        if fresh or parts['product_mark'] != self.product_mark:
+            parts['products'] = {
+                'version': replica.version,
+                'products': list(replica.products.values()),
+                'product_lines': dict(builder.product_lines),
+                'context_order': builder.ordered(builder.product_order),
+                'alert_ids': list(builder.alert_ids()),
+                'alerts': {name: list(builder.alert_lines(name)[1]) for name in ('low_stock', 'out_of_stock')},
+                'summary': builder.summary(),
+                'product_tokens': builder.product_tokens,
+                # A product's term counts are replaced, never changed, on update
+                'terms': dict(index.doc_terms) if index is not None else None,
+                'total_len': index.total_len if index is not None else None,
+                'product_ids': [pid or '' for pid in store.product_ids],
+                'product_names': names,
+            }
+        start = 0 if fresh or parts['marks'] != self.marks else self.rows
+        records = store.records[start:store.n]
+        parts['transactions'] = {
+            'start': start,
+            'records': records,
+            'columns': {name: getattr(store, name)[start:store.n].copy() for name in TransactionStore.COLUMNS},
+            'lines': dict(builder.transaction_lines) if not start else {
+                t.get('_id'): builder.transaction_lines[t.get('_id')] for t in records
+            },
+        }
+        return parts
+
+    def write(self, parts, tenant):
+        """Write a `capture` (blocking). Returns the version's manifest, or
+        None when the transaction section is full: capture with `rewrite`."""
+        version = parts['version']
+        transactions = parts['transactions']
+        if transactions['start']:
+            if not self._append(transactions):
+                return None
+        else:
+            self._rewrite(transactions, version, tenant)
+        if 'products' in parts:
+            path = self._path('p', version)
+            ids = write_products(parts['products'], path, tenant, self.durable)
+            if self.products is not None:
+                self.stale.append(self.products)
+            self.products = path
+            self._index(parts['products'], ids, version)
+        self.source, self.product_mark, self.marks = parts['source'], parts['product_mark'], parts['marks']
+        return {
+            'tenant': tenant,
+            'version': version,
+            'written_at': time.time(),
+            'dashboard': parts['dashboard'],
+            'products': self.products,
+            'index': self.index,
+            'transactions': self.transactions.path,
+            'counts': {**self.transactions.counts, **self.records.counts()},
+        }
+
+    def _path(self, section, version):
+        return os.path.join(self.directory, f"{self.name}-{section}{version}-{self.stamp}.snap")
+
+    def _index(self, products, ids, version):
+        if products['terms'] is None:
+            index = products['index'] = ProductIndex(products['products'])
+            products['terms'], products['total_len'] = dict(index.doc_terms), index.total_len
+        terms = products['terms']
+        if self.index is not None and ids == self.ids and terms == self.terms:
+            return
+        path = self._path('i', version)
+        write_index(terms, products['total_len'], ids, path, self.durable)
+        if self.index is not None:
+            self.stale.append(self.index)
+        self.index, self.terms, self.ids = path, terms, ids
+
+    def adopt(self, replica, parts):
+        """Keep the retrieval index `write` built for `replica` in step with
+        it, unless it changed meanwhile, so later captures copy its terms"""
+        index = parts.get('products', {}).get('index')
+        if index is not None and replica.version == parts['version'] and 'product_index' not in replica.derived:
+            replica.derived['product_index'] = index
+            replica.subscribe(index.apply)
+
+    def _rewrite(self, transactions, version, tenant):
+        records, lines = transactions['records'], transactions['lines']
+        self.records = ColumnWriter(TransactionRecord, 'transaction', records)
+        arrays = {f'transaction_{name}': column for name, column in transactions['columns'].items()}
+        arrays.update(self.records.encode(records))
+        arrays['transaction_line_offsets'], arrays['transaction_line_blob'] = string_arrays(
+            lines[t.get('_id')][1] for t in records
+        )
+        if self.transactions is not None:
+            self.stale.append(self.transactions.path)
+        path = self._path('t', version)
+        self.transactions = GrowingFile(path, {'tenant': tenant, 'records': self.records.meta()}, arrays, self.durable)
+        self.rows = len(records)
+
+    def _append(self, transactions):
+        records, lines = transactions['records'], transactions['lines']
+        if self.transactions is None or not self.records.fits(records):
+            return False
+        chunks = {f'transaction_{name}': column for name, column in transactions['columns'].items()}
+        chunks['transaction_line_offsets'], chunks['transaction_line_blob'] = self.transactions.strings(
+            'transaction_line', (lines[t.get('_id')][1] for t in records)
+        )
+        chunks.update(self.records.encode(records))
+        if not self.transactions.append(chunks):
+            # The encoder already counted these rows: start a new section
+            self.source = None
+            return False
+        self.rows += len(records)
+        return True
+
+    def files(self):
+        return [path for path in (self.products, self.index, self.transactions and self.transactions.path) if path]
+
+    def collect(self):
+        """Delete files the last write superseded; workers still mapping
+        them keep them until they swap"""
+        for path in self.stale:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self.stale = []
+
+
+class SharedProducts(Mapping):
+    """Product id -> record mapping over a snapshot file"""
+
+    def __init__(self, ids, records, lookup):
+        self.ids = ids
+        self.records = records
+        self.lookup = lookup
+
+    def __getitem__(self, product_id):
+        row = self.lookup.row(product_id)
+        if row < 0:
+            raise KeyError(product_id)
+        return self.records[row]
+
+    def __contains__(self, product_id):
+        return self.lookup.row(product_id) >= 0
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def values(self):
+        return self.records
+
+
+class SharedProductIndex(ProductIndex):
+    """Read-only `ProductIndex` over the postings a snapshot file carries;
+    ranks exactly as the owner's index would"""
+
+    def __init__(self, file, ids):
+        super().__init__()
+        self.documents = file.header['documents']
+        self.total_len = file.header['total_len']
+        self.ids = ids
+        self.terms = IdLookup(file.array('index_term_keys'), file.array('index_term_rows'))
+        self.vocabulary = file.strings('index_term')
+        self.offsets = file.array('index_offsets')
+        self.rows = file.array('index_rows')
+        self.tf = file.array('index_tf')
+        self.doc_len = file.array('index_doc_len')
+        self.grams = IdLookup(file.array('index_gram_keys'), file.array('index_gram_rows'))
+        self.gram_offsets = file.array('index_gram_offsets')
+        self.gram_numbers = file.array('index_gram_terms')
+
+    def __len__(self):
+        return self.documents
+
+    def has_term(self, term):
+        return self.terms.row(term) >= 0
+
+    def gram_terms(self, gram):
+        row = self.grams.row(gram)
+        if row < 0:
+            return ()
+        numbers = self.gram_numbers[self.gram_offsets[row]:self.gram_offsets[row + 1]]
+        return [self.vocabulary[number] for number in numbers.tolist()]
+
+    def search(self, query, limit=50):
+        n = self.documents
+        if not n:
+            return []
+        avg_len = self.total_len / n
+
+        scores = np.zeros(len(self.doc_len))
+        seen = np.zeros(len(self.doc_len), dtype=bool)
+        # Rows in the order they were first scored, as the dict of the owner's index
+        touched = []
+        for term in set(tokenize(query)):
+            for match, similarity in self.expand(term):
+                number = self.terms.row(match)
+                lo, hi = self.offsets[number], self.offsets[number + 1]
+                rows, tf = self.rows[lo:hi], self.tf[lo:hi]
+                idf = math.log(1 + (n - (hi - lo) + 0.5) / ((hi - lo) + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[rows] / avg_len)
+                scores[rows] += similarity * idf * tf * (self.k1 + 1) / (tf + norm)
+                touched.append(rows[~seen[rows]])
+                seen[rows] = True
+
+        rows = np.concatenate(touched).tolist() if touched else []
+        best = heapq.nlargest(limit, zip(rows, scores[rows].tolist()), key=lambda item: item[1])
+        return [(self.ids[row], score) for row, score in best]
+
+
+class SharedContextBuilder(ContextBuilder):
+    """Read-only `ContextBuilder` over the lines and aggregates the snapshot
+    files carry; renders exactly what the owner's builder would"""
+
+    def __init__(self, replica):
+        super().__init__()
+        products, transactions = replica.product_file, replica.transaction_file
+        self.products = replica.products
+        self.transactions = replica.snapshot_data()['transactions']
+        self.product_tokens = products.header['product_tokens']
+        self.summary_text = products.header['summary']
+        self.lines = products.strings('product_line')
+        self.context_order = products.array('context_order')
+        self.alert_rows = products.array('alert_rows')
+        self.alerts = {name: products.strings(name) for name in ('low_stock', 'out_of_stock')}
+        self.transaction_table = transactions.strings('transaction_line')
+        self.transaction_product = transactions.array('transaction_product')
+        self.transaction_codes = IdLookup(
+            products.array('transaction_product_keys'), products.array('transaction_product_rows')
+        )
+    def summary(self):
+        return self.summary_text
+
+    def alert_lines(self, name):
+        lines = self.alerts[name]
+        return len(lines), iter(lines)
+
+    def alert_ids(self):
+        return self._section('alert_ids', lambda: [self.products.ids[row] for row in self.alert_rows])
+
+    def product_line(self, product_id):
+        return self.lines[self.products.lookup.row(product_id)]
+
+    def all_products_section(self):
+        return self._section('all_products', lambda: "\n".join(self.lines[row] for row in self.context_order))
+
+    def select_transactions(self, product_ids, budget):
+        n = len(self.transaction_table)
+        recent = list(range(n - 1, max(-1, n - 1 - self.RECENT_TRANSACTIONS), -1))
+        if product_ids is None:
+            candidates = recent
+        else:
+            codes = [code for code in map(self.transaction_codes.row, product_ids) if code >= 0]
+            relevant = (
+                np.flatnonzero(np.isin(self.transaction_product, codes))[::-1][:self.RECENT_TRANSACTIONS].tolist()
+                if codes else []
+            )
+            seen = set(relevant)
+            candidates = relevant + [row for row in recent if row not in seen][:self.RECENT_TRANSACTIONS - len(relevant)]
+        return take_within_budget((self.transaction_table[row] for row in candidates), budget)
+
+
+class SharedReplica:
+    """Read-only stand-in for `InventoryReplica` over a published version.
+
+    `manifest` (see `SnapshotWriter`) names the version's product, index
+    and transaction files and how many transaction rows it spans. The product
+    frame, transaction store, context builder and retrieval index are
+    views of the mapped files, so every worker shares one copy of the
+    data; records are decoded only when a handler returns them.
+    """
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.product_file = products = SnapshotFile(manifest['products'])
+        self.index_file = SnapshotFile(manifest['index'])
+        self.transaction_file = transactions = SnapshotFile(manifest['transactions'], manifest['counts'])
+        header = products.header
+        self.version = manifest['version']
+        self.dashboard = manifest['dashboard']
+        self.seeded = True
+
+        records = RecordColumns(products, ProductRecord, 'product', header['records'])
+        ids = products.strings('product_id')
+        self.products = SharedProducts(
+            ids, records, IdLookup(products.array('product_id_keys'), products.array('product_id_rows'))
+        )
+        history = RecordColumns(
+            transactions, TransactionRecord, 'transaction', transactions.header['records']
+        )
+        self._data = {'products': records, 'dashboard': self.dashboard, 'transactions': history.reversed()}
+
+        frame = ProductFrame.from_columns(
+            records, header['categories'], header['suppliers'], ids=ids,
+            **{name: products.array(f'product_{name}') for name in ProductFrame.COLUMNS}
+        )
+        store = TransactionStore.from_columns(
+            history, products.strings('transaction_product'), products.strings('transaction_name'),
+            **{name: transactions.array(f'transaction_{name}') for name in TransactionStore.COLUMNS}
+        )
+        self.derived = {
+            'product_frame': (self.version, frame),
+            'transaction_store': store,
+            'product_index': SharedProductIndex(self.index_file, ids),
+        }
+        self.derived['context_builder'] = SharedContextBuilder(self)
+
+    @property
+    def size(self):
+        return self.product_file.size + self.index_file.size + self.transaction_file.size
+
+    def subscribe(self, listener):
+        # Published snapshots never change; a new version is a new replica
+        pass
+
+    def snapshot_data(self):
+        return self._data
+
+
+def snapshot_name(key):
+    return hashlib.sha256(key.encode()).hexdigest()[:24]
+
+
+class SnapshotOwner:
+    """Keeps tenant snapshots for a group of worker processes.
+
+    The owner is the only process that talks to the backend: it holds the
+    replicas (`SnapshotCache`), syncs them in the background and publishes
+    each new version into `directory` through a `SnapshotWriter`, then
+    atomically rewrites `<tenant>.current` with the version's manifest.
+    Workers ask it for a tenant over a Unix socket and otherwise just
+    follow the pointers.
+    """
+
+    def __init__(self, directory, cache, interval=None):
+        from replica import SyncScheduler
+
+        self.directory = directory
+        self.cache = cache
+        self.interval = interval if interval is not None else float(os.getenv("SYNC_INTERVAL", 15))
+        self.scheduler = SyncScheduler(cache, self.interval)
+        self.published = {}
+        self.writers = {}
+        self.flights = SingleFlight()
+        # publish_seconds is the whole publication; capture_seconds the part spent on the event loop
+        self.counters = {
+            'requests': 0, 'publications': 0, 'publish_seconds': 0.0, 'capture_seconds': 0.0,
+            'product_sections': 0, 'index_sections': 0, 'transaction_sections': 0,
+        }
+
+    async def publish(self, key, snapshot):
+        """Publish the snapshot's version if it is new. Returns its manifest.
+
+        What changed is copied out on the event loop and encoded and
+        written in a thread, so the owner keeps answering workers while a
+        large tenant is written; concurrent requests for one version share
+        the write.
+        """
+        current = self.published.get(key)
+        if current is not None and current['version'] >= snapshot.version:
+            return current
+        return await self.flights.run((key, snapshot.version), lambda: self._publish(key, snapshot))
+
+    async def _publish(self, key, snapshot):
+        name = snapshot_name(key)
+        writer = self.writers.get(key)
+        if writer is None:
+            writer = self.writers[key] = SnapshotWriter(self.directory, name)
+        # One write at a time per tenant: each continues the files of the last
+        async with writer.lock:
+            current = self.published.get(key)
+            if current is not None and current['version'] >= snapshot.version:
+                # A newer version was published while this one waited
+                return current
+            started = time.perf_counter()
+            products, index, transactions = writer.products, writer.index, writer.transactions
+            for rewrite in (False, True):
+                capture_started = time.perf_counter()
+                parts = writer.capture(snapshot.replica, rewrite)
+                self.counters['capture_seconds'] += time.perf_counter() - capture_started
+                manifest = await asyncio.to_thread(writer.write, parts, key)
+                if manifest is not None:
+                    break
+            writer.adopt(snapshot.replica, parts)
+            write_pointer(os.path.join(self.directory, f"{name}.current"), json.dumps(manifest))
+            writer.collect()
+            self.published[key] = manifest
+            self.counters['publications'] += 1
+            self.counters['product_sections'] += writer.products != products
+            self.counters['index_sections'] += writer.index != index
+            self.counters['transaction_sections'] += writer.transactions is not transactions
+            self.counters['publish_seconds'] += time.perf_counter() - started
+            return manifest
+
+    async def publish_all(self):
+        for key, snapshot in list(self.cache.entries.items()):
+            if snapshot.replica.seeded:
+                try:
+                    await self.publish(key, snapshot)
+                except Exception as e:
+                    print(f"Error publishing snapshot {key}: {e}")
+        for key in [k for k in self.published if k not in self.cache.entries]:
+            del self.published[key]
+            writer = self.writers.pop(key)
+            for stale in (*writer.files(), os.path.join(self.directory, f"{snapshot_name(key)}.current")):
+                try:
+                    os.unlink(stale)
+                except FileNotFoundError:
+                    pass
+
+    async def snapshot(self, token):
+        self.counters['requests'] += 1
+        snapshot, errors = await self.cache.get_snapshot(token)
+        if snapshot is None:
+            return {'manifest': None, 'errors': errors}
+        try:
+            manifest = await self.publish(tenant_key(token), snapshot)
+        except Exception as e:
+            print(f"Error publishing snapshot: {e}")
+            return {'manifest': None, 'errors': {'publish': str(e)}}
+        return {'manifest': manifest, 'errors': errors}
+
+    def invalidate(self, key=None, drop=False):
+        count = self.cache.invalidate(key, drop=drop)
+        # Tell workers to stop serving their copies without asking first
+        write_pointer(os.path.join(self.directory, GENERATION_FILE), str(time.time_ns()))
+        return count
+
+    async def handle(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                op = request.get('op')
+                if op == 'snapshot':
+                    reply = await self.snapshot(request['token'])
+                elif op == 'invalidate':
+                    reply = {'invalidated': self.invalidate(request.get('key'), request.get('drop', False))}
+                elif op == 'stats':
+                    reply = {**self.counters, 'snapshots': self.cache.stats(), 'published': len(self.published)}
+                else:
+                    reply = {'error': f"Unknown op: {op}"}
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        except Exception as e:
+            print(f"Error serving snapshot owner request: {e}")
+        finally:
+            writer.close()
+
+    async def sync_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.scheduler.tick()
+            await self.publish_all()
+
+    async def restore(self):
+        """Load snapshots kept on disk (see `SnapshotStore`) and publish them"""
+        await self.cache.store.restore(self.cache)
+        await self.publish_all()
+
+    async def serve(self):
+        server = await asyncio.start_unix_server(self.handle, os.path.join(self.directory, OWNER_SOCKET))
+        tasks = [asyncio.create_task(self.sync_forever())] if self.interval > 0 else []
+        if self.cache.store is not None:
+            tasks.append(asyncio.create_task(self.restore()))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.cache.client.aclose()
+
+
+class SharedSnapshotCache:
+    """Worker-side snapshot cache over the files a `SnapshotOwner` publishes.
+
+    Drop-in for `SnapshotCache`. A tenant's snapshot is requested from the
+    owner on first use, for a token not seen before, and once older than
+    `ttl`; in between, each lookup checks the tenant's pointer file and
+    swaps to a newer published version without a round trip. Swapping
+    replaces the entry's replica, so requests already holding the old one
+    finish on it.
+    """
+
+    def __init__(self, directory, ttl=None, max_entries=None, connect_timeout=None):
+        self.directory = directory
+        self.socket_path = os.path.join(directory, OWNER_SOCKET)
+        self.ttl = ttl if ttl is not None else float(os.getenv("SNAPSHOT_TTL", 30))
+        self.max_entries = max_entries or int(os.getenv("SNAPSHOT_MAX_TENANTS", 100))
+        self.connect_timeout = (
+            connect_timeout if connect_timeout is not None else float(os.getenv("SNAPSHOT_OWNER_TIMEOUT", 10))
+        )
+        self.entries = OrderedDict()
+        self.pointers = {}
+        self.generation = self._generation()
+        self.flights = SingleFlight()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'revalidations': 0,
+            'swaps': 0,
+            'invalidations': 0,
+        }
+
+    @property
+    def total_bytes(self):
+        return sum(entry.size for entry in self.entries.values())
+
+    def _generation(self):
+        try:
+            return os.stat(os.path.join(self.directory, GENERATION_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _attach(self, key, manifest, entry=None):
+        """Map the version `manifest` names into `entry` (a new one if None),
+        replacing its replica"""
+        if entry is None:
+            entry = Snapshot(SharedReplica(manifest))
+        elif entry.replica.manifest != manifest:
+            previous, entry.replica = entry.replica, SharedReplica(manifest)
+            # The new version extends the same history: keep folding it in
+            store = entry.replica.derived['transaction_store']
+            for name in ('demand_forecast', 'mover_index'):
+                derived = previous.derived.get(name)
+                if derived is not None:
+                    entry.replica.derived[name] = derived.follow(store)
+            self.counters['swaps'] += 1
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            self.pointers.pop(evicted, None)
+        return entry
+
+    def _follow(self, key, entry):
+        """Swap to the tenant's newest published version, if it changed"""
+        pointer = os.path.join(self.directory, f"{snapshot_name(key)}.current")
+        try:
+            inode = os.stat(pointer).st_ino
+            if inode == self.pointers.get(key):
+                return
+            with open(pointer) as f:
+                manifest = json.load(f)
+            self._attach(key, manifest, entry)
+            self.pointers[key] = inode
+        except FileNotFoundError:
+            # Dropped by the owner, or replaced mid-read: ask on the next miss
+            pass
+
+    async def request(self, message):
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # The owner may still be starting
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.05)
+        try:
+            writer.write(json.dumps(message).encode() + b'\n')
+            await writer.drain()
+            return json.loads(await reader.readline())
+        finally:
+            writer.close()
+
+    def request_sync(self, message):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.connect_timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(message).encode() + b'\n')
+            return json.loads(sock.makefile('rb').readline())
+
+    async def load(self, key, token):
+        entry = self.entries.get(key)
+        try:
+            reply = await self.request({'op': 'snapshot', 'token': token})
+        except OSError as e:
+            print(f"Snapshot owner unavailable: {e}")
+            return None, {'owner': str(e) or type(e).__name__}
+        errors = reply.get('errors') or {}
+        if reply.get('manifest') is None:
+            # The owner would not serve this token (e.g. it was rejected)
+            if entry is not None:
+                entry.forget(token)
+            return None, errors
+        for _ in range(3):
+            try:
+                entry = self._attach(key, reply['manifest'], entry)
+                break
+            except FileNotFoundError:
+                # Superseded before we mapped it: take the newest instead
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self._follow(key, entry)
+                    break
+        else:
+            return None, {'owner': 'snapshot file vanished'}
+        entry.fetched_at = time.monotonic()
+        entry.remember(token)
+        return entry, errors
+
+    async def get_snapshot(self, token):
+        """Return `(snapshot, errors)` for the token's tenant"""
+        key = tenant_key(token)
+        generation = self._generation()
+        if generation != self.generation:
+            self.generation = generation
+            for entry in self.entries.values():
+                entry.expire()
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.used_at = time.monotonic()
+            self._follow(key, entry)
+            if entry.age() < self.ttl and entry.knows(token):
+                self.counters['hits'] += 1
+                return entry, {}
+            self.counters['revalidations'] += 1
+        else:
+            self.counters['misses'] += 1
+        return await self.flights.run((key, token_digest(token)), lambda: self.load(key, token))
+
+    def invalidate(self, key=None, drop=False):
+        """Forward to the owner, which tells every worker"""
+        for k in list(self.entries) if key is None else [key] if key in self.entries else []:
+            if drop:
+                del self.entries[k]
+                self.pointers.pop(k, None)
+            else:
+                self.entries[k].expire()
+        self.counters['invalidations'] += 1
+        try:
+            return self.request_sync({'op': 'invalidate', 'key': key, 'drop': drop})['invalidated']
+        except OSError as e:
+            print(f"Snapshot owner unavailable: {e}")
+            return 0
+
+    def stats(self):
+        lookups = self.counters['hits'] + self.counters['misses'] + self.counters['revalidations']
+        return {
+            **self.counters,
+            'coalesced': self.flights.counters['coalesced'],
+            'hit_ratio': round(self.counters['hits'] / lookups, 4) if lookups else 0.0,
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+            'ttl': self.ttl,
+            'shared': True,
+        }
@@ -0,0 +1,40 @@
+import asyncio
+
+
+class SingleFlight:
+    """Share one in-flight call among concurrent callers with the same key.
+
+    The first caller for a key starts the call; callers arriving while it
+    runs await the same result, and an exception is raised to all of
+    them. Once the call finishes the key is free again, so results are
+    never cached beyond the flight itself.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.counters = {'calls': 0, 'coalesced': 0}
+
+    def _done(self, key, future):
+        if self.calls.get(key) is future:
+            del self.calls[key]
+        # Mark the outcome retrieved even if every waiter was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    async def run(self, key, func):
+        """Return `await func()`, joining an in-flight call for `key` if any"""
+        if key is None:
+            return await func()
+        future = self.calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+            self.counters['calls'] += 1
+        else:
+            self.counters['coalesced'] += 1
+        # A cancelled waiter must not cancel the call the others share
+        return await asyncio.shield(future)
+
+    def stats(self):
+        return {**self.counters, 'in_flight': len(self.calls)}
@@ -0,0 +1,224 @@
+import base64
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from backend_client import AUTH_REJECTED, is_transient
+from replica import InventoryReplica
+from single_flight import SingleFlight
+
+
+def tenant_key(token):
+    """Derive a stable cache key for the user behind a JWT.
+
+    The backend signs tokens as `{id: <user id>}`, so a user keeps the same
+    key across token refreshes. The payload is read without verification;
+    callers must still prove a token against the backend before serving
+    cached data for it (see `Snapshot.knows`).
+    """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        if claims.get('id'):
+            return f"user:{claims['id']}"
+    except Exception:
+        pass
+    return f"token:{token_digest(token)}"
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class Snapshot:
+    """One tenant's replica plus the bookkeeping to decide when to refresh it"""
+
+    MAX_KNOWN_TOKENS = 8
+
+    def __init__(self, replica=None):
+        self.replica = replica or InventoryReplica()
+        self.fetched_at = None
+        self.used_at = time.monotonic()
+        self.last_token = None
+        self.tokens = OrderedDict()
+
+    @property
+    def data(self):
+        return self.replica.snapshot_data()
+
+    @property
+    def version(self):
+        return self.replica.version
+
+    @property
+    def size(self):
+        return self.replica.size
+
+    def age(self):
+        if self.fetched_at is None:
+            return float('inf')
+        return time.monotonic() - self.fetched_at
+
+    def idle(self):
+        return time.monotonic() - self.used_at
+
+    def expire(self):
+        self.fetched_at = None
+
+    def knows(self, token):
+        """True if the backend has accepted this token for this snapshot"""
+        return token_digest(token) in self.tokens
+
+    def remember(self, token):
+        self.tokens[token_digest(token)] = True
+        self.tokens.move_to_end(token_digest(token))
+        while len(self.tokens) > self.MAX_KNOWN_TOKENS:
+            self.tokens.popitem(last=False)
+        self.last_token = token
+
+    def forget(self, token):
+        """Drop a token the backend has rejected"""
+        self.tokens.pop(token_digest(token), None)
+        if self.last_token == token:
+            self.last_token = None
+
+
+class SnapshotCache:
+    """Per-tenant inventory snapshot cache with TTL, LRU eviction and invalidation.
+
+    A fresh snapshot is served without touching the backend. Once it is
+    older than `ttl` (or invalidated) its replica is delta-synced, so the
+    refresh costs what changed rather than the catalogue size; the
+    dashboard is revalidated with a conditional request. Memory is bounded
+    by both tenant count and approximate payload bytes. Concurrent
+    requests for one tenant share a single in-flight load. With a `store`
+    (see `snapshot_store.SnapshotStore`) snapshots also survive restarts.
+    """
+
+    def __init__(self, client, ttl=None, max_entries=None, max_bytes=None, store=None):
+        self.client = client
+        self.store = store
+        self.ttl = ttl if ttl is not None else float(os.getenv("SNAPSHOT_TTL", 30))
+        self.max_entries = max_entries or int(os.getenv("SNAPSHOT_MAX_TENANTS", 100))
+        self.max_bytes = max_bytes or int(os.getenv("SNAPSHOT_MAX_BYTES", 256 * 1024 * 1024))
+        self.entries = OrderedDict()
+        self.flights = SingleFlight()
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'revalidations': 0,
+            'unchanged': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    @property
+    def total_bytes(self):
+        return sum(entry.size for entry in self.entries.values())
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        total = self.total_bytes
+        while self.entries and (
+            len(self.entries) > self.max_entries or
+            (total > self.max_bytes and len(self.entries) > 1)
+        ):
+            _, entry = self.entries.popitem(last=False)
+            total -= entry.size
+            self.counters['evictions'] += 1
+
+    def invalidate(self, key=None, drop=False):
+        """Mark one tenant's snapshot (or all when `key` is None) as stale.
+
+        Stale snapshots are delta-synced on next use; `drop=True` discards
+        them instead, forcing a full reseed.
+        """
+        keys = list(self.entries) if key is None else [key] if key in self.entries else []
+        for k in keys:
+            if drop:
+                del self.entries[k]
+            else:
+                self.entries[k].expire()
+        if drop and self.store is not None:
+            self.store.discard(key)
+        self.counters['invalidations'] += len(keys)
+        return len(keys)
+
+    async def refresh(self, key, entry, token):
+        """Sync an entry's replica with the backend. Returns `(snapshot, errors)`."""
+        changes, errors, statuses = await entry.replica.sync(self.client, token)
+
+        if any(status in AUTH_REJECTED for status in statuses.values()):
+            # Expired token or deactivated user: nothing is served to it,
+            # cached or not, and background syncs stop using it
+            entry.forget(token)
+            return None, errors
+
+        if len(errors) == 3:
+            # Backend unavailable: serve stale data only to a token the
+            # backend has accepted before
+            if entry.replica.seeded and entry.knows(token) and all(map(is_transient, statuses.values())):
+                return entry, errors
+            return None, errors
+
+        if not any(changes.values()):
+            self.counters['unchanged'] += 1
+        entry.fetched_at = time.monotonic()
+        entry.remember(token)
+        # A first load with missing sections is served but not cached
+        if entry.replica.seeded:
+            self.put(key, entry)
+        return entry, errors
+
+    async def load(self, key, token):
+        """Serve from cache or sync. Returns `(token, (snapshot, errors))`."""
+        entry = self.get(key)
+
+        if entry is not None:
+            entry.used_at = time.monotonic()
+            if entry.age() < self.ttl and entry.knows(token):
+                self.counters['hits'] += 1
+                return token, (entry, {})
+            self.counters['revalidations'] += 1
+        else:
+            self.counters['misses'] += 1
+            entry = Snapshot()
+
+        return token, await self.refresh(key, entry, token)
+
+    async def get_snapshot(self, token):
+        """Return `(snapshot, errors)` for the token's tenant, syncing as needed.
+
+        Concurrent calls for a tenant share one load. A caller that joined a
+        load made with another token takes its result only if its own token
+        was accepted before; otherwise it loads with its own token.
+        """
+        key = tenant_key(token)
+        while True:
+            used, (snapshot, errors) = await self.flights.run(key, lambda: self.load(key, token))
+            if used == token or (snapshot is not None and snapshot.knows(token)):
+                return snapshot, errors
+
+    def stats(self):
+        lookups = self.counters['hits'] + self.counters['misses'] + self.counters['revalidations']
+        return {
+            **self.counters,
+            'coalesced': self.flights.counters['coalesced'],
+            'hit_ratio': round(self.counters['hits'] / lookups, 4) if lookups else 0.0,
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+            'ttl': self.ttl,
+            **({'store': self.store.stats()} if self.store is not None else {}),
+        }
@@ -0,0 +1,525 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Sequence
+import numpy as np
+
+
+MAGIC = b'INVSNAP1'
+ALIGN = 64
+# Integers beyond this do not survive a float64 column
+EXACT_INT = 2 ** 53
+
+_MISSING = object()
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _dumps(value):
+    # Records are read-only mappings; nested ones serialize as dicts
+    return json.dumps(value, default=dict, separators=(',', ':'))
+
+
+def room(count):
+    """Capacity reserved for an array of `count` items that will grow"""
+    return max(2 * count, count + 4096)
+
+
+def string_arrays(values):
+    """Encode strings as an `(offsets, blob)` pair of arrays"""
+    encoded = [value.encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    if encoded:
+        np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def decode_strings(offsets, blob):
+    """All strings of an `(offsets, blob)` pair, as a list"""
+    data = blob[:offsets[-1]].tobytes()
+    bounds = offsets.tolist()
+    if data.isascii():
+        # Byte offsets are character offsets: slice one decoded string
+        data = data.decode()
+        return [data[start:end] for start, end in zip(bounds, bounds[1:])]
+    return [data[start:end].decode() for start, end in zip(bounds, bounds[1:])]
+
+
+def id_arrays(ids):
+    """Sorted id keys plus the row of each, for `IdLookup`"""
+    keys = np.array([i.encode() for i in ids], dtype=f'S{max([len(i) for i in ids] or [1])}')
+    order = np.argsort(keys, kind='stable').astype(np.int32)
+    return keys[order], order
+
+
+def _sync_directory(path):
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def write_snapshot(path, header, arrays, durable=False, capacity=None):
+    """Write a snapshot file: magic, header length, JSON header, then the
+    1-D `arrays` at 64-byte aligned offsets. Written to a temporary name and
+    renamed, so readers only ever see complete files. `durable` also syncs
+    the file and its directory, so the rename survives a crash. `capacity`
+    reserves room for named arrays to grow into (see `GrowingFile`).
+    Returns `(start, layout)`: where the arrays begin and each one's
+    `[offset, dtype, capacity]`."""
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        arrays[name] = array = np.ascontiguousarray(array)
+        size = (capacity or {}).get(name, len(array))
+        layout[name] = [offset, array.dtype.str, size]
+        offset = _align(offset + size * array.itemsize)
+    head = json.dumps({**header, 'arrays': layout}, default=dict).encode()
+    start = _align(16 + len(head))
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(head)) + head)
+        for name, array in arrays.items():
+            f.seek(start + layout[name][0])
+            f.write(memoryview(array).cast('B'))
+        f.truncate(start + offset)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if durable:
+        _sync_directory(path)
+    return start, layout
+
+
+def write_pointer(path, target, durable=False):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        f.write(target)
+        if durable:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if durable:
+        _sync_directory(path)
+
+
+class GrowingFile:
+    """Writer of a snapshot file whose arrays have room to grow.
+
+    `append` writes past the counts earlier readers were given, in place,
+    so the rows a reader maps never change under it. Once an array is
+    full `append` returns False and the caller starts a new file.
+    """
+
+    def __init__(self, path, header, arrays, durable=False):
+        self.path = path
+        self.durable = durable
+        self.counts = {name: len(array) for name, array in arrays.items()}
+        capacity = {name: room(count) for name, count in self.counts.items()}
+        self.start, self.layout = write_snapshot(path, {**header, 'counts': self.counts}, arrays, durable, capacity)
+        self.size = os.path.getsize(path)
+
+    def strings(self, name, values):
+        """`(offsets, blob)` chunks appending `values` to string table `name`"""
+        offsets, blob = string_arrays(values)
+        return offsets[1:] + self.counts[f'{name}_blob'], blob
+
+    def append(self, chunks):
+        """Append `{name: array}` chunks; False (and nothing written) when one does not fit"""
+        if any(self.counts[name] + len(chunk) > self.layout[name][2] for name, chunk in chunks.items()):
+            return False
+        with open(self.path, 'r+b') as f:
+            for name, chunk in chunks.items():
+                if not len(chunk):
+                    continue
+                offset, dtype, _ = self.layout[name]
+                chunk = np.ascontiguousarray(chunk, dtype=dtype)
+                f.seek(self.start + offset + self.counts[name] * chunk.itemsize)
+                f.write(memoryview(chunk).cast('B'))
+            if self.durable:
+                f.flush()
+                os.fsync(f.fileno())
+        for name, chunk in chunks.items():
+            self.counts[name] += len(chunk)
+        return True
+
+
+class SnapshotFile:
+    """A snapshot file mapped read-only; arrays are zero-copy views of the mapping.
+
+    `counts` limits arrays to the part a published version spans (the
+    file's own counts by default).
+    """
+
+    def __init__(self, path, counts=None):
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a snapshot file: {path}")
+        (length,) = struct.unpack_from('<Q', self.buffer, len(MAGIC))
+        self.header = json.loads(self.buffer[16:16 + length])
+        self.start = _align(16 + length)
+        self.counts = counts if counts is not None else self.header.get('counts', {})
+        self.path = path
+        self.size = len(self.buffer)
+
+    def array(self, name):
+        offset, dtype, capacity = self.header['arrays'][name]
+        return np.frombuffer(
+            self.buffer, dtype=dtype, count=self.counts.get(name, capacity), offset=self.start + offset
+        )
+
+    def strings(self, name, table=None):
+        return (table or StringTable)(self.array(f'{name}_offsets'), self.array(f'{name}_blob'))
+
+
+class StringTable(Sequence):
+    """Strings stored as offsets into a byte blob, decoded on access"""
+
+    def __init__(self, offsets, blob, reverse=False):
+        self.offsets = offsets
+        self.blob = blob
+        self.reverse = reverse
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def decode(self, data):
+        return data.decode()
+
+    def __getitem__(self, i):
+        n = len(self)
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(n))]
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(i)
+        if self.reverse:
+            i = n - 1 - i
+        return self.decode(self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes())
+
+    def reversed(self):
+        return type(self)(self.offsets, self.blob, not self.reverse)
+
+
+class IdLookup:
+    """Id -> row lookup by binary search over sorted fixed-width keys"""
+
+    def __init__(self, keys, rows):
+        self.keys = keys
+        self.rows = rows
+
+    def row(self, key):
+        if not isinstance(key, str) or not len(self.keys):
+            return -1
+        encoded = key.encode()
+        i = int(np.searchsorted(self.keys, encoded))
+        if i < len(self.keys) and self.keys[i] == encoded:
+            return int(self.rows[i])
+        return -1
+
+
+# -- records by column ---------------------------------------------------
+
+def _fits(kind, values):
+    if kind in ('str', 'label'):
+        return all(value.__class__ is str for value in values)
+    if kind == 'bool':
+        return all(value.__class__ is bool for value in values)
+    if kind == 'number':
+        return all(
+            value.__class__ is float or (value.__class__ is int and -EXACT_INT <= value <= EXACT_INT)
+            for value in values
+        )
+    return kind == 'json'
+
+
+def _ref_keys(values):
+    """`_values()` of each nested record, computed once per instance (refs
+    are shared between the records of one decode)"""
+    keys = {}
+    for value in values:
+        if value is not _MISSING and id(value) not in keys:
+            keys[id(value)] = value._values()
+    return [value if value is _MISSING else keys[id(value)] for value in values]
+
+
+def _refs_fit(nested, values):
+    distinct = {id(value): value for value in values}.values()
+    try:
+        return all(value.__class__ is nested and hash(value._values()) is not None for value in distinct)
+    except TypeError:
+        return False
+
+
+def _field(records, field, plain):
+    if plain:
+        return [getattr(record, field, _MISSING) for record in records]
+    return [record.get(field, _MISSING) for record in records]
+
+
+class ColumnWriter:
+    """Encodes `Record`s of one type column by column, appending to what it
+    encoded before.
+
+    Each field gets a kind from the records it first sees: numbers are a
+    float64 column, booleans a byte column, strings an offsets/blob table,
+    interned strings (`Record.INTERNED`) and nested records
+    (`Record.NESTED`, encoded by a nested writer) integer codes into a
+    table of distinct values; anything else is stored as JSON. Fields some
+    records lack get a presence column. `fits` tells whether more records
+    can be appended without changing a kind.
+    """
+
+    def __init__(self, cls, prefix, records=()):
+        self.cls = cls
+        self.prefix = prefix
+        self.rows = 0
+        self.kinds = {}
+        self.present = set()
+        self.labels = {}
+        self.refs = {}
+        self.bases = {}
+        plain = all(record.__class__ is cls for record in records)
+        for field, _, nested, interned in cls._plan:
+            values = [value for value in _field(records, field, plain) if value is not _MISSING]
+            if len(values) < len(records):
+                self.present.add(field)
+            if nested is not None:
+                kind = 'ref' if _refs_fit(nested, values) else 'json'
+            else:
+                kind = next(
+                    (kind for kind in ('label' if interned else 'str', 'bool', 'number') if _fits(kind, values)),
+                    'json'
+                )
+            self.kinds[field] = kind
+            if kind == 'label':
+                self.labels[field] = {}
+            elif kind == 'ref':
+                unique = list(dict(zip(_ref_keys(values), values)).values())
+                self.refs[field] = ({}, ColumnWriter(nested, f'{prefix}.{field}.refs', unique))
+
+    def meta(self):
+        """What a `RecordColumns` reader needs besides the arrays"""
+        return {
+            'kinds': self.kinds,
+            'present': sorted(self.present),
+            'refs': {field: writer.meta() for field, (_, writer) in self.refs.items()},
+        }
+
+    def counts(self):
+        """Rows encoded so far, by prefix (nested tables included)"""
+        counts = {self.prefix: self.rows}
+        for _, writer in self.refs.values():
+            counts.update(writer.counts())
+        return counts
+
+    def fits(self, records):
+        plain = all(record.__class__ is self.cls for record in records)
+        for field, _, nested, _ in self.cls._plan:
+            values = _field(records, field, plain)
+            if any(value is _MISSING for value in values):
+                if field not in self.present:
+                    return False
+                values = [value for value in values if value is not _MISSING]
+            kind = self.kinds[field]
+            if kind == 'ref':
+                if not _refs_fit(nested, values) or not self.refs[field][1].fits(values):
+                    return False
+            elif not _fits(kind, values):
+                return False
+        return True
+
+    def _strings(self, arrays, name, values):
+        offsets, blob = string_arrays(values)
+        base = self.bases.get(name)
+        # Later chunks continue the offsets of the first
+        arrays[f'{name}_offsets'] = offsets if base is None else offsets[1:] + base
+        arrays[f'{name}_blob'] = blob
+        self.bases[name] = (base or 0) + len(blob)
+
+    def _codes(self, table, keys):
+        codes = np.empty(len(keys), dtype=np.int32)
+        new = []
+        for i, key in enumerate(keys):
+            if key is _MISSING:
+                codes[i] = -1
+                continue
+            code = table.get(key)
+            if code is None:
+                code = table[key] = len(table)
+                new.append(i)
+            codes[i] = code
+        return codes, new
+
+    def encode(self, records):
+        """`{name: array}` of `records`, continuing the arrays encoded so far"""
+        arrays = {}
+        plain = all(record.__class__ is self.cls for record in records)
+        for field, _, _, _ in self.cls._plan:
+            name = f'{self.prefix}.{field}'
+            kind = self.kinds[field]
+            values = _field(records, field, plain)
+            if field in self.present:
+                arrays[f'{name}.present'] = np.fromiter(
+                    (value is not _MISSING for value in values), dtype=np.uint8, count=len(values)
+                )
+            if kind == 'number':
+                arrays[name] = np.array([0 if value is _MISSING else value for value in values], dtype=np.float64)
+            elif kind == 'bool':
+                arrays[name] = np.array([value is True for value in values], dtype=np.uint8)
+            elif kind == 'str':
+                self._strings(arrays, name, ('' if value is _MISSING else value for value in values))
+            elif kind == 'json':
+                self._strings(arrays, name, ('' if value is _MISSING else _dumps(value) for value in values))
+            elif kind == 'label':
+                arrays[name], new = self._codes(self.labels[field], values)
+                self._strings(arrays, f'{name}.labels', (values[i] for i in new))
+            else:
+                table, writer = self.refs[field]
+                arrays[name], new = self._codes(table, _ref_keys(values))
+                arrays.update(writer.encode([values[i] for i in new]))
+        self.rows += len(records)
+        return arrays
+
+
+class RecordColumns(Sequence):
+    """Records stored by a `ColumnWriter`, read from a `SnapshotFile`.
+
+    Rows are decoded on access (nested records once per distinct value),
+    or all at once by `decode`.
+    """
+
+    def __init__(self, file, cls, prefix, meta, reverse=False):
+        self.file = file
+        self.cls = cls
+        self.prefix = prefix
+        self.meta = meta
+        self.reverse = reverse
+        self.n = file.counts[prefix]
+        self.refs = {
+            field: RecordColumns(file, cls.NESTED[field], f'{prefix}.{field}.refs', nested)
+            for field, nested in meta['refs'].items()
+        }
+        self.getters = None
+        self.shared = {}
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.n))]
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        return self.row(self.n - 1 - i if self.reverse else i)
+
+    def reversed(self):
+        return type(self)(self.file, self.cls, self.prefix, self.meta, not self.reverse)
+
+    def _array(self, name):
+        return self.file.array(name)[:self.n]
+
+    def _strings(self, name):
+        return StringTable(self.file.array(f'{name}_offsets')[:self.n + 1], self.file.array(f'{name}_blob'))
+
+    def _labels(self, name):
+        offsets = self.file.array(f'{name}.labels_offsets')
+        return [sys.intern(label) for label in decode_strings(offsets, self.file.array(f'{name}.labels_blob'))]
+
+    def _getter(self, field, nested):
+        name = f'{self.prefix}.{field}'
+        kind = self.meta['kinds'][field]
+        if kind == 'number':
+            column = self._array(name)
+            getter = lambda i: _number(float(column[i]))
+        elif kind == 'bool':
+            column = self._array(name)
+            getter = lambda i: bool(column[i])
+        elif kind == 'str':
+            getter = self._strings(name).__getitem__
+        elif kind == 'json':
+            table = self._strings(name)
+            getter = lambda i: _decode_json(table[i], nested)
+        elif kind == 'label':
+            column, labels = self._array(name), self._labels(name)
+            getter = lambda i: labels[column[i]]
+        else:
+            column, refs = self._array(name), self.refs[field]
+            getter = lambda i: refs.row(int(column[i]))
+        if field in self.meta['present']:
+            present = self._array(f'{name}.present')
+            return lambda i: getter(i) if present[i] else _MISSING
+        return getter
+
+    def row(self, i):
+        """The record at stored row `i`"""
+        shared = self.cls.SHARED
+        if shared and i in self.shared:
+            return self.shared[i]
+        if self.getters is None:
+            self.getters = [
+                (set_slot, self._getter(field, nested)) for field, set_slot, nested, _ in self.cls._plan
+            ]
+        record = self.cls.__new__(self.cls)
+        for set_slot, getter in self.getters:
+            value = getter(i)
+            if value is not _MISSING:
+                set_slot(record, value)
+        if shared:
+            self.shared[i] = record
+        return record
+
+    def _values(self, field, nested):
+        name = f'{self.prefix}.{field}'
+        kind = self.meta['kinds'][field]
+        if kind == 'number':
+            column = self._array(name)
+            if np.array_equal(column, np.trunc(column)):
+                return column.astype(np.int64).tolist()
+            return [_number(value) for value in column.tolist()]
+        if kind == 'bool':
+            return self._array(name).astype(bool).tolist()
+        if kind in ('str', 'json'):
+            table = self._strings(name)
+            values = decode_strings(table.offsets, table.blob)
+            return values if kind == 'str' else [_decode_json(value, nested) for value in values]
+        # Missing rows have code -1: the trailing None stands in for them
+        if kind == 'label':
+            labels = self._labels(name) + [None]
+        else:
+            labels = self.refs[field].decode() + [None]
+        return [labels[code] for code in self._array(name).tolist()]
+
+    def decode(self):
+        """Every record, in stored order"""
+        records = [self.cls.__new__(self.cls) for _ in range(self.n)]
+        for field, set_slot, nested, _ in self.cls._plan:
+            values = self._values(field, nested)
+            if field in self.meta['present']:
+                for record, value, present in zip(records, values, self._array(f'{self.prefix}.{field}.present').tolist()):
+                    if present:
+                        set_slot(record, value)
+            else:
+                for record, value in zip(records, values):
+                    set_slot(record, value)
+        return records
+
+
+def _number(value):
+    # JSON has one number type; integral values were integers
+    return int(value) if value.is_integer() else value
+
+
+def _decode_json(text, nested):
+    value = json.loads(text) if text else None
+    return nested.decode(value) if nested is not None else value
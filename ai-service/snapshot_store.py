@@ -0,0 +1,327 @@
+import asyncio
+import json
+import os
+import time
+from analytics import ProductFrame
+from context_builder import ContextBuilder
+from forecasting import DemandForecast
+from movers import MoverIndex
+from records import ProductRecord, TransactionRecord
+from replica import InventoryReplica
+from retrieval import ProductIndex
+from shared_snapshot import SnapshotWriter, snapshot_name
+from snapshot_cache import Snapshot
+from snapshot_format import RecordColumns, SnapshotFile, decode_strings, write_pointer
+from tokens import estimate_tokens
+from transaction_store import TransactionStore
+
+
+# Bumped when the stored layout changes; files of another format are discarded
+STORE_FORMAT = 2
+SUFFIX = '.inv'
+
+
+def _strings(file, name):
+    return decode_strings(file.array(f'{name}_offsets'), file.array(f'{name}_blob'))
+
+
+def load_replica(path):
+    """Read a stored replica. Returns `(header, replica)`.
+
+    Records are decoded column by column; the product frame is a view of
+    the stored columns, and the transaction store, context builder and
+    retrieval index start from the stored columns, rendered lines and
+    postings instead of re-parsing, re-rendering and re-tokenizing every
+    record.
+    """
+    with open(path) as f:
+        header = json.load(f)
+    if header.get('format') != STORE_FORMAT:
+        raise ValueError(f"unsupported snapshot format {header.get('format')}")
+    sections = header['sections']
+    products = SnapshotFile(sections['products'])
+    transactions = SnapshotFile(sections['transactions'], sections['counts'])
+
+    # Products by frame row (backend order); the replica keeps its own order
+    rows = RecordColumns(products, ProductRecord, 'product', products.header['records']).decode()
+    history = RecordColumns(transactions, TransactionRecord, 'transaction', transactions.header['records']).decode()
+    replica = InventoryReplica.restore(
+        header['state'], [rows[row] for row in products.array('replica_order').tolist()], history
+    )
+
+    frame = ProductFrame.from_columns(
+        rows, products.header['categories'], products.header['suppliers'],
+        **{name: products.array(f'product_{name}') for name in ProductFrame.COLUMNS}
+    )
+    replica.derived['product_frame'] = (replica.version, frame)
+
+    store = TransactionStore.restore(
+        history,
+        [product_id or None for product_id in _strings(products, 'transaction_product')],
+        [name or None for name in _strings(products, 'transaction_name')],
+        **{name: transactions.array(f'transaction_{name}') for name in TransactionStore.COLUMNS}
+    )
+    replica.derived['transaction_store'] = store
+    replica.subscribe(store.apply)
+
+    product_lines = {
+        p.get('_id'): (p.get('updatedAt'), line, estimate_tokens(line) + 1)
+        for p, line in zip(rows, _strings(products, 'product_line'))
+    }
+    transaction_lines = {
+        t.get('_id'): (t.get('updatedAt'), line) for t, line in zip(history, _strings(transactions, 'transaction_line'))
+    }
+    builder = ContextBuilder(replica.products.values(), replica.transactions.values(), product_lines, transaction_lines)
+    replica.derived['context_builder'] = builder
+    replica.subscribe(builder.apply)
+
+    index = SnapshotFile(sections['index'])
+    ids = [p.get('_id') for p in rows]
+    offsets = index.array('index_offsets').tolist()
+    postings, tf = [ids[row] for row in index.array('index_rows').tolist()], index.array('index_tf').tolist()
+    doc_len = index.array('index_doc_len').tolist()
+    documents = index.array('index_documents').tolist()
+    product_index = ProductIndex.from_postings(
+        [ids[row] for row in documents],
+        {
+            term: dict(zip(postings[start:end], tf[start:end]))
+            for term, start, end in zip(_strings(index, 'index_term'), offsets, offsets[1:])
+        },
+        {ids[row]: doc_len[row] for row in documents},
+        index.header['total_len'],
+    )
+    replica.derived['product_index'] = product_index
+    replica.subscribe(product_index.apply)
+    return header, replica
+
+
+def warm_replica(replica):
+    """Build the structures requests derive from a replica, ahead of them"""
+    ProductFrame.attach(replica)
+    ContextBuilder.attach(replica)
+    ProductIndex.attach(replica)
+    DemandForecast.attach(replica).project(ProductFrame.attach(replica))
+    MoverIndex.attach(replica).update(ProductFrame.attach(replica))
+    replica.snapshot_data()
+
+
+class SnapshotStore:
+    """Tenant snapshots persisted on local disk for warm restarts.
+
+    Each tenant is stored as the sections a `SnapshotWriter` writes (the
+    records, frame and store columns, rendered lines and retrieval
+    postings) plus a manifest, `<tenant>.inv`, naming them alongside the
+    replica's sync cursors. Sections and manifests are synced and renamed
+    into place, and transactions are appended in place past the rows the
+    manifest spans, so a crash leaves either the old or the new version.
+    Only what changed since the last save is written, except for the first
+    save of a tenant after a restart. On start-up the stored replicas are
+    loaded from the sections and their forecasts built in the background;
+    each is then delta-synced from its cursors on first use instead of
+    being pulled in full. Token digests are not stored, so a restored
+    snapshot is served to a token only after it synced with it.
+
+    `persist` saves tenants whose version changed, at most every
+    `interval` seconds. Tenants unused for `max_idle` seconds are deleted,
+    then the least recently used until the store fits `max_bytes`.
+    """
+
+    def __init__(self, directory, interval=None, max_bytes=None, max_idle=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.interval = interval if interval is not None else float(os.getenv("SNAPSHOT_STORE_INTERVAL", 60))
+        self.max_bytes = max_bytes or int(os.getenv("SNAPSHOT_STORE_MAX_BYTES", 2 * 1024 ** 3))
+        self.max_idle = max_idle or float(os.getenv("SNAPSHOT_STORE_MAX_IDLE", 7 * 24 * 3600))
+        # key -> (version, used_at) last persisted
+        self.saved = {}
+        # key -> the SnapshotWriter that continues its sections
+        self.writers = {}
+        self.persisted_at = 0.0
+        self.restored = False
+        self.lock = asyncio.Lock()
+        self.counters = {'saves': 0, 'save_seconds': 0.0, 'restores': 0, 'restore_seconds': 0.0, 'evictions': 0, 'errors': 0}
+
+    @classmethod
+    def from_env(cls):
+        """The store in SNAPSHOT_STORE_DIR, or None when persistence is off"""
+        directory = os.getenv("SNAPSHOT_STORE_DIR")
+        return cls(directory) if directory else None
+
+    def path(self, key):
+        return os.path.join(self.directory, snapshot_name(key) + SUFFIX)
+
+    def files(self):
+        """Stored manifest paths, least recently used first"""
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(SUFFIX)]
+        return sorted(paths, key=lambda path: os.stat(path).st_mtime)
+
+    def sections(self, path):
+        """Section files of the tenant whose manifest is `path`"""
+        prefix = os.path.basename(path)[:-len(SUFFIX)] + '-'
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.startswith(prefix)]
+
+    def size(self, path):
+        return sum(os.stat(file).st_size for file in [path, *self.sections(path)])
+
+    # -- saving -----------------------------------------------------------
+
+    def save(self, writer, parts, key, state, sweep=False):
+        """Write one tenant's changed sections, then its manifest (blocking).
+        Returns False when its transaction section is full: capture again
+        with `rewrite`. `sweep` deletes sections the manifest does not name
+        (left by an earlier process)."""
+        sections = writer.write(parts, key)
+        if sections is None:
+            return False
+        write_pointer(self.path(key), json.dumps({
+            'format': STORE_FORMAT,
+            'tenant': key,
+            'saved_at': time.time(),
+            'state': state,
+            'sections': sections,
+        }), durable=True)
+        writer.collect()
+        if sweep:
+            for path in self.sections(self.path(key)):
+                if path not in writer.files():
+                    self._remove(path)
+        return True
+
+    async def persist(self, cache, force=False):
+        """Save changed tenants of `cache` (off the event loop) and apply the
+        size and idle limits; runs at most every `interval` seconds unless
+        `force`d"""
+        if not force and time.monotonic() - self.persisted_at < self.interval:
+            return 0
+        async with self.lock:
+            self.persisted_at = time.monotonic()
+            saved = 0
+            for key, entry in list(cache.entries.items()):
+                replica = entry.replica
+                last = self.saved.get(key)
+                if not replica.seeded:
+                    continue
+                if last is not None and last[0] == replica.version:
+                    if entry.used_at != last[1]:
+                        # Unchanged but in use: keep it from looking idle
+                        self._touch(key)
+                        self.saved[key] = (replica.version, entry.used_at)
+                    continue
+                writer = self.writers.get(key)
+                sweep = writer is None
+                if sweep:
+                    writer = self.writers[key] = SnapshotWriter(self.directory, snapshot_name(key), durable=True)
+                started = time.perf_counter()
+                try:
+                    for rewrite in (False, True):
+                        # Captured here; the replica may change while the thread writes
+                        parts = writer.capture(replica, rewrite)
+                        if await asyncio.to_thread(self.save, writer, parts, key, replica.state(), sweep):
+                            break
+                    writer.adopt(replica, parts)
+                except Exception as e:
+                    self.counters['errors'] += 1
+                    print(f"Error persisting snapshot {key}: {e}")
+                    # Start over with a full save
+                    self.writers.pop(key, None)
+                    continue
+                self.saved[key] = (replica.version, entry.used_at)
+                self.counters['saves'] += 1
+                self.counters['save_seconds'] += time.perf_counter() - started
+                saved += 1
+            await asyncio.to_thread(self.evict)
+            return saved
+
+    def _touch(self, key):
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Delete idle tenants, then the least recently used beyond `max_bytes`"""
+        now = time.time()
+        paths = self.files()
+        sizes = {path: self.size(path) for path in paths}
+        total = sum(sizes.values())
+        keys = {self.path(key): key for key in self.saved}
+        for path in paths:
+            if now - os.stat(path).st_mtime <= self.max_idle and total <= self.max_bytes:
+                break
+            self._remove_tenant(path)
+            # Saved again in full if the tenant is still cached
+            key = keys.get(path)
+            self.saved.pop(key, None)
+            self.writers.pop(key, None)
+            total -= sizes[path]
+            self.counters['evictions'] += 1
+
+    def discard(self, key=None):
+        """Delete one tenant's files (every tenant's when `key` is None)"""
+        if key is None:
+            for path in self.files():
+                self._remove_tenant(path)
+            self.saved.clear()
+            self.writers.clear()
+        else:
+            self._remove_tenant(self.path(key))
+            self.saved.pop(key, None)
+            self.writers.pop(key, None)
+
+    def _remove_tenant(self, path):
+        # The manifest first: sections without one are never read
+        self._remove(path)
+        for section in self.sections(path):
+            self._remove(section)
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    # -- restoring --------------------------------------------------------
+
+    def load(self, path):
+        """Read and warm one stored tenant (blocking). Returns `(key, snapshot)`."""
+        header, replica = load_replica(path)
+        warm_replica(replica)
+        # Accepted tokens are not stored: each must sync successfully once
+        # before the restored snapshot is served to it
+        return header['tenant'], Snapshot(replica)
+
+    async def restore(self, cache):
+        """Load stored tenants into `cache`, most recently used last, up to its
+        tenant limit. Restored snapshots count as stale, so their first
+        request delta-syncs them. Returns the number restored."""
+        started = time.perf_counter()
+        restored = 0
+        try:
+            for path in (await asyncio.to_thread(self.files))[-cache.max_entries:]:
+                try:
+                    key, snapshot = await asyncio.to_thread(self.load, path)
+                except Exception as e:
+                    self.counters['errors'] += 1
+                    print(f"Discarding unreadable snapshot {path}: {e}")
+                    self._remove_tenant(path)
+                    continue
+                # A request may have loaded the tenant in the meantime
+                if key in cache.entries:
+                    continue
+                cache.put(key, snapshot)
+                self.saved[key] = (snapshot.version, snapshot.used_at)
+                restored += 1
+        finally:
+            self.restored = True
+            self.counters['restores'] += restored
+            self.counters['restore_seconds'] += time.perf_counter() - started
+        return restored
+
+    def stats(self):
+        paths = self.files()
+        return {
+            **self.counters,
+            'files': len(paths),
+            'bytes': sum(self.size(path) for path in paths),
+            'restored': self.restored,
+        }
@@ -0,0 +1,17 @@
+def estimate_tokens(text):
+    """Cheap local token estimate (~4 characters per token for English text)"""
+    if not text:
+        return 0
+    return (len(text) + 3) // 4
+
+
+def take_within_budget(lines, budget):
+    """Return the longest prefix of `lines` whose estimated tokens fit `budget`"""
+    taken, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        taken.append(line)
+        used += cost
+    return taken
@@ -0,0 +1,269 @@
+import numpy as np
+from datetime import datetime, timezone
+from analytics import parse_epoch_ms
+
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def now_ms():
+    return int(datetime.now(timezone.utc).timestamp() * 1000)
+
+
+def days_ago_ms(days, now=None):
+    """UTC epoch milliseconds `days` before `now` (default: the current time)"""
+    return (now if now is not None else now_ms()) - int(days * DAY_MS)
+
+
+def to_epoch_ms(value):
+    """Accept epoch ms, an aware/naive (UTC) datetime or an ISO string"""
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp() * 1000)
+    return int(parse_epoch_ms([value])[0])
+
+
+class TransactionStore:
+    """Time-indexed transaction store.
+
+    Timestamps are parsed once into a sorted int64 epoch-ms array with
+    parallel product-code, direction and quantity columns, so window
+    queries are a binary search plus a slice: "recent N" and "movement
+    over a period" cost O(log n + k). Per-product IN/OUT totals for the
+    common rolling windows are kept incrementally; each window only
+    subtracts the transactions that slid out of it since the last query.
+    Product names follow the product records (`rename`), not the copy
+    populated into each transaction when it was fetched.
+    """
+
+    ROLLING_DAYS = (1, 7, 30, 90)
+    COLUMNS = ('timestamp', 'product', 'is_out', 'quantity')
+
+    def __init__(self, transactions=(), rolling_days=None):
+        self.rolling_days = tuple(rolling_days or self.ROLLING_DAYS)
+        self.n = 0
+        self.timestamp = np.empty(0, dtype=np.int64)
+        self.product = np.empty(0, dtype=np.int32)
+        self.is_out = np.empty(0, dtype=bool)
+        self.quantity = np.empty(0, dtype=np.int64)
+        self.records = []
+        self.ids = set()
+        self.product_codes = {}
+        self.product_ids = []
+        self.product_names = []
+        # Bumped when late arrivals reorder rows already stored
+        self.reorders = 0
+        # days -> [left index, in_units, out_units]
+        self.windows = {}
+        self.add(transactions)
+
+    @classmethod
+    def of(cls, transactions):
+        return transactions if isinstance(transactions, cls) else cls(transactions)
+
+    @classmethod
+    def from_columns(cls, records, product_ids, product_names, rolling_days=None, **columns):
+        """Read-only store over existing `COLUMNS` arrays in time order (e.g.
+        views of a shared snapshot). Queries work as usual; `add` does not."""
+        store = cls.__new__(cls)
+        store.rolling_days = tuple(rolling_days or cls.ROLLING_DAYS)
+        for name in cls.COLUMNS:
+            setattr(store, name, columns[name])
+        store.n = len(store.timestamp)
+        store.records = records
+        store.ids = None
+        store.product_codes = None
+        store.product_ids = product_ids
+        store.product_names = product_names
+        store.reorders = 0
+        store.windows = {}
+        return store
+
+    @classmethod
+    def restore(cls, records, product_ids, product_names, rolling_days=None, **columns):
+        """Store over copies of stored `COLUMNS` arrays in time order (e.g.
+        from a persisted snapshot), taking further transactions as usual"""
+        store = cls.from_columns(
+            records, list(product_ids), list(product_names), rolling_days,
+            **{name: np.array(columns[name]) for name in cls.COLUMNS}
+        )
+        store.ids = {t.get('_id') for t in records}
+        store.product_codes = {product_id: code for code, product_id in enumerate(store.product_ids)}
+        return store
+
+    @classmethod
+    def attach(cls, replica):
+        """Return the store kept in step with `replica`, building it once"""
+        store = replica.derived.get('transaction_store')
+        if store is None:
+            store = cls(replica.transactions.values())
+            store.rename(replica.products.values())
+            replica.derived['transaction_store'] = store
+            replica.subscribe(store.apply)
+        return store
+
+    def __len__(self):
+        return self.n
+
+    def apply(self, changes):
+        """Replica listener: apply one delta"""
+        if changes.get('transactions'):
+            self.add(changes['transactions'])
+        if changes.get('products'):
+            self.rename(changes['products'])
+
+    def rename(self, products):
+        """Take the current names of `products` that transactions refer to"""
+        for product in products:
+            code = self.product_codes.get(product.get('_id'))
+            if code is not None:
+                self.product_names[code] = product.get('name')
+
+    # -- ingestion --------------------------------------------------------
+
+    def _code(self, product):
+        product_id = product.get('_id')
+        code = self.product_codes.get(product_id)
+        if code is None:
+            code = len(self.product_ids)
+            self.product_codes[product_id] = code
+            self.product_ids.append(product_id)
+            self.product_names.append(product.get('name'))
+        return code
+
+    def _grow(self, needed):
+        capacity = len(self.timestamp)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        for name in self.COLUMNS:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def add(self, transactions):
+        """Add transactions not seen before (ids are deduplicated)"""
+        batch = [t for t in transactions if t.get('_id') not in self.ids]
+        if not batch:
+            return 0
+        for t in batch:
+            self.ids.add(t.get('_id'))
+
+        # Product codes follow first appearance in the input order
+        codes = np.fromiter(
+            (self._code(t['product']) if t.get('product') else -1 for t in batch),
+            dtype=np.int32, count=len(batch)
+        )
+        timestamps = parse_epoch_ms([t.get('transactionDate') for t in batch])
+        order = np.argsort(timestamps, kind='stable')
+        batch = [batch[i] for i in order]
+        timestamps = timestamps[order]
+        codes = codes[order]
+        is_out = np.fromiter((t.get('type') == 'OUT' for t in batch), dtype=bool, count=len(batch))
+        quantity = np.fromiter((t.get('quantity', 0) or 0 for t in batch), dtype=np.int64, count=len(batch))
+
+        start, end = self.n, self.n + len(batch)
+        in_order = self.n == 0 or timestamps[0] >= self.timestamp[self.n - 1]
+        self._grow(end)
+        self.timestamp[start:end] = timestamps
+        self.product[start:end] = codes
+        self.is_out[start:end] = is_out
+        self.quantity[start:end] = quantity
+        self.records.extend(batch)
+        self.n = end
+
+        if in_order:
+            # Appended past every window's left edge: add to each window
+            for days in self.windows:
+                self._accumulate(days, start, end, 1)
+        else:
+            # Late arrivals: restore time order and rebuild the windows
+            order = np.argsort(self.timestamp[:self.n], kind='stable')
+            for name in self.COLUMNS:
+                column = getattr(self, name)
+                column[:self.n] = column[:self.n][order]
+            self.records = [self.records[i] for i in order]
+            self.reorders += 1
+            self.windows = {}
+        return len(batch)
+
+    # -- windows ----------------------------------------------------------
+
+    def window(self, start=None, end=None):
+        """Index range `(lo, hi)` of transactions with start <= date <= end"""
+        ts = self.timestamp[:self.n]
+        lo = 0 if start is None else int(np.searchsorted(ts, to_epoch_ms(start), side='left'))
+        hi = self.n if end is None else int(np.searchsorted(ts, to_epoch_ms(end), side='right'))
+        return lo, max(lo, hi)
+
+    def between(self, start=None, end=None):
+        """Transactions in the window, newest first"""
+        lo, hi = self.window(start, end)
+        return self.records[lo:hi][::-1]
+
+    def recent(self, k, since=None):
+        """The `k` most recent transactions (optionally not older than `since`), newest first"""
+        lo, hi = self.window(since)
+        return self.records[max(lo, hi - k):hi][::-1]
+
+    def count(self, start=None, end=None):
+        lo, hi = self.window(start, end)
+        return hi - lo
+
+    def _totals(self, lo, hi):
+        size = len(self.product_ids)
+        codes = self.product[lo:hi]
+        quantity = self.quantity[lo:hi]
+        is_out = self.is_out[lo:hi] & (codes >= 0)
+        is_in = ~self.is_out[lo:hi] & (codes >= 0)
+        return (
+            np.bincount(codes[is_in], weights=quantity[is_in], minlength=size).astype(np.int64),
+            np.bincount(codes[is_out], weights=quantity[is_out], minlength=size).astype(np.int64),
+        )
+
+    def movement(self, start=None, end=None):
+        """Per-product-code `(in_units, out_units)` over a date range"""
+        return self._totals(*self.window(start, end))
+
+    def _pad(self, window):
+        # New products may have appeared since the window was built
+        size = len(self.product_ids)
+        for i in (1, 2):
+            if len(window[i]) < size:
+                window[i] = np.concatenate([window[i], np.zeros(size - len(window[i]), dtype=np.int64)])
+
+    def _accumulate(self, days, lo, hi, sign):
+        window = self.windows[days]
+        self._pad(window)
+        in_units, out_units = self._totals(lo, hi)
+        window[1][:len(in_units)] += sign * in_units
+        window[2][:len(out_units)] += sign * out_units
+
+    def rolling(self, days, now=None):
+        """Per-product-code `(in_units, out_units)` for the last `days` days.
+
+        Common windows are maintained incrementally; other lengths fall
+        back to a one-off `movement` query.
+        """
+        since = days_ago_ms(days, to_epoch_ms(now))
+        if days not in self.rolling_days:
+            return self.movement(since)
+
+        lo, _ = self.window(since)
+        window = self.windows.get(days)
+        if window is None or lo < window[0]:
+            self.windows[days] = window = [lo, *self._totals(lo, self.n)]
+        elif lo > window[0]:
+            self._accumulate(days, window[0], lo, -1)
+            window[0] = lo
+
+        self._pad(window)
+        return window[1], window[2]
+
+    def all_time(self):
+        """Per-product-code `(in_units, out_units)` over every transaction"""
+        return self._totals(0, self.n)
@@ -0,0 +1,109 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+
+def shared_directory():
+    """Directory for published snapshots: SNAPSHOT_SHARED_DIR, or a fresh one
+    in /dev/shm (memory-backed) when available"""
+    directory = os.getenv("SNAPSHOT_SHARED_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        return directory
+    return tempfile.mkdtemp(prefix='inventory-ai-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+
+def run_owner(directory, backend_client):
+    from snapshot_cache import SnapshotCache
+    from snapshot_store import SnapshotStore
+    from shared_snapshot import SnapshotOwner
+
+    # Forked from the supervisor: drop its handlers, it stops us with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    owner = SnapshotOwner(directory, SnapshotCache(backend_client, store=SnapshotStore.from_env()))
+    asyncio.run(owner.serve())
+
+
+def run_worker(app, sock, config):
+    import uvicorn
+
+    # uvicorn installs its own SIGINT / SIGTERM handlers once serving
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    uvicorn.Server(uvicorn.Config(app, **config)).run(sockets=[sock])
+
+
+class Supervisor:
+    """Serve `app` from `workers` processes sharing one listening socket.
+
+    A separate owner process syncs inventory snapshots with the backend and
+    publishes them to `directory` for the workers (see `SnapshotOwner`).
+    Processes are forked, so each starts from the already imported app;
+    one that dies is restarted. SIGINT / SIGTERM stop them all.
+    """
+
+    RESTART_DELAY = 1.0
+    STOP_TIMEOUT = 10.0
+
+    def __init__(self, app, workers, directory, backend_client, host='0.0.0.0', port=8001, **config):
+        import uvicorn
+
+        self.app = app
+        self.workers = workers
+        self.directory = directory
+        self.backend_client = backend_client
+        self.config = {'host': host, 'port': port, **config}
+        self.socket = uvicorn.Config(app, **self.config).bind_socket()
+        self.context = multiprocessing.get_context('fork')
+        self.owner = None
+        self.processes = []
+        self.stopping = False
+
+    def spawn_owner(self):
+        process = self.context.Process(target=run_owner, args=(self.directory, self.backend_client), name='snapshot-owner')
+        process.start()
+        return process
+
+    def spawn_worker(self, i):
+        process = self.context.Process(target=run_worker, args=(self.app, self.socket, self.config), name=f'worker-{i}')
+        process.start()
+        return process
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        self.owner = self.spawn_owner()
+        self.processes = [self.spawn_worker(i) for i in range(self.workers)]
+        print(f"Serving on {self.config['host']}:{self.config['port']} with {self.workers} workers, "
+              f"snapshots in {self.directory}")
+        try:
+            while not self.stopping:
+                time.sleep(self.RESTART_DELAY)
+                if not self.stopping and not self.owner.is_alive():
+                    print(f"Snapshot owner exited ({self.owner.exitcode}), restarting")
+                    self.owner = self.spawn_owner()
+                for i, process in enumerate(self.processes):
+                    if not self.stopping and not process.is_alive():
+                        print(f"Worker {i} exited ({process.exitcode}), restarting")
+                        self.processes[i] = self.spawn_worker(i)
+        finally:
+            for process in [*self.processes, self.owner]:
+                if process.is_alive():
+                    process.terminate()
+            deadline = time.monotonic() + self.STOP_TIMEOUT
+            for process in [*self.processes, self.owner]:
+                process.join(timeout=max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    print(f"{process.name} did not stop, killing it")
+                    process.kill()
+                    process.join()
+            self.socket.close()
+            shutil.rmtree(self.directory, ignore_errors=True)
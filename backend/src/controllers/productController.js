@@ -1,13 +1,20 @@
 const Product = require('../models/Product');
+const { notifyInventoryChange } = require('../utils/helpers');
 
 // @desc    Get all products
 // @route   GET /api/products
 // @access  Private
 const getProducts = async (req, res) => {
   try {
-    const { category, search, stockStatus } = req.query;
+    const { category, search, stockStatus, updatedSince } = req.query;
     let query = { isActive: true };
 
+    // Delta sync: everything changed since the cursor, including
+    // soft-deleted products so replicas can drop them
+    if (updatedSince) {
+      query = { updatedAt: { $gte: new Date(updatedSince) } };
+    }
+
     // Filter by category
     if (category) {
       query.category = category;
@@ -23,7 +30,7 @@ const getProducts = async (req, res) => {
 
     const products = await Product.find(query)
       .populate('createdBy', 'name email')
-      .sort({ createdAt: -1 });
+      .sort(updatedSince ? { updatedAt: 1 } : { createdAt: -1 });
 
     // Filter by stock status (virtual field)
     let filteredProducts = products;
@@ -79,6 +86,7 @@ const createProduct = async (req, res) => {
     req.body.createdBy = req.user.id;
 
     const product = await Product.create(req.body);
+    notifyInventoryChange();
 
     res.status(201).json({
       success: true,
@@ -110,6 +118,8 @@ const updateProduct = async (req, res) => {
       });
     }
 
+    notifyInventoryChange();
+
     res.status(200).json({
       success: true,
       data: product
@@ -140,6 +150,8 @@ const deleteProduct = async (req, res) => {
       });
     }
 
+    notifyInventoryChange();
+
     res.status(200).json({
       success: true,
       message: 'Product deleted successfully'
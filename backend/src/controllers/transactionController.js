@@ -1,5 +1,6 @@
 const Transaction = require('../models/Transaction');
 const Product = require('../models/Product');
+const { notifyInventoryChange } = require('../utils/helpers');
 
 // @desc    Get all transactions
 // @route   GET /api/transactions
@@ -75,6 +76,7 @@ const createTransaction = async (req, res) => {
       notes,
       performedBy: req.user.id
     });
+    notifyInventoryChange();
 
     const populatedTransaction = await Transaction.findById(transaction._id)
       .populate('product', 'name sku category')
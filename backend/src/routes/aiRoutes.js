@@ -11,7 +11,7 @@ const AI_SERVICE_URL = process.env.AI_SERVICE_URL || 'http://localhost:8001';
 // @access  Private
 const askAI = async (req, res) => {
   try {
-    const { message } = req.body;
+    const { message, conversationHistory, sessionId, session } = req.body;
 
     if (!message || !message.trim()) {
       return res.status(400).json({ 
@@ -23,12 +23,16 @@ const askAI = async (req, res) => {
     // Get user's JWT token
     const token = req.headers.authorization?.split(' ')[1];
 
-    // Forward request to Python AI service
+    // Forward request to Python AI service. Server-side chat sessions are
+    // opt-in: `session: true` starts one, `sessionId` resumes it
     const aiResponse = await axios.post(
       `${AI_SERVICE_URL}/chat`,
       {
         message: message,
-        token: token
+        token: token,
+        conversation_history: Array.isArray(conversationHistory) ? conversationHistory : [],
+        session_id: sessionId || null,
+        session: Boolean(session)
       },
       {
         timeout: 30000 // 30 second timeout
@@ -39,7 +43,8 @@ const askAI = async (req, res) => {
       success: true,
       data: {
         answer: aiResponse.data.answer,
-        metadata: aiResponse.data.data
+        metadata: aiResponse.data.data,
+        sessionId: aiResponse.data.session_id
       }
     });
 
@@ -0,0 +1,23 @@
+const axios = require('axios');
+
+const AI_SERVICE_URL = process.env.AI_SERVICE_URL || 'http://localhost:8001';
+
+// Tell the AI service that inventory data changed so it drops its cached
+// snapshots. Fire-and-forget: a write must never fail because the AI
+// service is down.
+const notifyInventoryChange = () => {
+  axios.post(
+    `${AI_SERVICE_URL}/cache/invalidate`,
+    {},
+    {
+      timeout: 2000,
+      headers: process.env.AI_SERVICE_SECRET
+        ? { 'X-AI-Service-Secret': process.env.AI_SERVICE_SECRET }
+        : {}
+    }
+  ).catch((error) => {
+    console.error('AI cache invalidation failed:', error.message);
+  });
+};
+
+module.exports = { notifyInventoryChange };
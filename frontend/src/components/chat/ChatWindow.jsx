@@ -13,6 +13,8 @@ const ChatWindow = ({ onClose, onNewMessage }) => {
   ]);
   const [input, setInput] = useState('');
   const [loading, setLoading] = useState(false);
+  // Server-side chat session, so later turns reuse the AI service's cached prompt
+  const [sessionId, setSessionId] = useState(null);
   const [isSpeaking, setIsSpeaking] = useState(false);
   const [language, setLanguage] = useState('en-IN');
   const messagesEndRef = useRef(null);
@@ -117,8 +119,11 @@ const ChatWindow = ({ onClose, onNewMessage }) => {
     try {
       const response = await api.post('/ai/ask', {
         message: userMessage,
-        conversation_history: messages.slice(-10)
+        conversationHistory: messages.slice(-10),
+        session: true,
+        sessionId
       });
+      setSessionId(response.data.data.sessionId || null);
 
       const aiMessage = {
         role: 'assistant',
@@ -174,6 +179,7 @@ const ChatWindow = ({ onClose, onNewMessage }) => {
   const clearChat = () => {
     stopSpeaking();
     stopListening();
+    setSessionId(null);
     setMessages([
       {
         role: 'assistant',
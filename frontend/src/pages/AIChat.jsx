@@ -14,6 +14,8 @@ const AIChat = () => {
   ]);
   const [input, setInput] = useState('');
   const [loading, setLoading] = useState(false);
+  // Server-side chat session, so later turns reuse the AI service's cached prompt
+  const [sessionId, setSessionId] = useState(null);
   const messagesEndRef = useRef(null);
 
   const scrollToBottom = () => {
@@ -37,8 +39,12 @@ const AIChat = () => {
     try {
       // Call Node.js backend, which forwards to Python AI service
       const response = await api.post('/ai/ask', {
-        message: userMessage
+        message: userMessage,
+        conversationHistory: messages.slice(-10),
+        session: true,
+        sessionId
       });
+      setSessionId(response.data.data.sessionId || null);
 
       // Add AI response
       setMessages(prev => [...prev, {